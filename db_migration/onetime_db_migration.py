@@ -21,7 +21,6 @@ import logging
 import os
 import pytz
 import re
-import shutil
 import sys
 import uuid
 
@@ -31,6 +30,8 @@ os.environ['DJANGO_SETTINGS_MODULE'] = 'ozp.settings'
 import django
 from django.conf import settings
 
+from ozpcenter import image_processing
+from ozpcenter import media_storage
 from ozpcenter import models
 from ozpcenter import model_access
 from ozpcenter import utils
@@ -488,15 +489,17 @@ def migrate_image(image_uuid, image_type):
         logging.error('Error: no file extension found for image {0!s}'.format(image_uuid))
         return
 
+    # store the file (once for identical files, see ozpcenter.media_storage)
+    with open(filename, 'rb') as f:
+        content_hash, path = media_storage.store(f.read(), file_extension)
+    image_processing.make_variants(path, image_type, file_extension)
+
     # set default security marking
     image_type = models.ImageType.objects.get(name=image_type)
     img = models.Image(uuid=image_uuid, security_marking=DEFAULT_SECURITY_MARKING,
-            file_extension=file_extension, image_type=image_type)
+            file_extension=file_extension, image_type=image_type,
+            content_hash=content_hash)
     img.save()
-
-    src = filename
-    dest = settings.MEDIA_ROOT + str(img.id) + '_' + img.image_type.name + '.' + file_extension
-    shutil.copy(src, dest)
     logging.info('Migrated image: {0!s}, type: {1!s}'.format(image_uuid, image_type))
     return img
 
@@ -202,7 +202,8 @@ REST_FRAMEWORK = {
     )
 }
 
-# NOTE: In production, change this to memcached
+# NOTE: In production, change this to memcached (or locmem / filebased - any
+# backend works with ozpcenter.caching)
 CACHES = {
     'default': {
         'BACKEND': 'django.core.cache.backends.dummy.DummyCache',
@@ -225,6 +226,22 @@ OZP = {
     'USE_AUTH_SERVER': False,
     # convert DNs read as /CN=My Name/OU=Something... to CN=My Name, OU=Something
     'PREPROCESS_DN': True,
+    # cache the counts of the listing/ endpoint until a listing or agency
+    # changes (requires a shared cache backend)
+    'CACHE_LISTING_COUNTS': False,
+    # how image files are sent once access is checked: 'django' (streamed),
+    # 'x-accel-redirect' (nginx) or 'x-sendfile' (Apache, lighttpd). See
+    # ozpcenter.api.image.serving
+    'IMAGE_SERVING': 'django',
+    # internal nginx location that maps to MEDIA_ROOT, for x-accel-redirect
+    'IMAGE_ACCEL_REDIRECT_PREFIX': '/protected-media/',
+    # how long browsers may cache images (they never change)
+    'IMAGE_CACHE_SECONDS': 60 * 60 * 24 * 365,
+    # processes that make the resized variants of uploaded images (0 to make
+    # them in the request's process). See ozpcenter.image_processing
+    'IMAGE_PROCESS_WORKERS': 2,
+    # also make WebP copies of uploaded images (if Pillow supports WebP)
+    'IMAGE_WEBP': False,
     'OZP_AUTHORIZATION': {
         'SERVER_CRT': '/ozp/server.crt',
         'SERVER_KEY': '/ozp/server.key',
@@ -3,8 +3,12 @@ Views
 """
 import logging
 
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition
 from rest_framework import viewsets
 
+from ozpcenter import conditional
+from ozpcenter import models
 from ozpcenter import permissions
 import ozpcenter.api.agency.model_access as model_access
 import ozpcenter.api.agency.serializers as serializers
@@ -60,3 +64,13 @@ class AgencyViewSet(viewsets.ModelViewSet):
     queryset = model_access.get_all_agencies()
     serializer_class = serializers.AgencySerializer
     permission_classes = (permissions.IsAppsMallStewardOrReadOnly,)
+
+    @method_decorator(condition(etag_func=conditional.model_etag(models.Agency),
+        last_modified_func=conditional.model_last_modified(models.Agency)))
+    def list(self, request, *args, **kwargs):
+        return super(AgencyViewSet, self).list(request, *args, **kwargs)
+
+    @method_decorator(condition(etag_func=conditional.model_etag(models.Agency),
+        last_modified_func=conditional.model_last_modified(models.Agency)))
+    def retrieve(self, request, *args, **kwargs):
+        return super(AgencyViewSet, self).retrieve(request, *args, **kwargs)
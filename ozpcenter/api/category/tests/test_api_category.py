@@ -1,10 +1,14 @@
 """
 Tests for category endpoints
 """
+import time
+
+from django.core.cache import cache
 from rest_framework import status
 from rest_framework.test import APITestCase
 
 from ozpcenter import model_access as generic_model_access
+from ozpcenter import models
 from ozpcenter.scripts import sample_data_generator as data_gen
 
 
@@ -45,6 +49,30 @@ class CategoryApiTest(APITestCase):
         self.assertEqual(title, 'Books and Reference')
         self.assertTrue(description is not None)
 
+    def test_not_modified_since(self):
+        user = generic_model_access.get_profile('wsmith').user
+        self.client.force_authenticate(user=user)
+        url = '/api/category/'
+        with self.settings(CACHES={'default': {
+                'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                'LOCATION': 'test_not_modified_since'}}):
+            # not sent within a second of a change
+            models.Category.objects.first().save()
+            response = self.client.get(url, format='json')
+            self.assertFalse(response.has_header('Last-Modified'))
+
+            cache.set('modified:ozpcenter.Category', time.time() - 10, None)
+            response = self.client.get(url, format='json')
+            last_modified = response['Last-Modified']
+            response = self.client.get(url, format='json',
+                HTTP_IF_MODIFIED_SINCE=last_modified)
+            self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+            models.Category.objects.first().save()
+            response = self.client.get(url, format='json',
+                HTTP_IF_MODIFIED_SINCE=last_modified)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+
     def test_create_category(self):
         user = generic_model_access.get_profile('bigbrother').user
         self.client.force_authenticate(user=user)
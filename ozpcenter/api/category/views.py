@@ -3,8 +3,12 @@ Views
 """
 import logging
 
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition
 from rest_framework import viewsets
 
+from ozpcenter import conditional
+from ozpcenter import models
 from ozpcenter import permissions
 import ozpcenter.api.category.model_access as model_access
 import ozpcenter.api.category.serializers as serializers
@@ -61,3 +65,13 @@ class CategoryViewSet(viewsets.ModelViewSet):
     serializer_class = serializers.CategorySerializer
     filter_fields = ('title',)
     permission_classes = (permissions.IsAppsMallStewardOrReadOnly,)
+
+    @method_decorator(condition(etag_func=conditional.model_etag(models.Category),
+        last_modified_func=conditional.model_last_modified(models.Category)))
+    def list(self, request, *args, **kwargs):
+        return super(CategoryViewSet, self).list(request, *args, **kwargs)
+
+    @method_decorator(condition(etag_func=conditional.model_etag(models.Category),
+        last_modified_func=conditional.model_last_modified(models.Category)))
+    def retrieve(self, request, *args, **kwargs):
+        return super(CategoryViewSet, self).retrieve(request, *args, **kwargs)
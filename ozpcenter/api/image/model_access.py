@@ -4,9 +4,11 @@ Image model access
 import logging
 import os
 
-from django.conf import settings
-
+from ozpcenter import image_processing
+from ozpcenter import media_storage
 from ozpcenter import models
+from plugins_util import plugin_manager
+import ozpcenter.model_access as generic_model_access
 
 # Get an instance of a logger
 logger = logging.getLogger('ozp-center.' + str(__name__))
@@ -21,18 +23,79 @@ def get_all_image_types():
     return models.ImageType.objects.all()
 
 
-def get_image_path(pk):
+def get_image_for_user(username, pk):
+    """
+    Get an image (metadata) if the user can see it, else None
+
+    A single lookup by pk, and a single access check of its marking, rather
+    than restricting all images to the user's (get_all_images). The image
+    type is loaded with it (see get_image_path)
+    """
+    try:
+        image = models.Image.objects.select_related('image_type').get(id=pk)
+    except (models.Image.DoesNotExist, ValueError):
+        return None
+    profile = generic_model_access.get_profile(username)
+    if profile is None:
+        return None
+    access_control_instance = plugin_manager.get_system_access_control_plugin()
+    if not access_control_instance.has_access(profile.access_control,
+            image.security_marking):
+        return None
+    return image
+
+
+def get_images_for_user(username, ids):
+    """
+    Get the images (metadata) among ids that the user can see
+
+    One query for all the images, and one access check per distinct
+    marking (see get_image_for_user)
+
+    Returns:
+        [Image, ...] in the order of ids, without repeats
+    """
+    profile = generic_model_access.get_profile(username)
+    if profile is None:
+        return []
+    images = {i.id: i for i in models.Image.objects.select_related(
+        'image_type').filter(id__in=set(ids))}
+    markings = sorted(set(i.security_marking for i in images.values()))
+    access_control_instance = plugin_manager.get_system_access_control_plugin()
+    decisions = dict(zip(markings, plugin_manager.has_access_many(
+        access_control_instance, profile.access_control, markings)))
+
+    result = []
+    for i in ids:
+        image = images.pop(i, None)
+        if image is not None and decisions[image.security_marking]:
+            result.append(image)
+    return result
+
+
+def get_image_path(image, variant=None, file_extension=None):
     """
-    Return absolute file path to an image given its id (pk)
+    Return absolute file path to an image given the Image (or its id)
+
+    For a variant (and/or file_extension webp), the best file that was made
+    is returned (see ozpcenter.image_processing)
     """
-    image = models.Image.objects.get(id=pk)
-    image_path = settings.MEDIA_ROOT + '/' + str(image.id) + '_' + image.image_type.name + '.' + image.file_extension
-    if os.path.isfile(image_path):
-        return image_path
+    if not isinstance(image, models.Image):
+        image = models.Image.objects.select_related('image_type').get(id=image)
+    if image.content_hash:
+        image_path = media_storage.get_path(image.content_hash,
+            image.file_extension)
     else:
-        logger.error('image for pk {0:d} does not exist'.format(pk))
-        # TODO: raise exception
-        return '/does/not/exist'
+        image_path = media_storage.get_legacy_path(image.id,
+            image.image_type.name, image.file_extension)
+    size = image_processing.get_variants(image.image_type).get(variant)
+    for path in image_processing.get_variant_paths(image_path, size,
+            file_extension):
+        if os.path.isfile(path):
+            return path
+    logger.error('image for pk {0:d} does not exist'.format(image.id))
+    # TODO: raise exception
+    return '/does/not/exist'
 
 
 def get_image_by_id(id):
@@ -43,3 +106,68 @@ def get_image_by_id(id):
         return models.Image.objects.get(id=id)
     except models.Image.DoesNotExist:
         return None
+
+
+def sweep_orphaned_files(dry_run=False):
+    """
+    Remove the stored files that no Image refers to (like those of images
+    deleted while the file was in its grace period, or left by a failed
+    upload), and the files of images stored before content addressing that
+    no longer exist
+
+    Files younger than media_storage.GRACE_SECONDS are kept
+
+    Returns:
+        the number of files removed (or that would be, with dry_run)
+    """
+    referenced = set(models.Image.objects.exclude(content_hash=None).values_list(
+        'content_hash', flat=True))
+    count = 0
+    for content_hash in media_storage.iter_hashes():
+        if content_hash in referenced:
+            continue
+        if dry_run:
+            count += len(media_storage.get_files(content_hash))
+        else:
+            count += media_storage.remove(content_hash)
+
+    legacy = set(models.Image.objects.filter(content_hash=None).values_list(
+        'id', 'image_type__name'))
+    for image_id, image_type in media_storage.iter_legacy_images():
+        if (image_id, image_type) in legacy:
+            continue
+        paths = media_storage.get_legacy_files(image_id, image_type)
+        if dry_run:
+            count += len(paths)
+        else:
+            count += media_storage.remove_files(paths)
+    return count
+
+
+def relayout_legacy_images():
+    """
+    Move the files of the images stored before content addressing
+    (<id>_<image type>.<ext>) into the content addressed store, and make
+    their variants
+
+    Returns:
+        the number of images moved
+    """
+    count = 0
+    images = models.Image.objects.filter(content_hash=None).select_related(
+        'image_type')
+    for image in images.iterator():
+        image_type = image.image_type.name
+        path = media_storage.get_legacy_path(image.id, image_type,
+            image.file_extension)
+        if not os.path.isfile(path):
+            logger.error('image for pk {0:d} does not exist'.format(image.id))
+            continue
+        content_hash, path = media_storage.move(path, image.file_extension)
+        image_processing.make_variants(path, image_type, image.file_extension)
+        models.Image.objects.filter(id=image.id).update(content_hash=content_hash)
+        # the old variants
+        for i in media_storage.get_legacy_files(image.id, image_type):
+            os.remove(i)
+        count += 1
+    return count
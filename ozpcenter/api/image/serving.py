@@ -0,0 +1,206 @@
+"""
+Sending image files
+
+Access control is always checked in Django (see ImageViewSet.retrieve), but
+the bytes can be sent in one of three ways, set with OZP['IMAGE_SERVING']:
+    * 'django' (default): the file is streamed from disk in chunks (with
+        support for single Range requests), so a worker never holds a whole
+        file in memory
+    * 'x-accel-redirect': nginx sends the file from an internal location
+        that maps to MEDIA_ROOT (OZP['IMAGE_ACCEL_REDIRECT_PREFIX'])
+    * 'x-sendfile': Apache (mod_xsendfile) or lighttpd sends the file
+
+Images are never changed once written, so responses have a strong ETag and
+may be cached by the browser for a long time (but not by shared caches)
+
+Many images can be sent in one multipart/mixed response (see serve_bundle),
+which is always streamed by Django
+"""
+import logging
+import os
+import re
+import uuid
+
+from django.conf import settings
+from django.http import FileResponse
+from django.http import HttpResponse
+from django.http import HttpResponseNotModified
+from django.http import StreamingHttpResponse
+from django.utils.http import parse_etags
+from django.utils.http import quote_etag
+
+# Get an instance of a logger
+logger = logging.getLogger('ozp-center.' + str(__name__))
+
+CHUNK_SIZE = 64 * 1024
+
+# one year
+DEFAULT_CACHE_SECONDS = 60 * 60 * 24 * 365
+
+RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+def get_etag(image, image_path, stat):
+    """
+    Strong ETag of an image file (without quotes)
+    """
+    return '{0!s}-{1!s}-{2:d}-{3:d}'.format(image.uuid,
+        os.path.basename(image_path), stat.st_size, int(stat.st_mtime))
+
+
+def parse_range(header, size):
+    """
+    Parse a Range header
+
+    Only a single range is supported (multiple ranges would need a
+    multipart/byteranges response)
+
+    Returns:
+        (start, end) - inclusive - if the range is satisfiable
+        None if the header is missing or not supported (send the whole file)
+
+    Raises:
+        ValueError if the range can't be satisfied
+    """
+    match = RANGE_RE.match(header.strip()) if header else None
+    if not match or match.group(1) == match.group(2) == '':
+        return None
+    if size == 0:
+        raise ValueError('Range not satisfiable')
+    start, end = match.groups()
+    if start == '':
+        # the last <end> bytes
+        length = int(end)
+        if length == 0:
+            raise ValueError('Empty suffix range')
+        return max(size - length, 0), size - 1
+    start = int(start)
+    end = min(int(end), size - 1) if end else size - 1
+    if start >= size or start > end:
+        raise ValueError('Range not satisfiable')
+    return start, end
+
+
+def _read_range(f, start, length):
+    try:
+        f.seek(start)
+        while length > 0:
+            data = f.read(min(CHUNK_SIZE, length))
+            if not data:
+                break
+            length -= len(data)
+            yield data
+    finally:
+        f.close()
+
+
+def _stream(request, image_path, size, etag, content_type):
+    try:
+        byte_range = None
+        if_range = request.META.get('HTTP_IF_RANGE')
+        if not if_range or if_range == quote_etag(etag):
+            byte_range = parse_range(request.META.get('HTTP_RANGE'), size)
+    except ValueError:
+        response = HttpResponse(status=416)
+        response['Content-Range'] = 'bytes */{0:d}'.format(size)
+        return response
+
+    f = open(image_path, 'rb')
+    if byte_range is None:
+        response = FileResponse(f, content_type=content_type)
+        response['Content-Length'] = str(size)
+    else:
+        start, end = byte_range
+        response = StreamingHttpResponse(_read_range(f, start, end - start + 1),
+            content_type=content_type, status=206)
+        response['Content-Range'] = 'bytes {0:d}-{1:d}/{2:d}'.format(start,
+            end, size)
+        response['Content-Length'] = str(end - start + 1)
+    response['Accept-Ranges'] = 'bytes'
+    return response
+
+
+def _cache_control():
+    return 'private, max-age={0:d}'.format(
+        settings.OZP.get('IMAGE_CACHE_SECONDS', DEFAULT_CACHE_SECONDS))
+
+
+def _iter_bundle(images, boundary):
+    for image, image_path in images:
+        try:
+            f = open(image_path, 'rb')
+        except (IOError, OSError):
+            logger.error('No image found for pk {0:d}'.format(image.id))
+            continue
+        with f:
+            stat = os.fstat(f.fileno())
+            yield ('--{0!s}\r\n'
+                   'Content-Type: image/{1!s}\r\n'
+                   'Content-Length: {2:d}\r\n'
+                   'Content-ID: <{3:d}>\r\n'
+                   'ETag: {4!s}\r\n'
+                   '\r\n').format(boundary,
+                os.path.splitext(image_path)[1][1:], stat.st_size, image.id,
+                quote_etag(get_etag(image, image_path, stat))).encode('ascii')
+            while True:
+                data = f.read(CHUNK_SIZE)
+                if not data:
+                    break
+                yield data
+        yield b'\r\n'
+    yield '--{0!s}--\r\n'.format(boundary).encode('ascii')
+
+
+def serve_bundle(images):
+    """
+    Make the response that sends many image files as the parts of a
+    multipart/mixed body, once access has been checked
+
+    Each part has the Content-ID <image id>, and the Content-Type,
+    Content-Length, and ETag the image would have on its own. The files are
+    read as the response is sent, one at a time. Files that don't exist are
+    left out
+
+    Args:
+        images: [(Image, path of the file to send), ...]
+    """
+    boundary = uuid.uuid4().hex
+    response = StreamingHttpResponse(_iter_bundle(images, boundary),
+        content_type='multipart/mixed; boundary={0!s}'.format(boundary))
+    response['Cache-Control'] = _cache_control()
+    return response
+
+
+def serve_image(request, image, image_path):
+    """
+    Make the response that sends an image file, once access has been checked
+
+    Raises:
+        OSError (or IOError) if the file doesn't exist
+    """
+    stat = os.stat(image_path)
+    etag = get_etag(image, image_path, stat)
+    # the file may be a variant in another format
+    content_type = 'image/' + os.path.splitext(image_path)[1][1:]
+
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match and (if_none_match.strip() == '*' or
+            etag in parse_etags(if_none_match)):
+        response = HttpResponseNotModified()
+    else:
+        mode = settings.OZP.get('IMAGE_SERVING', 'django')
+        if mode == 'x-accel-redirect':
+            response = HttpResponse(content_type=content_type)
+            response['X-Accel-Redirect'] = '{0!s}{1!s}'.format(
+                settings.OZP.get('IMAGE_ACCEL_REDIRECT_PREFIX', '/protected-media/'),
+                os.path.relpath(image_path, settings.MEDIA_ROOT))
+        elif mode == 'x-sendfile':
+            response = HttpResponse(content_type=content_type)
+            response['X-Sendfile'] = os.path.abspath(image_path)
+        else:
+            response = _stream(request, image_path, stat.st_size, etag,
+                content_type)
+
+    response['ETag'] = quote_etag(etag)
+    response['Cache-Control'] = _cache_control()
+    return response
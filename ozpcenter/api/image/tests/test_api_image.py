@@ -1,11 +1,19 @@
 """
 Tests for image endpoints
 """
+import io
+from unittest.mock import patch
+
+from django.conf import settings
+from PIL import Image
 from rest_framework import status
 from rest_framework.test import APITestCase
 
 from ozpcenter import model_access as generic_model_access
+from ozpcenter import models
+import ozpcenter.api.image.model_access as model_access
 from ozpcenter.scripts import sample_data_generator as data_gen
+from plugins_util import plugin_manager
 
 
 class ImageApiTest(APITestCase):
@@ -37,3 +45,149 @@ class ImageApiTest(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
         self.assertTrue('id' in response.data)
         self.assertTrue('security_marking' in response.data)
+
+    def _get_image(self):
+        user = generic_model_access.get_profile('wsmith').user
+        self.client.force_authenticate(user=user)
+        image = models.Image.objects.filter(security_marking='UNCLASSIFIED').first()
+        with open(model_access.get_image_path(image), 'rb') as f:
+            data = f.read()
+        return '/api/image/{0:d}/'.format(image.id), data
+
+    def test_get_image(self):
+        url, data = self._get_image()
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(b''.join(response.streaming_content), data)
+        self.assertEqual(response['Content-Length'], str(len(data)))
+        self.assertTrue(response['Cache-Control'].startswith('private, max-age='))
+        etag = response['ETag']
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        response = self.client.get(url, HTTP_RANGE='bytes=10-19')
+        self.assertEqual(response.status_code, status.HTTP_206_PARTIAL_CONTENT)
+        self.assertEqual(b''.join(response.streaming_content), data[10:20])
+        self.assertEqual(response['Content-Range'],
+            'bytes 10-19/{0:d}'.format(len(data)))
+        response = self.client.get(url, HTTP_RANGE='bytes=-5')
+        self.assertEqual(b''.join(response.streaming_content), data[-5:])
+        response = self.client.get(url, HTTP_RANGE='bytes={0:d}-'.format(len(data)))
+        self.assertEqual(response.status_code,
+            status.HTTP_416_REQUESTED_RANGE_NOT_SATISFIABLE)
+        # a range of an older version of the file
+        response = self.client.get(url, HTTP_RANGE='bytes=10-19',
+            HTTP_IF_RANGE='"old"')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_get_image_sendfile(self):
+        url, data = self._get_image()
+        with self.settings(OZP=dict(settings.OZP, IMAGE_SERVING='x-accel-redirect')):
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertTrue(response['X-Accel-Redirect'].startswith('/protected-media/'))
+            self.assertEqual(response.content, b'')
+        with self.settings(OZP=dict(settings.OZP, IMAGE_SERVING='x-sendfile')):
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertTrue(response['X-Sendfile'].startswith('/'))
+
+    def _deny_secret(self):
+        # the default plugin lets everyone see everything
+        return patch.object(plugin_manager.get_system_access_control_plugin(),
+            'has_access', side_effect=lambda accesses, marking: marking != 'SECRET')
+
+    def test_get_image_access_control(self):
+        image = models.Image.create_image(
+            Image.open('ozpcenter/scripts/test_images/AirMail16.png'),
+            file_extension='png', security_marking='SECRET',
+            image_type='small_icon')
+        url = '/api/image/{0:d}/'.format(image.id)
+        user = generic_model_access.get_profile('tparsons').user
+        self.client.force_authenticate(user=user)
+        with self._deny_secret():
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+        user = generic_model_access.get_profile('wsmith').user
+        self.client.force_authenticate(user=user)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        response = self.client.get('/api/image/0/')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_get_image_variant(self):
+        user = generic_model_access.get_profile('wsmith').user
+        self.client.force_authenticate(user=user)
+        image = models.Image.objects.filter(security_marking='UNCLASSIFIED',
+            image_type__name='large_banner_icon').first()
+        url = '/api/image/{0:d}/'.format(image.id)
+        original = b''.join(self.client.get(url).streaming_content)
+
+        response = self.client.get(url + '?variant=thumbnail')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        thumbnail = b''.join(response.streaming_content)
+        self.assertTrue(len(thumbnail) < len(original))
+        # how the size is rounded depends on the version of Pillow
+        width, height = Image.open(io.BytesIO(thumbnail)).size
+        self.assertTrue(width <= 220 and height <= 137)
+        self.assertTrue(width >= 219 or height >= 136)
+
+        # the original already fits, so there is no display variant
+        response = self.client.get(url + '?variant=display&format=webp')
+        self.assertEqual(b''.join(response.streaming_content), original)
+        self.assertEqual(response['Content-Type'], 'image/png')
+
+        response = self.client.get(url + '?variant=huge')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_post_image_too_small(self):
+        user = generic_model_access.get_profile('wsmith').user
+        self.client.force_authenticate(user=user)
+        data = io.BytesIO()
+        Image.new('RGB', (8, 8)).save(data, 'PNG')
+        data.seek(0)
+        data.name = 'small.png'
+        response = self.client.post('/api/image/', {
+            'security_marking': 'UNCLASSIFIED',
+            'image_type': 'small_icon',
+            'file_extension': 'png',
+            'image': data
+        }, format='multipart')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_get_image_bundle(self):
+        secret_image = models.Image.create_image(
+            Image.open('ozpcenter/scripts/test_images/AirMail16.png'),
+            file_extension='png', security_marking='SECRET',
+            image_type='small_icon')
+        images = list(models.Image.objects.filter(
+            security_marking='UNCLASSIFIED').order_by('id')[:2])
+        ids = [images[0].id, secret_image.id, images[1].id, images[0].id, 0]
+        url = '/api/image/bundle/?ids=' + ','.join(str(i) for i in ids)
+
+        user = generic_model_access.get_profile('tparsons').user
+        self.client.force_authenticate(user=user)
+        with self._deny_secret():
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        content_type = response['Content-Type']
+        self.assertTrue(content_type.startswith('multipart/mixed; boundary='))
+        boundary = content_type.split('boundary=')[1].encode('ascii')
+        body = b''.join(response.streaming_content)
+        parts = body.split(b'--' + boundary)
+        self.assertEqual(parts[-1], b'--\r\n')
+        parts = parts[1:-1]
+        # the secret image, the repeat, and the missing image are left out
+        self.assertEqual(len(parts), 2)
+        for image, part in zip(images, parts):
+            headers, data = part.split(b'\r\n\r\n', 1)
+            self.assertTrue('Content-ID: <{0:d}>'.format(image.id).encode('ascii')
+                in headers)
+            with open(model_access.get_image_path(image), 'rb') as f:
+                self.assertEqual(data, f.read() + b'\r\n')
+
+        response = self.client.get('/api/image/bundle/?ids=1,a')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
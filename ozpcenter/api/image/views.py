@@ -3,23 +3,26 @@ Views
 """
 import logging
 
-from django.http import HttpResponse
 from django.shortcuts import get_object_or_404
 from rest_framework import status
 from rest_framework import viewsets
+from rest_framework.decorators import list_route
 from rest_framework.parsers import MultiPartParser, JSONParser
 from rest_framework.response import Response
 
+from ozpcenter import image_processing
 from ozpcenter import permissions
-from plugins_util import plugin_manager
 import ozpcenter.api.image.model_access as model_access
+import ozpcenter.api.image.serving as serving
 import ozpcenter.api.image.serializers as serializers
 from ozpcenter import errors
-import ozpcenter.model_access as generic_model_access
 
 # Get an instance of a logger
 logger = logging.getLogger('ozp-center.' + str(__name__))
 
+# the most images in one bundle
+MAX_BUNDLE_SIZE = 500
+
 
 class ImageTypeViewSet(viewsets.ModelViewSet):
     """
@@ -84,6 +87,7 @@ class ImageViewSet(viewsets.ModelViewSet):
     ======
     GET,POST /api/image
     GET, DELETE /api/image/{pk}
+    GET /api/image/bundle/?ids=1,2,3
     """
 
     def get_queryset(self):
@@ -128,6 +132,8 @@ class ImageViewSet(viewsets.ModelViewSet):
 
         except errors.PermissionDenied:
             return Response({'detail': 'Permission Denied'}, status=status.HTTP_403_FORBIDDEN)
+        except errors.InvalidInput as err:
+            return Response({'detail': '{}'.format(err)}, status=status.HTTP_400_BAD_REQUEST)
         except Exception as e:
             raise e
 
@@ -139,29 +145,68 @@ class ImageViewSet(viewsets.ModelViewSet):
 
     def retrieve(self, request, pk=None):
         """
-        Return an image, enforcing access control
+        Return an image, enforcing access control (see serving.serve_image
+        for how the file is sent)
+
+        Query parameters (see ozpcenter.image_processing):
+            variant: a resized variant of the image (e.g. display, thumbnail)
+            format: webp for a WebP copy
         """
-        queryset = self.get_queryset()
-        image = get_object_or_404(queryset, pk=pk)
-        image_path = model_access.get_image_path(pk)
         # enforce access control
-        user = generic_model_access.get_profile(self.request.user.username)
+        image = model_access.get_image_for_user(request.user.username, pk)
+        if image is None:
+            return Response(status=status.HTTP_404_NOT_FOUND)
 
-        access_control_instance = plugin_manager.get_system_access_control_plugin()
-        if not access_control_instance.has_access(user.access_control,
-                image.security_marking):
-            return Response(status=status.HTTP_403_FORBIDDEN)
-        content_type = 'image/' + image.file_extension
+        variant = request.query_params.get('variant')
+        if variant and variant not in image_processing.get_variants(image.image_type):
+            return Response({'detail': 'Invalid variant: {0!s}'.format(variant)},
+                status=status.HTTP_400_BAD_REQUEST)
+        file_extension = request.query_params.get('format')
+        if file_extension and file_extension != image_processing.WEBP:
+            return Response({'detail': 'Invalid format: {0!s}'.format(file_extension)},
+                status=status.HTTP_400_BAD_REQUEST)
         try:
-            with open(image_path, 'rb') as f:
-                return HttpResponse(f.read(), content_type=content_type)
-        except IOError:
-            logger.error('No image found for pk {0:d}'.format(pk))
+            return serving.serve_image(request, image,
+                model_access.get_image_path(image, variant, file_extension))
+        except (IOError, OSError):
+            logger.error('No image found for pk {0!s}'.format(pk))
             return Response(status=status.HTTP_404_NOT_FOUND)
 
+    @list_route(methods=['get'])
+    def bundle(self, request):
+        """
+        Return many images in one multipart/mixed response, enforcing access
+        control once for all of them (see serving.serve_bundle)
+
+        Query parameters:
+            ids: comma separated image ids (at most MAX_BUNDLE_SIZE)
+            variant, format: as for a single image. Images that have no
+                such variant are sent as is
+
+        Images that don't exist or that the user can't see are left out
+        """
+        try:
+            ids = [int(i) for i in request.query_params.get('ids', '').split(',') if i]
+        except ValueError:
+            return Response({'detail': 'Invalid ids'},
+                status=status.HTTP_400_BAD_REQUEST)
+        if len(ids) > MAX_BUNDLE_SIZE:
+            return Response({'detail': 'At most {0:d} ids'.format(MAX_BUNDLE_SIZE)},
+                status=status.HTTP_400_BAD_REQUEST)
+        variant = request.query_params.get('variant')
+        file_extension = request.query_params.get('format')
+        if file_extension and file_extension != image_processing.WEBP:
+            return Response({'detail': 'Invalid format: {0!s}'.format(file_extension)},
+                status=status.HTTP_400_BAD_REQUEST)
+
+        images = model_access.get_images_for_user(request.user.username, ids)
+        return serving.serve_bundle([(i, model_access.get_image_path(i,
+            variant, file_extension)) for i in images])
+
     def destroy(self, request, pk=None):
         queryset = self.get_queryset()
         image = get_object_or_404(queryset, pk=pk)
-        # TODO: remove image from file system
+        # its files are removed with the last image that refers to them (see
+        # ozpcenter.signals)
         image.delete()
         return Response(status=status.HTTP_204_NO_CONTENT)
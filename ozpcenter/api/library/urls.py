@@ -9,7 +9,7 @@ import ozpcenter.api.library.views as views
 # Routers provide an easy way of automatically determining the URL conf.
 router = routers.DefaultRouter()
 
-router.register(r'library', views.LibraryViewSet)
+router.register(r'library', views.LibraryViewSet, base_name='library')
 router.register(r'self/library', views.UserLibraryViewSet,
     base_name='applicationlibraryentry')
 
@@ -62,9 +62,11 @@ class LibraryViewSet(viewsets.ModelViewSet):
     POST, PUT, PATCH, DELETE api/library/<id> - unallowed (for now)
     """
     permission_classes = (permissions.IsOrgSteward,)
-    queryset = model_access.get_all_library_entries()
     serializer_class = serializers.LibrarySerializer
 
+    def get_queryset(self):
+        return model_access.get_all_library_entries()
+
 
 class UserLibraryViewSet(viewsets.ViewSet):
     """
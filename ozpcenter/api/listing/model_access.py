@@ -1,15 +1,23 @@
 """
 Model access
 """
+import collections
+import hashlib
 import logging
 
 from django.core.cache import cache
-from django.core.exceptions import ObjectDoesNotExist
+from django.db import IntegrityError
+from django.db import transaction
+from django.db.models import Count
+from django.db.models import F
 
+from ozpcenter import caching
+from ozpcenter import facets
 from ozpcenter import models
 from ozpcenter import constants
 from ozpcenter import errors
 import ozpcenter.model_access as generic_model_access
+from ozpcenter import ranking
 from ozpcenter import utils
 
 # Get an instance of a logger
@@ -50,6 +58,33 @@ def get_listing_by_title(username, title):
     return models.Listing.objects.for_user(username).get(title=title)
 
 
+def _get_searchable_listings(username):
+    return models.Listing.objects.for_user(username).filter(
+        approval_status=models.Listing.APPROVED).filter(is_enabled=True)
+
+
+def _filter_facets_with_joins(objects, filter_params):
+    """
+    Filter Listings on the facets in filter_params with joins (see
+    filter_listings)
+    """
+    categories = filter_params.get('categories')
+    if categories and filter_params.get('category_logic') == 'and':
+        for category in categories:
+            objects = objects.filter(categories__title=category)
+    elif categories:
+        objects = objects.filter(categories__title__in=categories)
+    if filter_params.get('agencies'):
+        objects = objects.filter(
+            agency__short_name__in=filter_params['agencies'])
+    if filter_params.get('listing_types'):
+        objects = objects.filter(
+            listing_type__title__in=filter_params['listing_types'])
+    if filter_params.get('tags'):
+        objects = objects.filter(tags__name__in=filter_params['tags'])
+    return objects.distinct()
+
+
 def filter_listings(username, filter_params):
     """
     Filter Listings
@@ -58,89 +93,118 @@ def filter_listings(username, filter_params):
     max_classification_level
 
     filter_params can contain:
-        * list of category names (OR logic)
+        * list of category names (OR logic, or AND logic if
+            filter_params['category_logic'] is 'and')
         * list of agencies (OR logic)
         * list of listing types (OR logic)
+        * list of tags (OR logic)
+
+    The facets are matched with the in-memory facet index (see
+    ozpcenter.facets) rather than joins, among the Listings the user can see.
+    If more than caching.MAX_IDS match, they are filtered with joins instead
+    of by id
 
     Too many variations to cache
     """
-    objects = models.Listing.objects.for_user(username).filter(
-        approval_status=models.Listing.APPROVED).filter(is_enabled=True)
-    if 'categories' in filter_params:
-        # TODO: this is OR logic not AND
-        objects = objects.filter(
-            categories__title__in=filter_params['categories'])
-    if 'agencies' in filter_params:
-        objects = objects.filter(
-            agency__short_name__in=filter_params['agencies'])
-    if 'listing_types' in filter_params:
-        objects = objects.filter(
-            listing_type__title__in=filter_params['listing_types'])
+    objects = _get_searchable_listings(username)
+    if any(filter_params.get(facet) for facet in facets.FACETS):
+        candidates = facets.to_bitmap(objects.order_by().values_list('id', flat=True))
+        listing_ids = facets.from_bitmap(facets.get_index().match(filter_params,
+            candidates))
+        if len(listing_ids) > caching.MAX_IDS:
+            objects = _filter_facets_with_joins(objects, filter_params)
+        else:
+            objects = objects.filter(id__in=listing_ids)
 
     objects = objects.order_by('-avg_rate', '-total_reviews')
     return objects
 
 
+def get_facet_counts(username, filter_params, listings=None):
+    """
+    Count the Listings matching filter_params for each facet value (see
+    FacetIndex.get_counts)
+
+    Args:
+        username: user the Listings must be visible to
+        filter_params: see filter_listings
+        listings: Listing queryset to count in (e.g. search results), all
+            the user's searchable Listings if None
+
+    Too many variations to cache
+    """
+    if listings is None:
+        listings = _get_searchable_listings(username)
+    candidates = facets.to_bitmap(listings.order_by().values_list('id', flat=True))
+    return facets.get_index().get_counts(filter_params, candidates)
+
+
+def annotate_bookmarked(listings, username):
+    """
+    Add whether the user bookmarked each Listing (listing.bookmarked) to a
+    query of Listings, as an EXISTS subquery rather than a query per Listing
+
+    Only annotate per-user querysets - not the ones cached for a whole
+    visibility class
+    """
+    profile = generic_model_access.get_profile(username)
+    table = models.ApplicationLibraryEntry._meta.db_table
+    bookmarked = ('EXISTS (SELECT 1 FROM {0!s} WHERE {0!s}.listing_id = '
+                  '{1!s}.id AND {0!s}.owner_id = %s)').format(table,
+        models.Listing._meta.db_table)
+    return listings.extra(select={'bookmarked': bookmarked},
+        select_params=[profile.id if profile else None])
+
+
 def get_self_listings(username):
     """
     Get the Listings that belong to this user
 
-    Key: self_listings:<username>
+    Key: self_listings:<Listing, Profile generations>:<username>
     """
-    username = utils.make_keysafe(username)
-    key = 'self_listings:{0!s}'.format(username)
-    data = cache.get(key)
-    if data is None:
-        try:
-            user = generic_model_access.get_profile(username)
-            data = models.Listing.objects.for_user(username).filter(
-                owners__in=[user.id]).filter(is_deleted=False)
-            cache.set(key, data)
-            return data
-        except ObjectDoesNotExist:
-            return None
-    else:
-        return data
+    user = generic_model_access.get_profile(username)
+    if user is None:
+        return None
+    listings = models.Listing.objects.for_user(username).filter(
+        owners__in=[user.id]).filter(is_deleted=False)
+    return caching.cached_queryset('self_listings', [username],
+        [models.Listing, models.Profile], listings)
 
 
 def get_listings(username):
     """
     Get Listings this user can see
 
-    Key: listings:<username>
+    Shared by all users in the same visibility class
+
+    Key: listings:<Listing generation>:<visibility_class>
     """
-    username = utils.make_keysafe(username)
-    key = 'listings:{0!s}'.format(username)
-    data = cache.get(key)
-    if data is None:
-        try:
-            data = models.Listing.objects.for_user(username).all()
-            cache.set(key, data)
-            return data
-        except ObjectDoesNotExist:
-            return None
-    else:
-        return data
+    user = generic_model_access.get_profile(username)
+    if user is None:
+        return None
+    listings = models.Listing.objects.for_user(username).all()
+    if not user.visibility_class:
+        return listings
+    return caching.cached_queryset('listings', [user.visibility_class],
+        [models.Listing], listings)
 
 
 def get_reviews(username):
     """
     Get Reviews this user can see
 
-    Key: reviews:<username>
+    Shared by all users in the same visibility class
+
+    Key: reviews:<Review, Listing generations>:<visibility_class>
     """
-    username = utils.make_keysafe(username)
-    key = 'reviews:{0!s}'.format(username)
-    data = cache.get(key)
-    if data is None:
-        try:
-            data = models.Review.objects.for_user(username).all()
-            cache.set(key, data)
-            return data
-        except ObjectDoesNotExist:
-            return None
-    else:
-        return data
+    user = generic_model_access.get_profile(username)
+    if user is None:
+        return None
+    reviews = models.Review.objects.for_user(username).all()
+    if not user.visibility_class:
+        return reviews
+    return caching.cached_queryset('reviews', [user.visibility_class],
+        [models.Review, models.Listing], reviews)
 
 
 def get_review_by_id(id):
@@ -175,40 +239,129 @@ def get_all_screenshots():
     return models.Screenshot.objects.all()
 
 
-def _update_rating(username, listing):
+RATING_FIELDS = ['total_rate1', 'total_rate2', 'total_rate3', 'total_rate4',
+    'total_rate5', 'total_votes', 'total_reviews']
+
+
+def _get_avg_rate(counts):
+    """
+    Get the weighted average rating from a dict of RATING_FIELDS
+    """
+    if not counts['total_votes']:
+        return 0.0
+    avg_rate = sum(rate * counts['total_rate{0:d}'.format(rate)]
+        for rate in range(1, 6)) / counts['total_votes']
+    return float('{0:.1f}'.format(avg_rate))
+
+
+def _lock_rating(listing):
+    """
+    Lock a listing's row and load its current rating counters, so that a
+    following listing.save() doesn't overwrite concurrent rating changes
+
+    Must be called inside a transaction
+    """
+    counts = models.Listing.objects.select_for_update().filter(
+        id=listing.id).values(*RATING_FIELDS).get()
+    for field, value in counts.items():
+        setattr(listing, field, value)
+    return listing
+
+
+def _update_rating(listing, old_review=None, new_review=None):
     """
     Invoked each time a review is created, deleted, or updated
+
+    The rating counters are changed by the difference between the old and new
+    versions of the review with a single atomic UPDATE, and avg_rate is
+    derived from the result (in the same transaction, while the row is still
+    locked)
+
+    Args:
+        listing (models.Listing): listing the review is for
+        old_review: (rate, text) of the review before the change, or None if
+            it was created
+        new_review: (rate, text) of the review after the change, or None if
+            it was deleted
     """
-    reviews = models.Review.objects.filter(listing=listing)
-    rate1 = reviews.filter(rate=1).count()
-    rate2 = reviews.filter(rate=2).count()
-    rate3 = reviews.filter(rate=3).count()
-    rate4 = reviews.filter(rate=4).count()
-    rate5 = reviews.filter(rate=5).count()
-    total_votes = reviews.count()
-    total_reviews = total_votes - reviews.filter(text=None).count()
-
-    # calculate weighted average
-    if total_votes == 0:
-        avg_rate = 0
-    else:
-        avg_rate = (5 * rate5 + 4 * rate4 + 3 * rate3 + 2 * rate2 + rate1) / total_votes
-        avg_rate = float('{0:.1f}'.format(avg_rate))
-
-    # update listing
-    listing.total_rate1 = rate1
-    listing.total_rate2 = rate2
-    listing.total_rate3 = rate3
-    listing.total_rate4 = rate4
-    listing.total_rate5 = rate5
-    listing.total_votes = total_votes
-    listing.total_reviews = total_reviews
+    deltas = collections.Counter()
+    for review, sign in [(old_review, -1), (new_review, 1)]:
+        if review is None:
+            continue
+        rate, text = review
+        deltas['total_rate{0:d}'.format(rate)] += sign
+        deltas['total_votes'] += sign
+        if text is not None:
+            deltas['total_reviews'] += sign
+
+    edited_date = utils.get_now_utc()
+    with transaction.atomic():
+        listings = models.Listing.objects.filter(id=listing.id)
+        listings.update(edited_date=edited_date,
+            **{field: F(field) + delta for field, delta in deltas.items() if delta})
+        counts = listings.values(*RATING_FIELDS).get()
+        avg_rate = _get_avg_rate(counts)
+        popularity_score = ranking.get_score(counts, ranking.get_stored_mean())
+        listings.update(avg_rate=avg_rate, popularity_score=popularity_score)
+    # the Listing isn't saved, so its post_save handlers don't run
+    generic_model_access.bump_catalog_version()
+
+    for field, value in counts.items():
+        setattr(listing, field, value)
     listing.avg_rate = avg_rate
-    listing.edited_date = utils.get_now_utc()
-    listing.save()
+    listing.popularity_score = popularity_score
+    listing.edited_date = edited_date
     return listing
 
 
+def recompute_ratings():
+    """
+    Recompute the rating counters of all listings from their reviews (and
+    their popularity scores)
+
+    Returns:
+        the number of listings whose rating changed
+    """
+    counts = collections.defaultdict(lambda: dict.fromkeys(RATING_FIELDS, 0))
+    groups = models.Review.objects.order_by().values('listing_id', 'rate').annotate(
+        votes=Count('id'), reviews=Count('text'))
+    for group in groups:
+        listing_counts = counts[group['listing_id']]
+        listing_counts['total_rate{0:d}'.format(group['rate'])] += group['votes']
+        listing_counts['total_votes'] += group['votes']
+        listing_counts['total_reviews'] += group['reviews']
+
+    changed = 0
+    with transaction.atomic():
+        for listing in models.Listing.objects.order_by().values('id', 'avg_rate',
+                *RATING_FIELDS):
+            listing_counts = counts[listing['id']]
+            avg_rate = _get_avg_rate(listing_counts)
+            if (avg_rate == listing['avg_rate'] and
+                    all(listing[i] == listing_counts[i] for i in RATING_FIELDS)):
+                continue
+            models.Listing.objects.filter(id=listing['id']).update(
+                avg_rate=avg_rate, **listing_counts)
+            changed += 1
+    if changed:
+        refresh_popularity()
+    return changed
+
+
+def refresh_popularity():
+    """
+    Recompute the popularity scores of all listings (see ozpcenter.ranking)
+
+    Returns:
+        the number of listings whose score changed
+    """
+    changed = ranking.refresh()
+    if changed:
+        # the Listings aren't saved, so their post_save handlers don't run
+        generic_model_access.bump_catalog_version()
+    return changed
+
+
 def get_rejection_listings(username):
     activities = models.ListingActivity.objects.for_user(username).filter(
         action=models.ListingActivity.REJECTED)
@@ -216,10 +369,15 @@ def get_rejection_listings(username):
 
 
 def _add_listing_activity(author, listing, action, change_details=None,
-                          description=None):
+                          description=None, listing_updates=None):
     """
     Adds a ListingActivity
 
+    The activity, its change details, and the listing are written in a single
+    transaction with a constant number of queries: the ChangeDetails and
+    their links to the activity are inserted in bulk, and the listing is saved
+    once (with listing_updates applied)
+
     Args:
         author (models.Profile): author of the change
         listing (models.Listing): listing being affected
@@ -235,6 +393,9 @@ def _add_listing_activity(author, listing, action, change_details=None,
                 ...
                 }
             ]
+        description (Optional(str)): description of the activity
+        listing_updates (Optional(dict)): other fields of the listing to set
+            (like approval_status)
 
     Returns:
         models.Listing: The listing being affected
@@ -243,22 +404,29 @@ def _add_listing_activity(author, listing, action, change_details=None,
         None
 
     """
-    listing_activity = models.ListingActivity(action=action,
-        author=author, listing=listing, description=description)
-    listing_activity.save()
-    if change_details:
-        for i in change_details:
-            change = models.ChangeDetail(field_name=i['field_name'],
-                old_value=i['old_value'], new_value=i['new_value'])
-            change.save()
-            listing_activity.change_details.add(change)
-
-    # update the listing
-    listing.last_activity = listing_activity
-    if listing_activity.action == models.ListingActivity.REJECTED:
-        listing.current_rejection = listing_activity
-    listing.edited_date = utils.get_now_utc()
-    listing.save()
+    with transaction.atomic():
+        listing_activity = models.ListingActivity(action=action,
+            author=author, listing=listing, description=description)
+        listing_activity.save()
+        if change_details:
+            changes = generic_model_access.bulk_create_with_ids(
+                models.ChangeDetail,
+                [models.ChangeDetail(field_name=i['field_name'],
+                    old_value=i['old_value'], new_value=i['new_value'])
+                 for i in change_details])
+            ChangeDetailLink = models.ListingActivity.change_details.through
+            ChangeDetailLink.objects.bulk_create(
+                [ChangeDetailLink(listingactivity_id=listing_activity.id,
+                    changedetail_id=change.id) for change in changes])
+
+        # update the listing
+        listing.last_activity = listing_activity
+        if listing_activity.action == models.ListingActivity.REJECTED:
+            listing.current_rejection = listing_activity
+        for field, value in (listing_updates or {}).items():
+            setattr(listing, field, value)
+        listing.edited_date = utils.get_now_utc()
+        listing.save()
     return listing
 
 
@@ -266,10 +434,8 @@ def create_listing(author, listing):
     """
     Create a listing
     """
-    listing = _add_listing_activity(author, listing, models.ListingActivity.CREATED)
-    listing.approval_status = models.Listing.IN_PROGRESS
-    listing.save()
-    return listing
+    return _add_listing_activity(author, listing, models.ListingActivity.CREATED,
+        listing_updates={'approval_status': models.Listing.IN_PROGRESS})
 
 
 def log_listing_modification(author, listing, change_details):
@@ -286,70 +452,69 @@ def submit_listing(author, listing):
     Submit a listing for approval
     """
     # TODO: check that all required fields are set
-    listing = _add_listing_activity(author, listing, models.ListingActivity.SUBMITTED)
-    listing.approval_status = models.Listing.PENDING
-    listing.edited_date = utils.get_now_utc()
-    listing.save()
-    return listing
+    return _add_listing_activity(author, listing, models.ListingActivity.SUBMITTED,
+        listing_updates={'approval_status': models.Listing.PENDING})
 
 
 def approve_listing_by_org_steward(org_steward, listing):
     """
     Give Org Steward approval to a listing
     """
-    listing = _add_listing_activity(org_steward, listing,
-        models.ListingActivity.APPROVED_ORG)
-    listing.approval_status = models.Listing.APPROVED_ORG
-    listing.edited_date = utils.get_now_utc()
-    listing.save()
-    return listing
+    return _add_listing_activity(org_steward, listing,
+        models.ListingActivity.APPROVED_ORG,
+        listing_updates={'approval_status': models.Listing.APPROVED_ORG})
 
 
 def approve_listing(steward, listing):
     """
     Give final approval to a listing
     """
-    listing = _add_listing_activity(steward, listing,
-        models.ListingActivity.APPROVED)
-    listing.approval_status = models.Listing.APPROVED
-    listing.approved_date = utils.get_now_utc()
-    listing.edited_date = utils.get_now_utc()
-    listing.save()
-    return listing
+    return _add_listing_activity(steward, listing,
+        models.ListingActivity.APPROVED,
+        listing_updates={'approval_status': models.Listing.APPROVED,
+                         'approved_date': utils.get_now_utc()})
 
 
 def reject_listing(steward, listing, rejection_description):
     """
     Reject a submitted listing
     """
-    listing = _add_listing_activity(steward, listing,
-        models.ListingActivity.REJECTED, description=rejection_description)
-    listing.approval_status = models.Listing.REJECTED
-    listing.edited_date = utils.get_now_utc()
-    listing.save()
-    return listing
+    return _add_listing_activity(steward, listing,
+        models.ListingActivity.REJECTED, description=rejection_description,
+        listing_updates={'approval_status': models.Listing.REJECTED})
 
 
 def enable_listing(user, listing):
     """
     Enable a listing
     """
-    listing = _add_listing_activity(user, listing, models.ListingActivity.ENABLED)
-    listing.is_enabled = True
-    listing.edited_date = utils.get_now_utc()
-    listing.save()
-    return listing
+    return _add_listing_activity(user, listing, models.ListingActivity.ENABLED,
+        listing_updates={'is_enabled': True})
 
 
 def disable_listing(steward, listing):
     """
     Disable a listing
     """
-    listing = _add_listing_activity(steward, listing, models.ListingActivity.DISABLED)
-    listing.is_enabled = False
-    listing.edited_date = utils.get_now_utc()
-    listing.save()
-    return listing
+    return _add_listing_activity(steward, listing, models.ListingActivity.DISABLED,
+        listing_updates={'is_enabled': False})
+
+
+def _validate_rate(rate):
+    """
+    Get a review's rating as an int
+
+    Raises:
+        errors.InvalidInput if it isn't a whole number from 1 to 5
+    """
+    try:
+        valid_rate = int(rate)
+    except (TypeError, ValueError):
+        valid_rate = None
+    # int() would truncate 4.5
+    if valid_rate not in range(1, 6) or float(rate) != valid_rate:
+        raise errors.InvalidInput('rate must be a whole number from 1 to 5')
+    return valid_rate
 
 
 def create_listing_review(username, listing, rating, text=None):
@@ -368,13 +533,18 @@ def create_listing_review(username, listing, rating, text=None):
             "listing": listing.id,
             "id": review.id
         }
+
+    Raises:
+        errors.InvalidInput if rating isn't from 1 to 5
     """
+    rating = _validate_rate(rating)
     author = generic_model_access.get_profile(username)
     review = models.Review(listing=listing, author=author,
                 rate=rating, text=text)
-    review.save()
-    # update this listing's rating
-    _update_rating(username, listing)
+    with transaction.atomic():
+        review.save()
+        # update this listing's rating
+        _update_rating(listing, new_review=(rating, text))
 
     resp = {
         "rate": rating,
@@ -398,11 +568,15 @@ def edit_listing_review(username, review, rate, text=None):
 
     Returns:
         The modified review
+
+    Raises:
+        errors.InvalidInput if rate isn't from 1 to 5
     """
     # only the author of a review can edit it
     user = generic_model_access.get_profile(username)
     if review.author.user.username != username:
         raise errors.PermissionDenied()
+    rate = _validate_rate(rate)
 
     change_details = [
         {
@@ -417,16 +591,18 @@ def edit_listing_review(username, review, rate, text=None):
         }
     ]
 
-    listing = review.listing
-    listing = _add_listing_activity(user, listing, models.ListingActivity.REVIEW_EDITED,
-        change_details=change_details)
+    old_review = (review.rate, review.text)
+    with transaction.atomic():
+        listing = _lock_rating(review.listing)
+        listing = _add_listing_activity(user, listing, models.ListingActivity.REVIEW_EDITED,
+            change_details=change_details)
 
-    review.rate = rate
-    review.text = text
-    review.edited_date = utils.get_now_utc()
-    review.save()
+        review.rate = rate
+        review.text = text
+        review.edited_date = utils.get_now_utc()
+        review.save()
 
-    _update_rating(username, listing)
+        _update_rating(listing, old_review=old_review, new_review=(rate, text))
     return review
 
 
@@ -463,14 +639,16 @@ def delete_listing_review(username, review):
         }
     ]
     # add this action to the log
-    listing = review.listing
-    listing = _add_listing_activity(review.author, listing,
-        models.ListingActivity.REVIEW_DELETED, change_details=change_details)
-
-    # delete the review
-    review.delete()
-    # update this listing's rating
-    _update_rating(username, listing)
+    old_review = (review.rate, review.text)
+    with transaction.atomic():
+        listing = _lock_rating(review.listing)
+        listing = _add_listing_activity(review.author, listing,
+            models.ListingActivity.REVIEW_DELETED, change_details=change_details)
+
+        # delete the review
+        review.delete()
+        # update this listing's rating
+        _update_rating(listing, old_review=old_review)
     return listing
 
 
@@ -493,23 +671,25 @@ def delete_listing(username, listing):
     if listing.is_deleted:
         raise errors.PermissionDenied('The listing has already been deleted')
 
-    listing = _add_listing_activity(user, listing, models.ListingActivity.DELETED)
-    listing.is_deleted = True
-    listing.is_enabled = False
-    listing.approval_status = models.Listing.DELETED
-
     # TODO Delete the values of other field
     # Keep lisiting as shell listing for history
-    listing.save()
+    listing = _add_listing_activity(user, listing, models.ListingActivity.DELETED,
+        listing_updates={'is_deleted': True, 'is_enabled': False,
+                         'approval_status': models.Listing.DELETED})
     # listing.delete()
 
 
-def put_counts_in_listings_endpoint(queryset):
+def put_counts_in_listings_endpoint(queryset, cache_key=None):
     """
     Add counts to the listing/ endpoint
 
+    All counts come from a single query grouped by agency, approval status,
+    and enabled flag
+
     Args:
         querset: models.Listing queryset
+        cache_key: if given, cache the counts under this key (which must
+            identify the queryset) until the catalog changes
     Returns:
         {
             "total": <total listings>,
@@ -525,33 +705,39 @@ def put_counts_in_listings_endpoint(queryset):
             "APPROVED": <num>,
             "DELETED": <num>
         }
+
+    Key: listing_counts:<catalog_version>:<cache_key hash>
     """
-    data = {"total": queryset.count(), "organizations": {}}
-    num_enabled = queryset.filter(is_enabled=True).count()
-    num_in_progress = queryset.filter(
-        approval_status=models.Listing.IN_PROGRESS).count()
-    num_pending = queryset.filter(
-        approval_status=models.Listing.PENDING).count()
-    num_rejected = queryset.filter(
-        approval_status=models.Listing.REJECTED).count()
-    num_approved_org = queryset.filter(
-        approval_status=models.Listing.APPROVED_ORG).count()
-    num_approved = queryset.filter(
-        approval_status=models.Listing.APPROVED).count()
-    num_deleted = queryset.filter(
-        approval_status=models.Listing.DELETED).count()
-    data['enabled'] = num_enabled
-    data[models.Listing.IN_PROGRESS] = num_in_progress
-    data[models.Listing.PENDING] = num_pending
-    data[models.Listing.REJECTED] = num_rejected
-    data[models.Listing.APPROVED_ORG] = num_approved_org
-    data[models.Listing.APPROVED] = num_approved
-    data[models.Listing.DELETED] = num_deleted
-
-    orgs = models.Agency.objects.all()
-    for i in orgs:
-        data['organizations'][str(i.id)] = queryset.filter(
-            agency__id=i.id).count()
+    if cache_key is not None:
+        key = 'listing_counts:{0!s}:{1!s}'.format(
+            generic_model_access.get_catalog_version(),
+            hashlib.md5(cache_key.encode('utf-8')).hexdigest())
+        data = cache.get(key)
+        if data is not None:
+            return data
+
+    data = {"total": 0, "organizations": {}, "enabled": 0}
+    for approval_status, _ in models.Listing.APPROVAL_STATUS_CHOICES:
+        data[approval_status] = 0
+    for agency_id in models.Agency.objects.values_list('id', flat=True):
+        data['organizations'][str(agency_id)] = 0
+
+    groups = queryset.order_by().values('agency_id', 'approval_status',
+        'is_enabled').annotate(count=Count('id'))
+    for group in groups:
+        count = group['count']
+        data['total'] += count
+        if group['is_enabled']:
+            data['enabled'] += count
+        if group['approval_status'] in data:
+            data[group['approval_status']] += count
+        if group['agency_id'] is not None:
+            agency_id = str(group['agency_id'])
+            data['organizations'][agency_id] = data['organizations'].get(
+                agency_id, 0) + count
+
+    if cache_key is not None:
+        cache.set(key, data)
     return data
 
 
@@ -703,3 +889,153 @@ def owners_to_string(owners, queryset=False):
 
 def bool_to_string(var):
     return str(var).lower()
+
+
+def reconcile_m2m(manager, old_objects, new_objects):
+    """
+    Make a many-to-many relation contain exactly new_objects
+
+    Only the difference is written: the added objects are linked with one
+    bulk insert into the through table and the removed ones are unlinked
+    with one delete (m2m_changed is still sent for both)
+
+    Args:
+        manager: the relation's manager (like listing.categories)
+        old_objects: the objects currently in the relation (loaded once by
+            the caller)
+        new_objects: the objects the relation should contain
+    """
+    old_ids = {i.pk for i in old_objects}
+    new_ids = {i.pk for i in new_objects if i is not None}
+    removed_ids = old_ids - new_ids
+    added_ids = new_ids - old_ids
+    if removed_ids:
+        manager.remove(*removed_ids)
+    if added_ids:
+        manager.add(*added_ids)
+
+
+def get_or_create_tags(names):
+    """
+    Get the Tags with the given names, creating the missing ones in bulk
+
+    Returns:
+        [models.Tag] in the order of names (without duplicates)
+    """
+    names = list(collections.OrderedDict.fromkeys(names))
+    tags = {i.name: i for i in models.Tag.objects.filter(name__in=names)}
+    missing = [i for i in names if i not in tags]
+    if missing:
+        try:
+            with transaction.atomic():
+                models.Tag.objects.bulk_create(
+                    [models.Tag(name=i) for i in missing])
+        except IntegrityError:
+            # some were created concurrently
+            pass
+        tags.update({i.name: i for i in models.Tag.objects.filter(
+            name__in=missing)})
+    return [tags[i] for i in names]
+
+
+def _contact_key(contact):
+    return (contact.name, contact.email, contact.secure_phone,
+            contact.unsecure_phone, contact.organization, contact.contact_type_id)
+
+
+def get_or_create_contacts(contacts):
+    """
+    Get the Contacts matching all fields of the given contacts, creating the
+    missing ones in bulk
+
+    Args:
+        contacts: [{"name": ..., "email": ..., "secure_phone": ...,
+            "unsecure_phone": ..., "organization": ...,
+            "contact_type": {"name": ...}}, ...]
+    Returns:
+        [models.Contact] in the order of contacts (without duplicates)
+    """
+    contact_types = {i.name: i for i in models.ContactType.objects.filter(
+        name__in=[i['contact_type']['name'] for i in contacts])}
+    wanted = collections.OrderedDict()
+    for contact in contacts:
+        contact_type = contact_types.get(contact['contact_type']['name'])
+        if contact_type is None:
+            raise errors.InvalidInput('Invalid contact type: {0!s}'.format(
+                contact['contact_type']['name']))
+        new_contact = models.Contact(name=contact['name'],
+            email=contact['email'], secure_phone=contact['secure_phone'],
+            unsecure_phone=contact['unsecure_phone'],
+            organization=contact.get('organization', None),
+            contact_type=contact_type)
+        wanted.setdefault(_contact_key(new_contact), new_contact)
+
+    existing = {}
+    for contact in models.Contact.objects.filter(
+            name__in=[i[0] for i in wanted], email__in=[i[1] for i in wanted]):
+        existing.setdefault(_contact_key(contact), contact)
+    missing = [contact for key, contact in wanted.items() if key not in existing]
+    generic_model_access.bulk_create_with_ids(models.Contact, missing)
+    return [existing.get(key, contact) for key, contact in wanted.items()]
+
+
+def reconcile_doc_urls(listing, old_doc_urls, new_doc_urls):
+    """
+    Make a listing's DocUrls match new_doc_urls, creating and deleting only
+    the ones that differ (in bulk)
+
+    Args:
+        old_doc_urls: [models.DocUrl] currently on the listing
+        new_doc_urls: [{"name": "wiki", "url": "http://www.wiki.com"}, ...]
+    """
+    old_keys = {(i.name, i.url): i for i in old_doc_urls}
+    new_keys = collections.OrderedDict.fromkeys(
+        (i['name'], i['url']) for i in new_doc_urls)
+    stale_ids = [doc_url.id for key, doc_url in old_keys.items()
+                 if key not in new_keys]
+    if stale_ids:
+        logger.info('Deleting doc_urls: {0!s}'.format(stale_ids))
+        models.DocUrl.objects.filter(id__in=stale_ids).delete()
+    models.DocUrl.objects.bulk_create(
+        [models.DocUrl(name=name, url=url, listing=listing)
+         for name, url in new_keys if (name, url) not in old_keys])
+
+
+def reconcile_screenshots(listing, old_screenshots, new_screenshots):
+    """
+    Make a listing's Screenshots match new_screenshots, creating and deleting
+    only the ones that differ (in bulk), and update the security markings of
+    their images
+
+    Args:
+        old_screenshots: [models.Screenshot] currently on the listing
+        new_screenshots: [{"small_image": {"id": 1, "security_marking": ...},
+            "large_image": {"id": 2, "security_marking": ...}}, ...]
+    """
+    markings = {}
+    for screenshot in new_screenshots:
+        for image_key in ['small_image', 'large_image']:
+            image = screenshot[image_key]
+            markings[int(image['id'])] = image['security_marking']
+    images = models.Image.objects.in_bulk(list(markings))
+    if len(images) != len(markings):
+        raise errors.InvalidInput('Error while saving, can not find image by id')
+    for image_id, image in images.items():
+        if image.security_marking != markings[image_id]:
+            image.security_marking = markings[image_id]
+            image.save()
+
+    old_keys = {(i.small_image_id, i.large_image_id): i for i in old_screenshots}
+    new_keys = collections.OrderedDict.fromkeys(
+        (int(i['small_image']['id']), int(i['large_image']['id']))
+        for i in new_screenshots)
+    stale_ids = [screenshot.id for key, screenshot in old_keys.items()
+                 if key not in new_keys]
+    if stale_ids:
+        logger.info('Deleting screenshots: {0!s}'.format(stale_ids))
+        models.Screenshot.objects.filter(id__in=stale_ids).delete()
+    models.Screenshot.objects.bulk_create(
+        [models.Screenshot(small_image_id=small_image_id,
+            large_image_id=large_image_id, listing=listing)
+         for small_image_id, large_image_id in new_keys
+         if (small_image_id, large_image_id) not in old_keys])
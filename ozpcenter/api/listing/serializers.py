@@ -7,6 +7,7 @@ import pytz
 
 from rest_framework import serializers
 from django.contrib import auth
+from django.db.models import Prefetch
 
 from ozpcenter import constants
 from ozpcenter import models
@@ -213,11 +214,20 @@ class CreateListingProfileSerializer(serializers.ModelSerializer):
 
 class ListingIsBookmarked(serializers.ReadOnlyField):
     """
-    Read Only Field to see if a listing is bookmarked
+    Read Only Field to see if the requesting user bookmarked a listing
+
+    Uses the bookmarked annotation of listings loaded with
+    ListingSerializer.setup_eager_loading(queryset, username) when there is
+    one, and a query otherwise
     """
 
-    def to_native(self, obj):
-        return obj
+    def get_attribute(self, instance):
+        bookmarked = getattr(instance, 'bookmarked', None)
+        if bookmarked is None:
+            request = self.context.get('request')
+            username = request.user.username if request else None
+            bookmarked = instance.is_bookmarked(username)
+        return bool(bookmarked)
 
 
 class ListingSerializer(serializers.ModelSerializer):
@@ -244,6 +254,41 @@ class ListingSerializer(serializers.ModelSerializer):
         model = models.Listing
         depth = 2
 
+    @staticmethod
+    def setup_eager_loading(queryset, username=None):
+        """
+        Load every relation this serializer renders up front, so that
+        serializing a page of listings takes a constant number of queries
+
+        Only use for reads - prefetched relations aren't refreshed when an
+        update changes them
+
+        Args:
+            username: the requesting user, whose bookmarks are loaded with
+                the listings (otherwise they take a query per listing)
+        """
+        if username is not None:
+            queryset = model_access.annotate_bookmarked(queryset, username)
+
+        # select_related foreign keys (including nested ones)
+        queryset = queryset.select_related(
+            'agency', 'listing_type', 'required_listings',
+            'small_icon', 'large_icon', 'banner_icon', 'large_banner_icon',
+            'last_activity__author__user', 'last_activity__listing__agency',
+            'current_rejection__author__user')
+
+        # prefetch_related many-to-many relationships and reverse foreign
+        # keys, along with their own foreign keys
+        queryset = queryset.prefetch_related(
+            Prefetch('screenshots', queryset=models.Screenshot.objects.select_related(
+                'small_image', 'large_image')),
+            Prefetch('owners', queryset=models.Profile.objects.select_related('user')),
+            Prefetch('contacts', queryset=models.Contact.objects.select_related(
+                'contact_type')),
+            Prefetch('intents', queryset=models.Intent.objects.select_related('icon')),
+            'doc_urls', 'categories', 'tags', 'last_activity__change_details')
+        return queryset
+
     def validate(self, data):
         access_control_instance = plugin_manager.get_system_access_control_plugin()
         # logger.debug('inside ListingSerializer.validate', extra={'request':self.context.get('request')})
@@ -641,8 +686,12 @@ class ListingSerializer(serializers.ModelSerializer):
                     elif image_key == 'large_banner_icon':
                         instance.large_banner_icon = new_value_image
 
+        # the relations are reconciled with the current rows, loaded once:
+        # only the differences are written (in bulk), and the change details
+        # are made from the same rows
         if 'contacts' in validated_data:
-            old_contact_instances = instance.contacts.all()
+            old_contact_instances = list(instance.contacts.select_related(
+                'contact_type'))
             old_contacts = model_access.contacts_to_string(
                 old_contact_instances, True)
             new_contacts = model_access.contacts_to_string(
@@ -651,29 +700,20 @@ class ListingSerializer(serializers.ModelSerializer):
             if old_contacts != new_contacts:
                 change_details.append({'old_value': old_contacts,
                     'new_value': new_contacts, 'field_name': 'contacts'})
-                instance.contacts.clear()
-                for contact in validated_data['contacts']:
-                    # TODO: Smarter Handling of Duplicates Contact Records
-                    # A contact with the same name and email should be the same contact
-                    # in the backend.
-                    # Person1(name='N1',email='n2@n2.com') and
-                    #    Person1' (name='N1',email='n2@n2.com',secure_phone = '414-444-444')
-                    # The two people above should be one contact
-                    # if approval_status: "IN_PROGRESS" then it should be using
-                    # contact model ids' since it is temporary contacts
-                    obj, created = models.Contact.objects.get_or_create(
-                        name=contact['name'],
-                        email=contact['email'],
-                        secure_phone=contact['secure_phone'],
-                        unsecure_phone=contact['unsecure_phone'],
-                        organization=contact.get('organization', None),
-                        contact_type=contact_type_model_access.get_contact_type_by_name(
-                            contact['contact_type']['name'])
-                    )
-                    instance.contacts.add(obj)
+                # TODO: Smarter Handling of Duplicates Contact Records
+                # A contact with the same name and email should be the same contact
+                # in the backend.
+                # Person1(name='N1',email='n2@n2.com') and
+                #    Person1' (name='N1',email='n2@n2.com',secure_phone = '414-444-444')
+                # The two people above should be one contact
+                # if approval_status: "IN_PROGRESS" then it should be using
+                # contact model ids' since it is temporary contacts
+                model_access.reconcile_m2m(instance.contacts,
+                    old_contact_instances,
+                    model_access.get_or_create_contacts(validated_data['contacts']))
 
         if 'categories' in validated_data:
-            old_category_instances = instance.categories.all()
+            old_category_instances = list(instance.categories.all())
             old_categories = model_access.categories_to_string(
                 old_category_instances, True)
             new_categories = model_access.categories_to_string(
@@ -681,12 +721,11 @@ class ListingSerializer(serializers.ModelSerializer):
             if old_categories != new_categories:
                 change_details.append({'old_value': old_categories,
                     'new_value': new_categories, 'field_name': 'categories'})
-                instance.categories.clear()
-                for category in validated_data['categories']:
-                    instance.categories.add(category)
+                model_access.reconcile_m2m(instance.categories,
+                    old_category_instances, validated_data['categories'])
 
         if 'owners' in validated_data:
-            old_owner_instances = instance.owners.all()
+            old_owner_instances = list(instance.owners.select_related('user'))
             old_owners = model_access.owners_to_string(
                 old_owner_instances, True)
             new_owners = model_access.owners_to_string(
@@ -694,26 +733,23 @@ class ListingSerializer(serializers.ModelSerializer):
             if old_owners != new_owners:
                 change_details.append({'old_value': old_owners,
                     'new_value': new_owners, 'field_name': 'owners'})
-                instance.owners.clear()
-                for owner in validated_data['owners']:
-                    instance.owners.add(owner)
+                model_access.reconcile_m2m(instance.owners,
+                    old_owner_instances, validated_data['owners'])
 
         # tags will be automatically created if necessary
         if 'tags' in validated_data:
-            old_tag_instances = instance.tags.all()
+            old_tag_instances = list(instance.tags.all())
             old_tags = model_access.tags_to_string(old_tag_instances, True)
             new_tags = model_access.tags_to_string(validated_data['tags'])
             if old_tags != new_tags:
                 change_details.append({'old_value': old_tags,
                     'new_value': new_tags, 'field_name': 'tags'})
-                instance.tags.clear()
-                for tag in validated_data['tags']:
-                    obj, created = models.Tag.objects.get_or_create(
-                        name=tag['name'])
-                    instance.tags.add(obj)
+                model_access.reconcile_m2m(instance.tags, old_tag_instances,
+                    model_access.get_or_create_tags(
+                        [i['name'] for i in validated_data['tags']]))
 
         if 'intents' in validated_data:
-            old_intent_instances = instance.intents.all()
+            old_intent_instances = list(instance.intents.all())
             old_intents = model_access.intents_to_string(old_intent_instances,
                 True)
             new_intents = model_access.intents_to_string(
@@ -721,13 +757,13 @@ class ListingSerializer(serializers.ModelSerializer):
             if old_intents != new_intents:
                 change_details.append({'old_value': old_intents,
                     'new_value': new_intents, 'field_name': 'intents'})
-                instance.intents.clear()
-                for intent in validated_data['intents']:
-                    instance.intents.add(intent)
+                model_access.reconcile_m2m(instance.intents,
+                    old_intent_instances, validated_data['intents'])
 
         # doc_urls will be automatically created
         if 'doc_urls' in validated_data:
-            old_doc_url_instances = model_access.get_doc_urls_for_listing(instance)
+            old_doc_url_instances = list(
+                model_access.get_doc_urls_for_listing(instance))
             old_doc_urls = model_access.doc_urls_to_string(
                 old_doc_url_instances, True)
             new_doc_urls = model_access.doc_urls_to_string(
@@ -737,49 +773,21 @@ class ListingSerializer(serializers.ModelSerializer):
                     'old_value': old_doc_urls,
                     'new_value': new_doc_urls,
                     'field_name': 'doc_urls'})
-
-                new_doc_url_instances = []
-                for d in validated_data['doc_urls']:
-                    obj, created = models.DocUrl.objects.get_or_create(
-                        name=d['name'], url=d['url'], listing=instance)
-                    new_doc_url_instances.append(obj)
-                for i in old_doc_url_instances:
-                    if i not in new_doc_url_instances:
-                        logger.info('Deleting doc_url: {0!s}'.format(i.id), extra={'request': self.context.get('request')})
-                        i.delete()
+                model_access.reconcile_doc_urls(instance,
+                    old_doc_url_instances, validated_data['doc_urls'])
 
         # screenshots will be automatically created
-        if 'screenshots' in validated_data:
-            old_screenshot_instances = model_access.get_screenshots_for_listing(instance)
+        if validated_data.get('screenshots') is not None:
+            old_screenshot_instances = list(
+                model_access.get_screenshots_for_listing(instance).select_related(
+                    'small_image', 'large_image'))
             old_screenshots = model_access.screenshots_to_string(old_screenshot_instances, True)
             new_screenshots = model_access.screenshots_to_string(validated_data['screenshots'])
             if old_screenshots != new_screenshots:
                 change_details.append({'old_value': old_screenshots,
                     'new_value': new_screenshots, 'field_name': 'screenshots'})
-
-            new_screenshot_instances = []
-
-            for s in validated_data['screenshots']:
-
-                new_small_image = image_model_access.get_image_by_id(s['small_image']['id'])
-                new_small_image.security_marking = s['small_image']['security_marking']
-                new_small_image.save()
-
-                new_large_image = image_model_access.get_image_by_id(s['large_image']['id'])
-                new_large_image.security_marking = s['large_image']['security_marking']
-                new_large_image.save()
-
-                obj, created = models.Screenshot.objects.get_or_create(
-                    small_image=new_small_image,
-                    large_image=new_large_image,
-                    listing=instance)
-
-                new_screenshot_instances.append(obj)
-
-            for i in old_screenshot_instances:
-                if i not in new_screenshot_instances:
-                    logger.info('Deleting screenshot: {0!s}'.format(i.id), extra={'request': self.context.get('request')})
-                    i.delete()
+                model_access.reconcile_screenshots(instance,
+                    old_screenshot_instances, validated_data['screenshots'])
 
         if 'agency' in validated_data:
             if instance.agency != validated_data['agency']:
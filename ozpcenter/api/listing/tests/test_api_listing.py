@@ -3,11 +3,14 @@ Tests for listing endpoints
 """
 import json
 
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from rest_framework import status
 from rest_framework.test import APITestCase
 
 from ozpcenter import model_access as generic_model_access
 from ozpcenter import models
+from ozpcenter import utils
 from ozpcenter.scripts import sample_data_generator as data_gen
 import ozpcenter.api.listing.model_access as model_access
 
@@ -294,6 +297,160 @@ class ListingApiTest(APITestCase):
         for listing_map in response.data['results']:
             self.assertEquals(self._validate_listing_map_keys(listing_map), [])
 
+    def test_search_facets(self):
+        user = generic_model_access.get_profile('wsmith').user
+        self.client.force_authenticate(user=user)
+        url = '/api/listings/search/facets/?search=air&agency=Minitrue'
+        response = self.client.get(url, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        self.assertEqual(response.data['total'], 10)
+        self.assertEqual(response.data['tags']['tag_1'], 1)
+        self.assertEqual(response.data['categories']['Communication'], 10)
+        self.assertEqual(response.data['listing_types'], {'web application': 10})
+
+    def test_search_tag_and_category_logic(self):
+        user = generic_model_access.get_profile('wsmith').user
+        self.client.force_authenticate(user=user)
+        url = '/api/listings/search/?category=Communication&category=Health and Fitness&category_logic=and'
+        response = self.client.get(url, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        titles = [i['title'] for i in response.data]
+        self.assertFalse('Air Mail' in titles)
+
+        url = '/api/listings/search/?tag=tag_2'
+        response = self.client.get(url, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        titles = [i['title'] for i in response.data]
+        self.assertEqual(titles, ['Air Mail 2'])
+
+    def _get_page_queries(self, url, limit):
+        """
+        Get the number of queries made to get a page of listings
+        """
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('{0!s}?limit={1:d}'.format(url, limit),
+                format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['results']), limit)
+        return len(queries)
+
+    def test_listing_page_queries(self):
+        user = generic_model_access.get_profile('wsmith').user
+        self.client.force_authenticate(user=user)
+        for url in ['/api/listing/', '/api/listings/search/']:
+            # the number of queries doesn't depend on the number of listings
+            self.assertEqual(self._get_page_queries(url, 2),
+                self._get_page_queries(url, 20))
+
+    def test_listing_is_bookmarked(self):
+        bookmarked_ids = set(models.ApplicationLibraryEntry.objects.filter(
+            owner__user__username='wsmith').values_list('listing_id', flat=True))
+        self.assertTrue(1 in bookmarked_ids)
+        for username in ['wsmith', 'julia']:
+            user = generic_model_access.get_profile(username).user
+            self.client.force_authenticate(user=user)
+            for url in ['/api/listing/', '/api/listings/search/']:
+                response = self.client.get(url + '?limit=200', format='json')
+                self.assertEqual(response.status_code, status.HTTP_200_OK)
+                listings = response.data['results']
+                ids = {i['id'] for i in listings if i['is_bookmarked']}
+                if username == 'wsmith':
+                    self.assertEqual(ids, bookmarked_ids & {i['id'] for i in listings})
+                    self.assertTrue(1 in ids)
+                else:
+                    self.assertEqual(ids, set())
+
+            response = self.client.get('/api/listing/1/', format='json')
+            self.assertEqual(response.data['is_bookmarked'], username == 'wsmith')
+
+    def test_listing_not_modified(self):
+        url = '/api/listing/1/'
+        user = generic_model_access.get_profile('julia').user
+        self.client.force_authenticate(user=user)
+        with self.settings(CACHES={'default': {
+                'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                'LOCATION': 'test_listing_not_modified'}}):
+            response = self.client.get(url, format='json')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            etag = response['ETag']
+            self.assertFalse(response.has_header('Last-Modified'))
+            response = self.client.get(url, format='json', HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+            # bookmarking the listing changes the response
+            models.ApplicationLibraryEntry(owner=generic_model_access.get_profile('julia'),
+                listing=models.Listing.objects.get(id=1), folder='').save()
+            response = self.client.get(url, format='json', HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertTrue(response.data['is_bookmarked'])
+            self.assertNotEqual(response['ETag'], etag)
+
+            # saving another profile (as each login does) doesn't
+            etag = response['ETag']
+            generic_model_access.get_profile('wsmith').save()
+            response = self.client.get(url, format='json', HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+            # the ETag is per user
+            user = generic_model_access.get_profile('wsmith').user
+            self.client.force_authenticate(user=user)
+            response = self.client.get(url, format='json',
+                HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def _get_cursor_page(self, url):
+        response = self.client.get(url, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse('count' in response.data)
+        return response.data
+
+    def test_listing_cursor_pagination(self):
+        user = generic_model_access.get_profile('wsmith').user
+        self.client.force_authenticate(user=user)
+        expected_ids = list(models.Listing.objects.for_user('wsmith').order_by(
+            '-edited_date', '-id').values_list('id', flat=True))
+
+        # walk all the pages
+        ids = []
+        pages = []
+        url = '/api/listing/?cursor=&limit=7'
+        while url:
+            data = self._get_cursor_page(url)
+            pages.append([i['id'] for i in data['results']])
+            ids.extend(pages[-1])
+            url = data['next']
+        self.assertEqual(ids, expected_ids)
+
+        # new rows don't shift the following pages
+        data = self._get_cursor_page('/api/listing/?cursor=&limit=7')
+        models.Listing.objects.filter(id=expected_ids[-1]).update(
+            edited_date=utils.get_now_utc())
+        data = self._get_cursor_page(data['next'])
+        self.assertEqual([i['id'] for i in data['results']], pages[1])
+
+        # and back, where the new row now comes first
+        data = self._get_cursor_page(data['previous'])
+        self.assertEqual([i['id'] for i in data['results']], pages[0])
+        data = self._get_cursor_page(data['previous'])
+        self.assertEqual([i['id'] for i in data['results']], [expected_ids[-1]])
+        self.assertIsNone(data['previous'])
+
+    def test_listing_cursor_pagination_ordering(self):
+        user = generic_model_access.get_profile('wsmith').user
+        self.client.force_authenticate(user=user)
+        expected_ids = list(models.Listing.objects.for_user('wsmith').order_by(
+            'avg_rate', 'id').values_list('id', flat=True))
+        data = self._get_cursor_page('/api/listing/?cursor=&limit=30&ordering=avg_rate')
+        self.assertEqual([i['id'] for i in data['results']], expected_ids[:30])
+        data = self._get_cursor_page(data['next'])
+        self.assertEqual([i['id'] for i in data['results']], expected_ids[30:60])
+
+        response = self.client.get('/api/listing/?cursor=&ordering=title', format='json')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        response = self.client.get('/api/listing/?cursor=abc', format='json')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
     def test_self_listing(self):
         user = generic_model_access.get_profile('julia').user
         self.client.force_authenticate(user=user)
@@ -366,6 +523,9 @@ class ListingApiTest(APITestCase):
         self.client.force_authenticate(user=user)
         air_mail_id = models.Listing.objects.get(title='Air Mail').id
         url = '/api/listing/{0!s}/review/'.format(air_mail_id)
+        for rate in [7, 2.5, 'three']:
+            response = self.client.post(url, {'rate': rate}, format='json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
         data = {'rate': 3}
         response = self.client.post(url, data, format='json')
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
@@ -394,6 +554,14 @@ class ListingApiTest(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(4, response.data['rate'])
 
+        # the rating must be a whole number from 1 to 5
+        for rate in [0, 6, 4.5, 'four']:
+            response = self.client.put(url, {'rate': rate}, format='json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.put(url, {'rate': '3'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(3, response.data['rate'])
+
         # test the listing/<id>/activity endpoint
         url = '/api/listing/{0!s}/activity/'.format(air_mail_id)
         response = self.client.get(url, format='json')
@@ -844,7 +1012,8 @@ class ListingApiTest(APITestCase):
         self.assertEqual(response.data['large_icon']['id'], 2)
         self.assertEqual(response.data['banner_icon']['id'], 3)
         self.assertEqual(response.data['large_banner_icon']['id'], 4)
-        self.assertEqual(response.data['is_bookmarked'], True)
+        # only wsmith bookmarked this listing
+        self.assertEqual(response.data['is_bookmarked'], False)
         self.assertEquals(self._validate_listing_map_keys(response.data), [])
 
     def test_update_listing_full(self):
@@ -1141,6 +1310,36 @@ class ListingApiTest(APITestCase):
 
         self.assertEqual(total_found, len(fields) - 2)    # (-1 for approved_status) + (-1 for is_enabled)
 
+    def test_update_listing_relations_diff(self):
+        user = generic_model_access.get_profile('julia').user
+        self.client.force_authenticate(user=user)
+        url = '/api/listing/1/'
+        listing = models.Listing.objects.get(id=1)
+        doc_url_ids = set(listing.doc_urls.values_list('id', flat=True))
+        screenshot_ids = set(listing.screenshots.values_list('id', flat=True))
+
+        data = self.client.get(url, format='json').data
+        data['tags'] = data['tags'][1:] + [{'name': 'zeppelin'}, {'name': 'zeppelin'}]
+        data['doc_urls'].append({'name': 'blimp', 'url': 'http://www.google.com/blimp'})
+        response = self.client.put(url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        tags = sorted(i['name'] for i in data['tags'])
+        self.assertEqual(sorted(set(tags)),
+            sorted(listing.tags.values_list('name', flat=True)))
+        self.assertEqual(models.Tag.objects.filter(name='zeppelin').count(), 1)
+        # the unchanged rows are kept
+        new_doc_url_ids = set(listing.doc_urls.values_list('id', flat=True))
+        self.assertTrue(doc_url_ids < new_doc_url_ids)
+        self.assertEqual(len(new_doc_url_ids), len(doc_url_ids) + 1)
+        self.assertEqual(screenshot_ids,
+            set(listing.screenshots.values_list('id', flat=True)))
+
+        activity = models.ListingActivity.objects.filter(listing=listing,
+            action=models.ListingActivity.MODIFIED).order_by('-id').first()
+        self.assertEqual(sorted(i.field_name for i in activity.change_details.all()),
+            ['doc_urls', 'tags'])
+
     def test_z_create_update(self):
         user = generic_model_access.get_profile('julia').user
         self.client.force_authenticate(user=user)
@@ -1,13 +1,20 @@
 """
 Listing tests
 """
+import io
+from unittest.mock import patch
+
+from django.core.management import call_command
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 
 from ozpcenter.scripts import sample_data_generator as data_gen
 import ozpcenter.api.listing.model_access as model_access
 from ozpcenter import errors
 import ozpcenter.model_access as generic_model_access
 from ozpcenter import models
+from plugins_util import plugin_manager
 
 
 class ListingTest(TestCase):
@@ -45,6 +52,50 @@ class ListingTest(TestCase):
 
         #  TODO: Finish Unit Test
 
+    def test_for_user_security_marking(self):
+        username = 'wsmith'
+        visible_count = models.Listing.objects.for_user(username).count()
+        # give one of two listings titled 'Air Mail' a marking the user
+        # cannot access - only that listing (not its namesake) is hidden
+        models.Listing.objects.filter(title='Air Mail 1').update(title='Air Mail')
+        air_mail = models.Listing.objects.filter(title='Air Mail').first()
+
+        access_control_instance = plugin_manager.get_system_access_control_plugin()
+
+        def has_access(user_accesses_json, marking):
+            return marking != 'TOP SECRET//HIDDEN'
+
+        with patch.object(access_control_instance, 'has_access',
+                side_effect=has_access) as mock_has_access:
+            # changing the marking updates who can see the listing
+            air_mail.security_marking = 'TOP SECRET//HIDDEN'
+            air_mail.save()
+            listings = models.Listing.objects.for_user(username)
+            self.assertEqual(listings.count(), visible_count - 1)
+            self.assertFalse(listings.filter(id=air_mail.id).exists())
+            self.assertTrue(listings.filter(title='Air Mail').exists())
+            # the plugin is consulted once per distinct access_control, not
+            # per user
+            self.assertTrue(mock_has_access.call_count <
+                models.Profile.objects.count())
+
+    def test_security_marking_encoding(self):
+        markings = ['UNCLASSIFIED', 'SECRET//FOUO', 'TOP SECRET', 'SECRET//ABC']
+        listings = list(models.Listing.objects.order_by('id')[:len(markings)])
+        for listing, marking in zip(listings, markings):
+            listing.security_marking = marking
+            listing.save()
+
+        air_mail = models.Listing.objects.get(id=listings[1].id)
+        self.assertEqual((air_mail.security_level, air_mail.security_mask), (3, 1))
+        # controls without a bit can't be encoded
+        self.assertIsNone(models.Listing.objects.get(id=listings[3].id).security_level)
+
+        profile = generic_model_access.get_profile('jones')
+        profile.access_control = '{"clearances": ["SECRET"], "formal_accesses": ["FOUO"], "visas": []}'
+        profile.save()
+        self.assertEqual((profile.access_level, profile.access_mask), (3, 1))
+
     def test_get_reviews(self):
         username = 'wsmith'
         reviews = model_access.get_reviews(username)
@@ -110,6 +161,26 @@ class ListingTest(TestCase):
             title='Air Mail')
         self.assertEqual(air_mail.last_activity, modified_activity)
 
+    def test_log_listing_modification_queries(self):
+        author = generic_model_access.get_profile('wsmith')
+        air_mail = models.Listing.objects.get(title='Air Mail')
+
+        def log_changes(count):
+            change_details = [{'old_value': str(i), 'new_value': str(i + 1),
+                'field_name': 'field_{0:d}'.format(i)} for i in range(count)]
+            with CaptureQueriesContext(connection) as queries:
+                model_access.log_listing_modification(author, air_mail,
+                    change_details)
+            return len(queries)
+
+        # the number of queries doesn't depend on the number of changes
+        self.assertEqual(log_changes(2), log_changes(15))
+        activity = models.ListingActivity.objects.filter(listing=air_mail,
+            action=models.ListingActivity.MODIFIED).order_by('-id').first()
+        self.assertEqual(sorted((i.field_name, i.old_value, i.new_value)
+            for i in activity.change_details.all()),
+            sorted(('field_{0:d}'.format(i), str(i), str(i + 1)) for i in range(15)))
+
     def test_submit_listing(self):
         author = generic_model_access.get_profile('wsmith')
         air_mail = models.Listing.objects.for_user(author.user.username).get(
@@ -264,6 +335,42 @@ class ListingTest(TestCase):
         enabled_activity = listing_activities[0]
         self.assertEqual(enabled_activity.author.user.username, username)
 
+    def test_review_rating_deltas(self):
+        air_mail = models.Listing.objects.get(title='Air Mail')
+        before = models.Listing.objects.filter(id=air_mail.id).values(
+            *model_access.RATING_FIELDS).get()
+
+        model_access.create_listing_review('jones', air_mail, 5)
+        review = models.Review.objects.get(listing=air_mail,
+            author__user__username='jones')
+        model_access.edit_listing_review('jones', review, 2, 'meh')
+
+        listing = models.Listing.objects.get(id=air_mail.id)
+        self.assertEqual(listing.total_rate5, before['total_rate5'])
+        self.assertEqual(listing.total_rate2, before['total_rate2'] + 1)
+        self.assertEqual(listing.total_votes, before['total_votes'] + 1)
+        self.assertEqual(listing.total_reviews, before['total_reviews'] + 1)
+        self.assertEqual(listing.avg_rate, model_access._get_avg_rate(
+            {i: getattr(listing, i) for i in model_access.RATING_FIELDS}))
+
+        model_access.delete_listing_review('jones', review)
+        self.assertEqual(models.Listing.objects.filter(id=air_mail.id).values(
+            *model_access.RATING_FIELDS).get(), before)
+
+    def test_recompute_ratings(self):
+        self.assertEqual(model_access.recompute_ratings(), 0)
+        air_mail = models.Listing.objects.get(title='Air Mail')
+        expected = models.Listing.objects.filter(id=air_mail.id).values(
+            'avg_rate', *model_access.RATING_FIELDS).get()
+        models.Listing.objects.filter(id=air_mail.id).update(total_rate3=42,
+            total_votes=0, avg_rate=1.5)
+
+        out = io.StringIO()
+        call_command('recompute_ratings', stdout=out)
+        self.assertTrue('1 listings' in out.getvalue())
+        self.assertEqual(models.Listing.objects.filter(id=air_mail.id).values(
+            'avg_rate', *model_access.RATING_FIELDS).get(), expected)
+
     def test_delete_listing(self):
         username = 'wsmith'
         air_mail = models.Listing.objects.for_user(username).get(
@@ -420,3 +527,35 @@ class ListingTest(TestCase):
         self.assertTrue(data['APPROVED_ORG'] >= 0)
         self.assertTrue(data['APPROVED'] >= 0)
         self.assertTrue(data['DELETED'] >= 0)
+
+    def test_put_counts_in_listings_endpoint_queries(self):
+        queryset = models.Listing.objects.for_user('wsmith').filter(
+            is_enabled=True)
+        # agencies and grouped counts
+        with self.assertNumQueries(2):
+            data = model_access.put_counts_in_listings_endpoint(queryset)
+
+        self.assertEqual(data['total'], queryset.count())
+        self.assertEqual(data['enabled'], queryset.count())
+        for approval_status, _ in models.Listing.APPROVAL_STATUS_CHOICES:
+            self.assertEqual(data[approval_status],
+                queryset.filter(approval_status=approval_status).count())
+        for agency in models.Agency.objects.all():
+            self.assertEqual(data['organizations'][str(agency.id)],
+                queryset.filter(agency=agency).count())
+
+    def test_put_counts_in_listings_endpoint_cached(self):
+        queryset = models.Listing.objects.all()
+        with self.settings(CACHES={'default': {
+                'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}):
+            data = model_access.put_counts_in_listings_endpoint(queryset, 'all')
+            with self.assertNumQueries(0):
+                self.assertEqual(model_access.put_counts_in_listings_endpoint(
+                    queryset, 'all'), data)
+
+            # any listing change invalidates the counts
+            listing = queryset.filter(is_enabled=True).first()
+            listing.is_enabled = False
+            listing.save()
+            new_data = model_access.put_counts_in_listings_endpoint(queryset, 'all')
+            self.assertEqual(new_data['enabled'], data['enabled'] - 1)
@@ -3,16 +3,21 @@ Views
 """
 import logging
 
+from django.conf import settings
 from django.shortcuts import get_object_or_404
-from rest_framework import filters
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition
 from rest_framework import status
 from rest_framework import viewsets
+from rest_framework.decorators import list_route
 from rest_framework.response import Response
 
+from ozpcenter import conditional
 from ozpcenter import errors
 from ozpcenter import models
-#  from ozpcenter import pagination  # TODO: Is Necessary?
+from ozpcenter import pagination
 from ozpcenter import permissions
+from ozpcenter import search
 import ozpcenter.api.listing.model_access as model_access
 import ozpcenter.api.listing.serializers as serializers
 import ozpcenter.model_access as generic_model_access
@@ -44,7 +49,8 @@ class ReviewViewSet(viewsets.ModelViewSet):
     """
     permission_classes = (permissions.IsUser,)
     serializer_class = serializers.ReviewSerializer
-    # pagination_class = pagination.StandardPagination
+    pagination_class = pagination.CursorOrLimitOffsetPagination
+    cursor_ordering_fields = ('edited_date',)
 
     def get_queryset(self):
         return model_access.get_reviews(self.request.user.username)
@@ -92,7 +98,7 @@ class ReviewViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST)
 
         try:
-            rate = int(request.data['rate'])
+            rate = request.data['rate']
             text = request.data.get('text', None)
         except Exception:
             return Response('Invalid input data',
@@ -102,6 +108,8 @@ class ReviewViewSet(viewsets.ModelViewSet):
             resp = model_access.create_listing_review(request.user.username,
                 listing, rate, text)
             return Response(resp, status=status.HTTP_201_CREATED)
+        except errors.InvalidInput as err:
+            return Response({'detail': '{}'.format(err)}, status=status.HTTP_400_BAD_REQUEST)
         except Exception as e:
             raise e
             return Response('Bad request to create new review',
@@ -134,6 +142,8 @@ class ReviewViewSet(viewsets.ModelViewSet):
         except errors.PermissionDenied:
             return Response('Cannot update another user\'s review',
                  status=status.HTTP_403_FORBIDDEN)
+        except errors.InvalidInput as err:
+            return Response({'detail': '{}'.format(err)}, status=status.HTTP_400_BAD_REQUEST)
 
 
 class ListingTypeViewSet(viewsets.ModelViewSet):
@@ -147,6 +157,8 @@ class ListingUserActivitiesViewSet(viewsets.ModelViewSet):
     """
     permission_classes = (permissions.IsUser,)
     serializer_class = serializers.ListingActivitySerializer
+    pagination_class = pagination.CursorOrLimitOffsetPagination
+    cursor_ordering_fields = ('activity_date',)
 
     def get_queryset(self):
         return model_access.get_listing_activities_for_user(
@@ -170,6 +182,8 @@ class ListingActivitiesViewSet(viewsets.ModelViewSet):
     """
     permission_classes = (permissions.IsOrgSteward,)
     serializer_class = serializers.ListingActivitySerializer
+    pagination_class = pagination.CursorOrLimitOffsetPagination
+    cursor_ordering_fields = ('activity_date',)
 
     def get_queryset(self):
         return model_access.get_all_listing_activities(
@@ -195,6 +209,8 @@ class ListingActivityViewSet(viewsets.ModelViewSet):
     """
     permission_classes = (permissions.IsUser,)
     serializer_class = serializers.ListingActivitySerializer
+    pagination_class = pagination.CursorOrLimitOffsetPagination
+    cursor_ordering_fields = ('activity_date',)
 
     def get_queryset(self):
         return model_access.get_all_listing_activities(
@@ -267,6 +283,8 @@ class ListingViewSet(viewsets.ModelViewSet):
     """
     permission_classes = (permissions.IsUser,)
     serializer_class = serializers.ListingSerializer
+    pagination_class = pagination.CursorOrLimitOffsetPagination
+    cursor_ordering_fields = ('edited_date', 'avg_rate')
 
     def get_queryset(self):
         approval_status = self.request.query_params.get('approval_status', None)
@@ -292,7 +310,17 @@ class ListingViewSet(viewsets.ModelViewSet):
 
     def list(self, request):
         queryset = self.get_queryset()
-        counts_data = model_access.put_counts_in_listings_endpoint(queryset)
+        counts_cache_key = None
+        if settings.OZP.get('CACHE_LISTING_COUNTS', False):
+            # the counts only depend on what the user can see and the filters
+            profile = generic_model_access.get_profile(request.user.username)
+            counts_cache_key = '{0!s}:{1!s}'.format(profile.visibility_class,
+                [request.query_params.getlist(i) for i in
+                 ['approval_status', 'org', 'enabled']])
+        counts_data = model_access.put_counts_in_listings_endpoint(queryset,
+            counts_cache_key)
+        queryset = serializers.ListingSerializer.setup_eager_loading(queryset,
+            request.user.username)
         # it appears that because we override the queryset here, we must
         # manually invoke the pagination methods
         page = self.paginate_queryset(queryset)
@@ -401,6 +429,7 @@ class ListingViewSet(viewsets.ModelViewSet):
         except Exception as e:
             raise e
 
+    @method_decorator(condition(etag_func=conditional.listing_etag))
     def retrieve(self, request, pk=None):
         """
         Get a Listing by id
@@ -544,7 +573,11 @@ class ListingUserViewSet(viewsets.ModelViewSet):
     serializer_class = serializers.ListingSerializer
 
     def get_queryset(self):
-        return model_access.get_self_listings(self.request.user.username)
+        listings = model_access.get_self_listings(self.request.user.username)
+        if self.action == 'list':
+            listings = serializers.ListingSerializer.setup_eager_loading(listings,
+                self.request.user.username)
+        return listings
 
     def list(self, request):
         return super(ListingUserViewSet, self).list(self, request)
@@ -556,23 +589,35 @@ class ListingSearchViewSet(viewsets.ModelViewSet):
     """
     permission_classes = (permissions.IsUser,)
     serializer_class = serializers.ListingSerializer
-    filter_backends = (filters.SearchFilter, )
-    search_fields = ('title', 'description', 'description_short', 'tags__name')
 
-    def get_queryset(self):
+    def _get_filter_params(self):
         filter_params = {}
         categories = self.request.query_params.getlist('category', False)
         agencies = self.request.query_params.getlist('agency', False)
         listing_types = self.request.query_params.getlist('type', False)
+        tags = self.request.query_params.getlist('tag', False)
+        category_logic = self.request.query_params.get('category_logic', None)
         if categories:
             filter_params['categories'] = categories
         if agencies:
             filter_params['agencies'] = agencies
         if listing_types:
             filter_params['listing_types'] = listing_types
+        if tags:
+            filter_params['tags'] = tags
+        if category_logic:
+            filter_params['category_logic'] = category_logic
+        return filter_params
 
-        return model_access.filter_listings(self.request.user.username,
-            filter_params)
+    def get_queryset(self):
+        listings = model_access.filter_listings(self.request.user.username,
+            self._get_filter_params())
+        listings = search.search_listings(listings,
+            self.request.query_params.get('search', None))
+        if self.action == 'list':
+            listings = serializers.ListingSerializer.setup_eager_loading(listings,
+                self.request.user.username)
+        return listings
 
     def list(self, request):
         """
@@ -586,16 +631,23 @@ class ListingSearchViewSet(viewsets.ModelViewSet):
               description: Text to search
               paramType: query
             - name: category
-              description: List of category names (AND logic)
+              description: List of category names (OR logic, unless category_logic is and)
               required: false
               paramType: query
               allowMultiple: true
+            - name: category_logic
+              description: or (listings in any category) or and (listings in all categories)
+              required: false
+              paramType: query
             - name: agency
               description: List of agencies
               paramType: query
             - name: type
               description: List of application types
               paramType: query
+            - name: tag
+              description: List of tag names
+              paramType: query
             - name: limit
               description: Max number of listings to retrieve
               paramType: query
@@ -608,3 +660,58 @@ class ListingSearchViewSet(viewsets.ModelViewSet):
               message: Not authenticated
         """
         return super(ListingSearchViewSet, self).list(self, request)
+
+    @list_route(methods=['get'])
+    def facets(self, request):
+        """
+        Count the listings of each category, agency, listing type, and tag
+
+        The counts of each facet apply the search and the filters of the other
+        facets, but not its own
+
+        {
+            "total": <matching listings>,
+            "categories": {<title>: <count>, ...},
+            "agencies": {<short name>: <count>, ...},
+            "listing_types": {<title>: <count>, ...},
+            "tags": {<name>: <count>, ...}
+        }
+        ---
+        # YAML (must be separated by `---`)
+
+        omit_serializer: true
+
+        parameters:
+            - name: search
+              description: Text to search
+              paramType: query
+            - name: category
+              description: List of category names (OR logic, unless category_logic is and)
+              required: false
+              paramType: query
+              allowMultiple: true
+            - name: category_logic
+              description: or (listings in any category) or and (listings in all categories)
+              required: false
+              paramType: query
+            - name: agency
+              description: List of agencies
+              paramType: query
+            - name: type
+              description: List of application types
+              paramType: query
+            - name: tag
+              description: List of tag names
+              paramType: query
+
+        responseMessages:
+            - code: 401
+              message: Not authenticated
+        """
+        username = request.user.username
+        listings = model_access.filter_listings(username, {})
+        listings = search.search_listings(listings,
+            request.query_params.get('search', None))
+        data = model_access.get_facet_counts(username,
+            self._get_filter_params(), listings)
+        return Response(data)
@@ -11,6 +11,7 @@ from rest_framework import viewsets
 from rest_framework.response import Response
 
 from ozpcenter import errors
+from ozpcenter import pagination
 from ozpcenter import permissions
 import ozpcenter.api.notification.model_access as model_access
 import ozpcenter.api.notification.serializers as serializers
@@ -91,6 +92,8 @@ class UserNotificationViewSet(viewsets.ModelViewSet):
     filter_backends = (filters.OrderingFilter,)
     ordering_fields = ('created_date',)
     ordering = ('-created_date',)
+    pagination_class = pagination.CursorOrLimitOffsetPagination
+    cursor_ordering_fields = ('created_date',)
 
     def get_queryset(self):
         """
@@ -93,6 +93,8 @@ class ProfileListingViewSet(viewsets.ModelViewSet):
             queryset = self.get_queryset(current_request_username, profile_pk)
 
             if queryset:
+                queryset = listing_serializers.ListingSerializer.setup_eager_loading(queryset,
+                    current_request_username)
                 page = self.paginate_queryset(queryset)
 
                 if page is not None:
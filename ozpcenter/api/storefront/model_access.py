@@ -1,105 +1,202 @@
 """
 model access
 """
+import heapq
+import json
 import logging
 
+from django.db.models import Count
 from django.db.models.functions import Lower
 from django.core.cache import cache
+from rest_framework.utils.encoders import JSONEncoder
+from ozpcenter import caching
+from ozpcenter import conditional
 from ozpcenter import models
 import ozpcenter.api.storefront.serializers as serializers
+import ozpcenter.model_access as generic_model_access
+from ozpcenter import utils
 
 # Get an instance of a logger
 logger = logging.getLogger('ozp-center.' + str(__name__))
 
+# number of listings in each storefront section
+FEATURED_SIZE = 12
+RECENT_SIZE = 24
+MOST_POPULAR_SIZE = 36
+
+
+def _get_sections(rows):
+    """
+    Pick the ids of each storefront section from the (id, is_featured,
+    approved_date, popularity_score, total_reviews) of the visible listings
+    """
+    featured = sorted(i[0] for i in rows if i[1])[:FEATURED_SIZE]
+    # listings that were never approved come last
+    recent = heapq.nlargest(RECENT_SIZE, rows,
+        key=lambda i: (i[2] is not None, i[2] or 0, -i[0]))
+    most_popular = heapq.nlargest(MOST_POPULAR_SIZE, rows,
+        key=lambda i: (i[3], i[4], -i[0]))
+    return {
+        'featured': featured,
+        'recent': [i[0] for i in recent],
+        'most_popular': [i[0] for i in most_popular]
+    }
+
 
 def get_storefront(username):
     """
     Returns data for /storefront api invocation including:
         * featured listings (max=12?)
         * recent (new) listings (max=24?)
-        * most popular listings (max=36?)
+        * most popular listings (max=36?), by popularity score (see
+            ozpcenter.ranking)
+
+    The listings the user can see are scanned once (only the columns used to
+    pick the sections), and the listings in any section are then loaded
+    together
 
     NOTE: think about adding Bookmark status to this later on
     """
-    user = models.Profile.objects.get(user__username=username)  # flake8: noqa TODO: Is Necessary? - Variable not being used in method
     try:
-        # get featured listings
-        featured_listings = models.Listing.objects.for_user(
-            username).filter(
-                is_featured=True,
-                approval_status=models.Listing.APPROVED,
-                is_enabled=True,
-                is_deleted=False)[:12]
-
-        # get recent listings
-        recent_listings = models.Listing.objects.for_user(
-            username).order_by(
-                '-approved_date').filter(
-                    approval_status=models.Listing.APPROVED,
-                    is_enabled=True,
-                    is_deleted=False)[:24]
-
-        # get most popular listings via a weighted average
-        most_popular_listings = models.Listing.objects.for_user(
-            username).filter(
-                approval_status=models.Listing.APPROVED,
-                is_enabled=True,
-                is_deleted=False).order_by('-avg_rate', '-total_reviews')[:36]
-
-        featured_listings = serializers.ListingSerializer.setup_eager_loading(featured_listings)
-        recent_listings = serializers.ListingSerializer.setup_eager_loading(recent_listings)
-        most_popular_listings = serializers.ListingSerializer.setup_eager_loading(most_popular_listings)
-
-        data = {
-            'featured': featured_listings,
-            'recent': recent_listings,
-            'most_popular': most_popular_listings
-        }
+        rows = list(models.Listing.objects.for_user(username).filter(
+            approval_status=models.Listing.APPROVED,
+            is_enabled=True,
+            is_deleted=False).order_by().values_list('id', 'is_featured',
+                'approved_date', 'popularity_score', 'total_reviews'))
+        sections = _get_sections(rows)
+
+        listing_ids = set()
+        for ids in sections.values():
+            listing_ids.update(ids)
+        listings = serializers.ListingSerializer.setup_eager_loading(
+            models.Listing.objects.filter(id__in=listing_ids))
+        listings = {i.id: i for i in listings}
+
+        data = {section: [listings[i] for i in ids]
+                for section, ids in sections.items()}
     except Exception as e:
         return {'error': True, 'msg': 'Error getting storefront: {0!s}'.format(str(e))}
     return data
 
 
+def get_serialized_storefront(request):
+    """
+    Get the serialized storefront of the requesting user
+
+    The storefront only depends on the listings the user can see, so it is
+    cached once per visibility class (and host, since it has image urls).
+    Approving, enabling/disabling, and rating listings changes the catalog
+    version, which makes the cached storefronts stale
+
+    Key: storefront:<catalog_version>:<visibility_class>:<host>
+    """
+    username = request.user.username
+    profile = generic_model_access.get_profile(username)
+    key = None
+    if profile is not None and profile.visibility_class:
+        key = 'storefront:{0!s}:{1!s}:{2!s}'.format(
+            generic_model_access.get_catalog_version(),
+            profile.visibility_class, utils.make_keysafe(request.get_host()))
+        data = cache.get(key)
+        if data is not None:
+            return data
+
+    data = get_storefront(username)
+    if data.get('error'):
+        return data
+    # as plain types: serializers return urls as Hyperlinks, which can't be
+    # unpickled from the cache
+    data = json.loads(json.dumps(serializers.StorefrontSerializer(data,
+        context={'request': request}).data, cls=JSONEncoder))
+    if key is not None:
+        cache.set(key, data)
+    return data
+
+
+def get_static_metadata():
+    """
+    Returns the metadata that is the same for every user:
+        * categories
+        * organizations (agencies), without listing counts
+        * listing types
+        * intents
+        * contact types
+
+    Cached until any of these are saved or deleted (see ozpcenter.caching)
+
+    Key: metadata:<generations of the metadata models>
+    """
+    def compute():
+        data = {}
+        data['categories'] = list(models.Category.objects.all().values(
+            'title', 'description').order_by(Lower('title')))
+        data['listing_types'] = list(models.ListingType.objects.all().values(
+            'title', 'description'))
+        data['agencies'] = list(models.Agency.objects.all().values(
+            'title', 'short_name', 'icon', 'id'))
+        data['contact_types'] = list(models.ContactType.objects.all().values(
+            'name', 'required'))
+        data['intents'] = list(models.Intent.objects.all().values(
+            'action', 'media_type', 'label', 'icon', 'id'))
+
+        # return icon/image urls instead of the id
+        for i in data['intents']:
+            # i['icon'] = models.Image.objects.get(id=i['icon']).image_url()
+            i['icon'] = '/TODO'
+        return data
+
+    return caching.get_or_compute('metadata', [], conditional.METADATA_MODELS,
+        compute)
+
+
+def get_agency_listing_counts(username):
+    """
+    Count the approved listings of each agency that the user can see, with a
+    single grouped query
+
+    The counts only depend on what the user can see, so they are shared by
+    all users in the same visibility class (until the catalog changes)
+
+    Returns:
+        {<agency id>: <count>, ...} (agencies without listings are left out)
+
+    Key: agency_listing_counts:<catalog_version>:<visibility_class>
+    """
+    profile = generic_model_access.get_profile(username)
+    key = None
+    if profile is not None and profile.visibility_class:
+        key = 'agency_listing_counts:{0!s}:{1!s}'.format(
+            generic_model_access.get_catalog_version(), profile.visibility_class)
+        data = cache.get(key)
+        if data is not None:
+            return data
+
+    groups = models.Listing.objects.for_user(username).filter(
+        approval_status=models.Listing.APPROVED).order_by().values(
+            'agency_id').annotate(count=Count('id'))
+    data = {i['agency_id']: i['count'] for i in groups}
+    if key is not None:
+        cache.set(key, data)
+    return data
+
+
 def get_metadata(username):
     """
     Returns metadata including:
         * categories
-        * organizations (agencies)
+        * organizations (agencies), with the number of approved listings the
+            user can see
         * listing types
         * intents
         * contact types
 
-    Key: metadata
+    See get_static_metadata and get_agency_listing_counts
     """
-    key = 'metadata'
-    data = cache.get(key)
-    if data is None:
-        try:
-            data = {}
-            data['categories'] = models.Category.objects.all().values(
-                'title', 'description').order_by(Lower('title'))
-            data['listing_types'] = models.ListingType.objects.all().values(
-                'title', 'description')
-            data['agencies'] = models.Agency.objects.all().values(
-                'title', 'short_name', 'icon', 'id')
-            data['contact_types'] = models.ContactType.objects.all().values(
-                'name', 'required')
-            data['intents'] = models.Intent.objects.all().values(
-                'action', 'media_type', 'label', 'icon', 'id')
-
-            # return icon/image urls instead of the id and get listing counts
-            for i in data['agencies']:
-                # i['icon'] = models.Image.objects.get(id=i['icon']).image_url()
-                # i['icon'] = '/TODO'
-                i['listing_count'] = models.Listing.objects.for_user(
-                    username).filter(agency__title=i['title'],
-                    approval_status=models.Listing.APPROVED).count()
-
-            for i in data['intents']:
-                # i['icon'] = models.Image.objects.get(id=i['icon']).image_url()
-                i['icon'] = '/TODO'
-
-            cache.set(key, data)
-        except Exception as e:
-            return {'error': True, 'msg': 'Error getting metadata: {0!s}'.format(str(e))}
+    try:
+        data = dict(get_static_metadata())
+        counts = get_agency_listing_counts(username)
+        data['agencies'] = [dict(i, listing_count=counts.get(i['id'], 0))
+                            for i in data['agencies']]
+    except Exception as e:
+        return {'error': True, 'msg': 'Error getting metadata: {0!s}'.format(str(e))}
     return data
@@ -1,9 +1,13 @@
 """
 Tests for storefront endpoints
 """
+from unittest.mock import patch
+
 from rest_framework.test import APITestCase
 
 from ozpcenter import model_access as generic_model_access
+from ozpcenter import models
+import ozpcenter.api.storefront.model_access as model_access
 from ozpcenter.scripts import sample_data_generator as data_gen
 
 
@@ -53,3 +57,56 @@ class StorefrontApiTest(APITestCase):
         self.assertIn('featured', response.data)
         self.assertIn('recent', response.data)
         self.assertIn('most_popular', response.data)
+
+    def test_storefront_cached(self):
+        url = '/api/storefront/'
+        user = generic_model_access.get_profile('wsmith').user
+        self.client.force_authenticate(user=user)
+        with self.settings(CACHES={'default': {
+                'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}):
+            with patch.object(model_access, 'get_storefront',
+                    wraps=model_access.get_storefront) as get_storefront:
+                response = self.client.get(url, format='json')
+                self.assertEqual(self.client.get(url, format='json').data,
+                    response.data)
+                self.assertEqual(get_storefront.call_count, 1)
+
+                # disabling a listing invalidates the storefront
+                listing_id = response.data['recent'][0]['id']
+                listing = models.Listing.objects.get(id=listing_id)
+                listing.is_enabled = False
+                listing.save()
+                response = self.client.get(url, format='json')
+                self.assertEqual(get_storefront.call_count, 2)
+                self.assertFalse(listing_id in
+                    [i['id'] for i in response.data['recent']])
+
+    def test_not_modified(self):
+        user = generic_model_access.get_profile('wsmith').user
+        self.client.force_authenticate(user=user)
+        with self.settings(CACHES={'default': {
+                'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                'LOCATION': 'test_not_modified'}}):
+            for url in ['/api/storefront/', '/api/metadata/']:
+                response = self.client.get(url, format='json')
+                self.assertEqual(response.status_code, 200)
+                etag = response['ETag']
+                response = self.client.get(url, format='json',
+                    HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, 304)
+
+                category = models.Category.objects.first()
+                category.save()
+                listing = models.Listing.objects.first()
+                listing.save()
+                response = self.client.get(url, format='json',
+                    HTTP_IF_NONE_MATCH=etag)
+                self.assertEqual(response.status_code, 200)
+
+    def test_no_etag_without_cache(self):
+        # the default (dummy) cache keeps no counters to validate against
+        user = generic_model_access.get_profile('wsmith').user
+        self.client.force_authenticate(user=user)
+        response = self.client.get('/api/storefront/', format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.has_header('ETag'))
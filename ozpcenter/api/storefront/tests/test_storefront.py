@@ -45,6 +45,26 @@ class StorefrontTest(TestCase):
         for i in data['most_popular']:
             self.assertEqual(i.approval_status, models.Listing.APPROVED)
 
+    def test_get_storefront_sections(self):
+        data = model_access.get_storefront('wsmith')
+        listings = models.Listing.objects.for_user('wsmith').filter(
+            approval_status=models.Listing.APPROVED, is_enabled=True,
+            is_deleted=False)
+
+        featured = listings.filter(is_featured=True).order_by('id')[:12]
+        self.assertEqual([i.id for i in data['featured']],
+            [i.id for i in featured])
+
+        recent = listings.order_by('-approved_date')[:24]
+        self.assertEqual([i.approved_date for i in data['recent']],
+            [i.approved_date for i in recent])
+
+        most_popular = listings.order_by('-popularity_score', '-total_reviews')[:36]
+        self.assertEqual(len(data['most_popular']), len(most_popular))
+        self.assertEqual(
+            [(i.popularity_score, i.total_reviews) for i in data['most_popular']],
+            [(i.popularity_score, i.total_reviews) for i in most_popular])
+
     def test_get_metadata(self):
         """
         test for model_access.get_metadata()
@@ -74,3 +94,27 @@ class StorefrontTest(TestCase):
         keys = list(listing_types[0].keys()).sort()
         expected_keys = ['title', 'description'].sort()
         self.assertEqual(keys, expected_keys)
+
+    def _expected_agency_counts(self, username):
+        listings = models.Listing.objects.for_user(username).filter(
+            approval_status=models.Listing.APPROVED)
+        return {agency.title: listings.filter(agency=agency).count()
+                for agency in models.Agency.objects.all()}
+
+    def test_get_metadata_counts(self):
+        with self.settings(CACHES={'default': {
+                'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}):
+            # the counts of one user aren't served to another
+            for username in ['wsmith', 'jones', 'wsmith']:
+                metadata = model_access.get_metadata(username)
+                self.assertEqual(
+                    {i['title']: i['listing_count'] for i in metadata['agencies']},
+                    self._expected_agency_counts(username))
+
+            # the static parts are refreshed when edited
+            category = models.Category.objects.get(title='Communication')
+            category.title = 'Messaging'
+            category.save()
+            titles = [i['title'] for i in model_access.get_metadata('wsmith')['categories']]
+            self.assertTrue('Messaging' in titles)
+            self.assertFalse('Communication' in titles)
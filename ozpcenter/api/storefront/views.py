@@ -7,13 +7,14 @@ most popular)
 """
 import logging
 
+from django.views.decorators.http import condition
 from rest_framework.decorators import api_view
 from rest_framework.decorators import permission_classes
 from rest_framework.response import Response
 
+from ozpcenter import conditional
 from ozpcenter import permissions
 import ozpcenter.api.storefront.model_access as model_access
-import ozpcenter.api.storefront.serializers as serializers
 
 # Get an instance of a logger
 logger = logging.getLogger('ozp-center.' + str(__name__))
@@ -21,6 +22,7 @@ logger = logging.getLogger('ozp-center.' + str(__name__))
 
 @api_view(['GET'])
 @permission_classes((permissions.IsUser, ))
+@condition(etag_func=conditional.metadata_etag)
 def MetadataView(request):
     """
     Metadata for the store including categories, agencies, contact types,
@@ -32,13 +34,12 @@ def MetadataView(request):
 
 @api_view(['GET'])
 @permission_classes((permissions.IsUser, ))
+@condition(etag_func=conditional.storefront_etag)
 def StorefrontView(request):
     """
     Featured, recent, and most popular listings
     ---
     serializer: ozpcenter.api.storefront.serializers.StorefrontSerializer
     """
-    data = model_access.get_storefront(request.user)
-    serializer = serializers.StorefrontSerializer(data,
-        context={'request': request})
-    return Response(serializer.data)
+    data = model_access.get_serialized_storefront(request)
+    return Response(data)
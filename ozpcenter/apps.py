@@ -0,0 +1,12 @@
+"""
+App configuration for ozpcenter
+"""
+from django.apps import AppConfig
+
+
+class OzpcenterConfig(AppConfig):
+    name = 'ozpcenter'
+
+    def ready(self):
+        # connect the signal handlers
+        import ozpcenter.signals  # noqa
@@ -0,0 +1,248 @@
+"""
+Cache layer
+
+Results are cached as plain data - the ids of the rows a query found, or the
+field values of a model instance - rather than as QuerySets (pickling a lazy
+QuerySet caches no rows) or whole instances (with their related objects)
+
+Invalidation:
+    Every model that cached results depend on has a generation counter in
+    the cache. The handlers in ozpcenter.signals bump it when an instance is
+    saved or deleted, or one of its many-to-many relations changes, and code
+    that updates rows in bulk bumps it itself. The key of each entry includes
+    the generations of the models it was computed from, so after a change
+    the old entries are never read again (and expire on their own)
+
+    Besides models, there is a generation for the listing catalog as a whole
+    (CATALOG). The time of the last bump of each generation is kept too, for Last-Modified
+    dates (see get_last_modified)
+
+Statistics:
+    The hits, misses, and time spent are counted per key prefix, in each
+    process (see get_stats)
+
+Only the basic cache API (get, get_many, set, add, incr) is used, and the
+cached values are plain lists and tuples, so any Django cache backend works
+(local memory, file, memcached, etc)
+"""
+import collections
+import datetime
+import hashlib
+import logging
+import re
+import threading
+import time
+
+from django.core.cache import cache
+from django.db import router
+
+# Get an instance of a logger
+logger = logging.getLogger('ozp-center.' + str(__name__))
+
+# id lists longer than this aren't cached: filtering on a long list of ids is
+# slower than the query it replaces (and SQLite allows 999 parameters)
+MAX_IDS = 900
+
+# the parts of longer keys (or keys with unsafe characters) are hashed
+MAX_KEY_PARTS_LENGTH = 100
+
+# cached in place of an id list that was too long
+TOO_MANY_IDS = 'too_many_ids'
+
+# generation of the listing catalog as a whole (see
+# model_access.get_catalog_version)
+CATALOG = 'catalog'
+
+
+def model_label(model):
+    if isinstance(model, str):
+        # a generation that isn't a model's (like CATALOG)
+        return model
+    return '{0!s}.{1!s}'.format(model._meta.app_label, model._meta.object_name)
+
+
+def _generation_key(model):
+    return 'generation:{0!s}'.format(model_label(model))
+
+
+def get_generations(models):
+    """
+    Get the current generation of each model
+
+    Key: generation:<app_label>.<model name>
+    """
+    keys = [_generation_key(i) for i in models]
+    generations = cache.get_many(keys)
+    missing = [i for i in keys if i not in generations]
+    if missing:
+        # start from the time rather than 0 so that an evicted generation is
+        # never reused
+        for key in missing:
+            cache.add(key, int(time.time() * 1000000), None)
+        generations.update(cache.get_many(missing))
+    return [generations.get(i, 0) for i in keys]
+
+
+def _modified_key(model):
+    return 'modified:{0!s}'.format(model_label(model))
+
+
+def get_last_modified(models):
+    """
+    Get the time (UTC) any of the models was last changed, or None if it
+    isn't known, or is too recent to tell apart from an earlier change in
+    the same second (HTTP dates have a resolution of one second)
+
+    If a time was evicted, the models are taken to have changed now
+
+    Key: modified:<app_label>.<model name>
+    """
+    keys = [_modified_key(i) for i in models]
+    times = cache.get_many(keys)
+    missing = [i for i in keys if i not in times]
+    if missing:
+        for key in missing:
+            cache.add(key, time.time(), None)
+        times.update(cache.get_many(missing))
+    if not keys or len(times) < len(keys):
+        return None
+    last_modified = max(times.values())
+    if time.time() - last_modified < 1:
+        return None
+    return datetime.datetime.utcfromtimestamp(int(last_modified))
+
+
+def bump_generation(model):
+    """
+    Mark all cached results that depend on a model as stale
+    """
+    key = _generation_key(model)
+    try:
+        cache.incr(key)
+    except ValueError:
+        # not set (or evicted)
+        cache.set(key, int(time.time() * 1000000), None)
+    cache.set(_modified_key(model), time.time(), None)
+
+
+def make_key(prefix, parts, depends_on):
+    """
+    Make the key of a cached result
+
+    Args:
+        prefix: name of the kind of result (statistics are kept per prefix)
+        parts: the arguments the result was computed from
+        depends_on: the models the result was computed from
+
+    Key: <prefix>:<generations of depends_on>:<parts>
+    """
+    generations = '.'.join(str(i) for i in get_generations(depends_on))
+    parts = ':'.join(str(i) for i in parts)
+    if (len(parts) > MAX_KEY_PARTS_LENGTH or
+            not re.match(r'^[a-zA-Z0-9_.:-]*$', parts)):
+        parts = hashlib.md5(parts.encode('utf-8')).hexdigest()
+    return '{0!s}:{1!s}:{2!s}'.format(prefix, generations, parts)
+
+
+_stats = collections.defaultdict(lambda: {'hits': 0, 'misses': 0,
+    'hit_seconds': 0.0, 'miss_seconds': 0.0})
+_stats_lock = threading.Lock()
+
+
+def _record(prefix, hit, seconds):
+    with _stats_lock:
+        stats = _stats[prefix]
+        if hit:
+            stats['hits'] += 1
+            stats['hit_seconds'] += seconds
+        else:
+            stats['misses'] += 1
+            stats['miss_seconds'] += seconds
+
+
+def get_stats():
+    """
+    Get the statistics of each key prefix in this process
+
+    Returns:
+        {
+            <prefix>: {
+                "hits": <num>,
+                "misses": <num>,
+                "hit_seconds": <total time spent on hits>,
+                "miss_seconds": <total time spent on misses (computing)>
+            },
+            ...
+        }
+    """
+    with _stats_lock:
+        return {prefix: dict(stats) for prefix, stats in _stats.items()}
+
+
+def reset_stats():
+    with _stats_lock:
+        _stats.clear()
+
+
+def get_or_compute(prefix, parts, depends_on, compute):
+    """
+    Get a cached result, or compute and cache it
+
+    compute() must return plain (picklable) data. None is returned as is,
+    and isn't cached
+    """
+    start = time.time()
+    key = make_key(prefix, parts, depends_on)
+    data = cache.get(key)
+    if data is not None:
+        _record(prefix, True, time.time() - start)
+        return data
+    data = compute()
+    if data is not None:
+        cache.set(key, data)
+    _record(prefix, False, time.time() - start)
+    return data
+
+
+def cached_queryset(prefix, parts, depends_on, queryset):
+    """
+    Get a QuerySet of the rows of queryset, found with a cached list of their
+    ids
+
+    The rows themselves are still read from the database, so they are
+    current, but the query that found them isn't repeated. If there are
+    more than MAX_IDS rows, queryset is returned as is
+    """
+    def compute():
+        ids = list(queryset.order_by().values_list('id', flat=True)[:MAX_IDS + 1])
+        return TOO_MANY_IDS if len(ids) > MAX_IDS else ids
+
+    ids = get_or_compute(prefix, parts, depends_on, compute)
+    if ids == TOO_MANY_IDS:
+        return queryset
+    return queryset.model._default_manager.filter(id__in=ids)
+
+
+def cached_instance(model, prefix, parts, get_instance, depends_on=None):
+    """
+    Get a model instance, cached as the values of its fields
+
+    Related objects aren't cached (they are loaded when used)
+
+    Args:
+        get_instance: returns the instance (or None if there is none)
+        depends_on: the models the instance was found with (model by
+            default)
+    """
+    field_names = [i.attname for i in model._meta.concrete_fields]
+
+    def compute():
+        instance = get_instance()
+        if instance is None:
+            return None
+        return tuple(getattr(instance, i) for i in field_names)
+
+    values = get_or_compute(prefix, parts, depends_on or [model], compute)
+    if values is None:
+        return None
+    return model.from_db(router.db_for_read(model), field_names, values)
@@ -0,0 +1,136 @@
+"""
+Conditional GET
+
+Read endpoints that are fetched on every page view send an ETag, computed
+from counters and dates rather than from the response. With
+django.views.decorators.http.condition, a request whose If-None-Match (or
+If-Modified-Since) matches gets a 304 before anything is queried or
+serialized
+
+A Last-Modified date is only sent for responses that are the same for every
+user and only depend on some models (agencies, categories): it is the time
+the last of them changed (see caching.get_last_modified). Other responses
+can change without any date changing (a listing is bookmarked, the caller's
+access changes), so If-Modified-Since would give stale 304s
+
+The validators are made of:
+    * the cache generations of the models a response is built from (see
+        ozpcenter.caching)
+    * the catalog version, for responses built from many listings (see
+        model_access.get_catalog_version)
+    * the caller's visibility class, for responses that depend on what the
+        caller can see
+    * a listing's edited_date, for a single listing
+
+Each function takes the arguments of the view it validates
+"""
+import hashlib
+import json
+import logging
+
+from ozpcenter import caching
+from ozpcenter import models
+import ozpcenter.model_access as generic_model_access
+
+# Get an instance of a logger
+logger = logging.getLogger('ozp-center.' + str(__name__))
+
+# the models the metadata is built from (see storefront model_access)
+METADATA_MODELS = [models.Category, models.Agency, models.ListingType,
+                   models.ContactType, models.Intent]
+
+
+def make_etag(*parts):
+    """
+    Make an ETag (without quotes) from JSON serializable parts
+    """
+    data = json.dumps(parts, default=str, sort_keys=True)
+    return hashlib.md5(data.encode('utf-8')).hexdigest()
+
+
+def _get_visibility_class(request):
+    profile = generic_model_access.get_profile(request.user.username)
+    return profile.visibility_class if profile else None
+
+
+def _get_counters(dependencies, catalog=False):
+    """
+    Get the generations of models (and the catalog version), or None if the
+    cache doesn't keep them (like DummyCache) - then there is nothing to
+    validate against, and no ETag is sent
+    """
+    counters = caching.get_generations(dependencies)
+    if catalog:
+        counters.append(generic_model_access.get_catalog_version())
+    if not all(counters):
+        return None
+    return counters
+
+
+def model_etag(*dependencies):
+    """
+    Make an ETag function for views that only depend on some models (and
+    the path and query string)
+    """
+    def etag(request, *args, **kwargs):
+        counters = _get_counters(dependencies)
+        if counters is None:
+            return None
+        return make_etag('models', counters, request.get_full_path())
+    return etag
+
+
+def model_last_modified(*dependencies):
+    """
+    Make a Last-Modified function for views that only depend on some models
+    """
+    def last_modified(request, *args, **kwargs):
+        return caching.get_last_modified(dependencies)
+    return last_modified
+
+
+def _get_listing_edited_date(request, pk):
+    try:
+        return models.Listing.objects.for_user(request.user.username).filter(
+            id=int(pk)).values_list('edited_date', flat=True).first()
+    except (TypeError, ValueError):
+        return None
+
+
+def listing_etag(request, pk=None, *args, **kwargs):
+    """
+    ETag of a listing: its edited date, the counters of the related objects
+    it is rendered with (ratings, the caller's bookmark), and the caller's
+    visibility class
+
+    Not the Profile generation: profiles are saved whenever their users log
+    in, which would change every listing's ETag
+    """
+    counters = _get_counters([models.Listing, models.Review,
+        models.ApplicationLibraryEntry], catalog=True)
+    edited_date = _get_listing_edited_date(request, pk)
+    if counters is None or edited_date is None:
+        return None
+    return make_etag('listing', pk, edited_date, request.user.username,
+        _get_visibility_class(request), counters)
+
+
+def storefront_etag(request, *args, **kwargs):
+    """
+    ETag of the storefront (see storefront model_access.get_serialized_storefront)
+    """
+    counters = _get_counters([], catalog=True)
+    if counters is None:
+        return None
+    return make_etag('storefront', counters, _get_visibility_class(request),
+        request.get_host())
+
+
+def metadata_etag(request, *args, **kwargs):
+    """
+    ETag of the metadata (see storefront model_access.get_metadata)
+    """
+    counters = _get_counters(METADATA_MODELS, catalog=True)
+    if counters is None:
+        return None
+    return make_etag('metadata', counters, _get_visibility_class(request))
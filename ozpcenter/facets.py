@@ -0,0 +1,313 @@
+"""
+Listing facet index
+
+Browsing the catalog filters Listings by category, agency, listing type, and
+tag. Instead of joining each of these relations on every request, each
+process keeps an in-memory index of them: for every value of every facet, the
+set of Listings that have it, as a bitmap (a Python int with bit n set for
+Listing id n). Combining filters and counting the Listings of each facet
+value are then bitwise operations on a few ints
+
+The index only narrows down Listings - access control is still applied by
+the database (Listing.objects.for_user), so a slightly stale index can't
+expose anything
+
+Keeping the index up to date:
+    The handlers in ozpcenter.signals call record_change whenever a Listing's
+    facets change (or a facet value is renamed or deleted), which appends a
+    row to the ListingChange table. Before each use, get_index reads the rows
+    added since the index was last synced (a single indexed query) and only
+    reloads the Listings they name. Since the log is in the database, changes
+    made by other processes are picked up too, and changes that are rolled
+    back are detected (each row has a random token) and cause a rebuild
+
+    Ids are handed out before a transaction commits, so a row can show up
+    after rows with higher ids. The last RECHECK_CHANGES ids are read again
+    on each sync, and rows not applied yet are applied then
+
+    An index is never changed once get_index has returned it (other threads
+    may be reading it): changes are applied to a copy, which then replaces it
+
+Facets (the keys of filter_listings' filter_params):
+    * categories: category titles
+    * agencies: agency short names
+    * listing_types: listing type titles
+    * tags: tag names
+"""
+import collections
+import logging
+import threading
+import uuid
+
+from ozpcenter import model_access as generic_model_access
+from ozpcenter import models
+
+# Get an instance of a logger
+logger = logging.getLogger('ozp-center.' + str(__name__))
+
+FACETS = ['categories', 'agencies', 'listing_types', 'tags']
+
+# when the ListingChange table grows past this many rows, the older ones are
+# deleted (indexes that haven't synced them are rebuilt)
+MAX_CHANGES = 1000
+
+# changes are read again until this many later ids have been handed out, in
+# case they were committed after them
+RECHECK_CHANGES = 100
+
+
+def to_bitmap(ids):
+    """
+    Make a bitmap of ids
+    """
+    ids = list(ids)
+    if not ids:
+        return 0
+    data = bytearray(max(ids) // 8 + 1)
+    for i in ids:
+        data[i // 8] |= 1 << (i % 8)
+    return int.from_bytes(bytes(data), 'little')
+
+
+def from_bitmap(bitmap):
+    """
+    Get the ids in a bitmap, in ascending order
+    """
+    ids = []
+    data = bitmap.to_bytes((bitmap.bit_length() + 7) // 8, 'little')
+    for index, byte in enumerate(data):
+        if byte:
+            for bit in range(8):
+                if byte & (1 << bit):
+                    ids.append(index * 8 + bit)
+    return ids
+
+
+def count_bitmap(bitmap):
+    return bin(bitmap).count('1')
+
+
+class FacetIndex(object):
+    """
+    The facet bitmaps of all Listings
+    """
+
+    def __init__(self):
+        # {facet: {value: bitmap}}
+        self.bitmaps = {facet: collections.defaultdict(int) for facet in FACETS}
+        # {listing_id: {facet: [values]}}, to remove a Listing's old values
+        self.listing_values = {}
+        # {id: token} of the ListingChanges applied, down to RECHECK_CHANGES
+        # below the last one
+        self.changes = {}
+
+    def copy(self):
+        """
+        Copy the index, to apply changes to
+        """
+        index = FacetIndex()
+        for facet in FACETS:
+            index.bitmaps[facet].update(self.bitmaps[facet])
+        # the values of a Listing are replaced, never changed
+        index.listing_values = dict(self.listing_values)
+        index.changes = dict(self.changes)
+        return index
+
+    def get_last_change_id(self):
+        return max(self.changes) if self.changes else 0
+
+    def add_changes(self, changes):
+        """
+        Mark ListingChanges as applied: [(id, token), ...]
+        """
+        self.changes.update(changes)
+        low = self.get_last_change_id() - RECHECK_CHANGES
+        self.changes = {change_id: token for change_id, token in
+                        self.changes.items() if change_id > low}
+
+    def load(self, listing_ids=None):
+        """
+        (Re)load the facets of Listings (all of them if None)
+        """
+        listings = models.Listing.objects.order_by()
+        if listing_ids is not None:
+            listing_ids = list(listing_ids)
+            listings = listings.filter(id__in=listing_ids)
+            for listing_id in listing_ids:
+                self._remove(listing_id)
+
+        values = collections.defaultdict(lambda: {facet: [] for facet in FACETS})
+        for listing_id, agency, listing_type in listings.values_list(
+                'id', 'agency__short_name', 'listing_type__title'):
+            if agency is not None:
+                values[listing_id]['agencies'].append(agency)
+            if listing_type is not None:
+                values[listing_id]['listing_types'].append(listing_type)
+            # Listings without any facet still need an entry
+            values[listing_id]
+        for facet, related in [('categories', 'categories__title'),
+                               ('tags', 'tags__name')]:
+            for listing_id, value in listings.filter(**{related + '__isnull': False}).values_list(
+                    'id', related):
+                values[listing_id][facet].append(value)
+
+        for listing_id, listing_values in values.items():
+            self.listing_values[listing_id] = listing_values
+            bit = 1 << listing_id
+            for facet, facet_values in listing_values.items():
+                for value in facet_values:
+                    self.bitmaps[facet][value] |= bit
+
+    def _remove(self, listing_id):
+        listing_values = self.listing_values.pop(listing_id, None)
+        if listing_values is None:
+            return
+        mask = ~(1 << listing_id)
+        for facet, facet_values in listing_values.items():
+            for value in facet_values:
+                bitmap = self.bitmaps[facet][value] & mask
+                if bitmap:
+                    self.bitmaps[facet][value] = bitmap
+                else:
+                    del self.bitmaps[facet][value]
+
+    def _facet_bitmap(self, facet, values, match_all=False):
+        """
+        Get the Listings with any (or all) of the given values of a facet
+        """
+        bitmaps = [self.bitmaps[facet].get(value, 0) for value in values]
+        bitmap = bitmaps[0]
+        for i in bitmaps[1:]:
+            bitmap = bitmap & i if match_all else bitmap | i
+        return bitmap
+
+    def match(self, filter_params, candidates, exclude_facet=None):
+        """
+        Get the candidate Listings matching filter_params
+
+        Listings must match every facet in filter_params, and any of the values
+        given for each facet - except for categories when
+        filter_params['category_logic'] is 'and', which must all match
+
+        Args:
+            filter_params: see filter_listings
+            candidates: bitmap of Listings to choose from
+            exclude_facet: facet of filter_params to ignore
+        Returns:
+            bitmap of the matching Listings
+        """
+        bitmap = candidates
+        for facet in FACETS:
+            values = filter_params.get(facet)
+            if not values or facet == exclude_facet:
+                continue
+            match_all = (facet == 'categories' and
+                         filter_params.get('category_logic') == 'and')
+            bitmap &= self._facet_bitmap(facet, values, match_all)
+        return bitmap
+
+    def get_counts(self, filter_params, candidates):
+        """
+        Count the matching Listings of every facet value
+
+        The counts of a facet apply the filters of the other facets, but not
+        its own, so that they are the number of results each value would have
+        if it were (also) selected
+
+        Returns:
+            {
+                "total": <matching listings>,
+                <facet>: {<value>: <count>, ...},
+                ...
+            }
+        """
+        data = {'total': count_bitmap(self.match(filter_params, candidates))}
+        for facet in FACETS:
+            bitmap = self.match(filter_params, candidates, exclude_facet=facet)
+            counts = {}
+            for value, value_bitmap in self.bitmaps[facet].items():
+                count = count_bitmap(value_bitmap & bitmap)
+                if count:
+                    counts[value] = count
+            data[facet] = counts
+        return data
+
+
+_index = None
+_lock = threading.Lock()
+
+
+def _get_changes(since_id):
+    """
+    Get the [(id, token, listing_id), ...] of the ListingChanges that may not
+    have been applied by an index that applied since_id
+    """
+    return list(models.ListingChange.objects.filter(
+        id__gt=since_id - RECHECK_CHANGES).order_by('id').values_list(
+        'id', 'token', 'listing_id'))
+
+
+def _build():
+    index = FacetIndex()
+    # changes recorded while loading are applied again on the next sync
+    last_id = models.ListingChange.objects.order_by('-id').values_list(
+        'id', flat=True).first()
+    if last_id is not None:
+        index.add_changes(i[:2] for i in _get_changes(last_id))
+    index.load()
+    return index
+
+
+def get_index():
+    """
+    Get this process's FacetIndex, synced with the ListingChange log
+    """
+    global _index
+    with _lock:
+        if _index is None:
+            _index = _build()
+            return _index
+
+        last_id = _index.get_last_change_id()
+        changes = _get_changes(last_id)
+        found = {change_id: token for change_id, token, _ in changes}
+        # the changes applied must still be there (they're gone if they were
+        # rolled back), and the ones not seen yet mustn't have been pruned
+        if (any(found.get(change_id) != token
+                for change_id, token in _index.changes.items()) or
+                (changes and changes[-1][0] - last_id >= MAX_CHANGES)):
+            _index = _build()
+            return _index
+        changes = [i for i in changes if i[0] not in _index.changes]
+        if not changes:
+            return _index
+
+        listing_ids = set()
+        for change_id, token, listing_id in changes:
+            if listing_id is None:
+                _index = _build()
+                return _index
+            listing_ids.add(listing_id)
+        index = _index.copy()
+        index.load(listing_ids)
+        index.add_changes(i[:2] for i in changes)
+        _index = index
+        return _index
+
+
+def record_change(listing_ids=None):
+    """
+    Mark the facets of Listings (all of them if None) as changed
+    """
+    if listing_ids is None:
+        change_ids = [None]
+    else:
+        change_ids = sorted(set(listing_ids))
+    if not change_ids:
+        return
+    changes = generic_model_access.bulk_create_with_ids(models.ListingChange,
+        [models.ListingChange(listing_id=listing_id, token=uuid.uuid4().hex)
+         for listing_id in change_ids])
+    last_id = max(i.id for i in changes)
+    if last_id % MAX_CHANGES < len(change_ids):
+        models.ListingChange.objects.filter(id__lte=last_id - MAX_CHANGES).delete()
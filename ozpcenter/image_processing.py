@@ -0,0 +1,167 @@
+"""
+Image variants
+
+When an image is uploaded (see models.Image.create_image), resized copies
+of it are made for the sizes its ImageType is displayed at (IMAGE_VARIANTS),
+so that clients don't download a full size original to show a 16px icon.
+With OZP['IMAGE_WEBP'], a WebP copy of the original and of each variant is
+made too
+
+Clients ask for one with /api/image/<id>/?variant=<name>&format=webp. A
+variant that wasn't made (the original already fit, or WebP is off or not
+supported by Pillow) is served as the next best file (see get_variant_paths)
+
+Files (next to the original, see ozpcenter.media_storage):
+    <name>.<ext>                        original
+    <name>_<width>x<height>.<ext>       variant
+    <name>[_<width>x<height>].webp      WebP copies
+
+Variants are named by their size rather than by the variant name, so an
+image stored once for several image types shares the variants they have in
+common
+
+Resizing is CPU bound, so the variants are made in parallel in a pool of
+OZP['IMAGE_PROCESS_WORKERS'] processes (0 to make them in the calling
+process). Workers only get file paths, never database objects
+"""
+import concurrent.futures
+import logging
+import os
+import threading
+
+from django.conf import settings
+from PIL import Image
+
+# Get an instance of a logger
+logger = logging.getLogger('ozp-center.' + str(__name__))
+
+# the sizes (width, height) that the variants of each image type fit in.
+# Images keep their aspect ratio, and are never enlarged
+IMAGE_VARIANTS = {
+    'small_icon': {'display': (16, 16)},
+    'large_icon': {'display': (32, 32)},
+    'banner_icon': {'display': (220, 137)},
+    'large_banner_icon': {'display': (600, 376), 'thumbnail': (220, 137)},
+    'small_screenshot': {'display': (600, 376), 'thumbnail': (220, 137)},
+    'large_screenshot': {'display': (960, 600), 'thumbnail': (220, 137)},
+    'intent_icon': {'display': (16, 16)},
+    'agency_icon': {'display': (32, 32)},
+}
+
+WEBP = 'webp'
+
+# Pillow format names by file extension
+FORMATS = {
+    'png': 'PNG',
+    'jpg': 'JPEG',
+    'jpeg': 'JPEG',
+    'gif': 'GIF',
+    WEBP: 'WEBP',
+}
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_variants(image_type):
+    """
+    Get the variants of an image type: {<name>: (<width>, <height>), ...}
+    """
+    return IMAGE_VARIANTS.get(str(image_type), {})
+
+
+def get_variant_path(image_path, size=None, file_extension=None):
+    """
+    Get the path of a variant of the image at image_path (the original if
+    size is None)
+    """
+    base, extension = os.path.splitext(image_path)
+    if size:
+        base = '{0!s}_{1:d}x{2:d}'.format(base, size[0], size[1])
+    if file_extension:
+        extension = '.' + file_extension
+    return base + extension
+
+
+def get_variant_paths(image_path, size=None, file_extension=None):
+    """
+    Get the paths to try for a variant, best first: the variant in the
+    requested format, the variant, the original in the requested format,
+    and the original
+    """
+    paths = []
+    for i in [size, None]:
+        for extension in [file_extension, None]:
+            path = get_variant_path(image_path, i, extension)
+            if path not in paths:
+                paths.append(path)
+    return paths
+
+
+def _make_variant(source_path, dest_path, size, image_format):
+    """
+    Write a resized (or re-encoded) copy of an image file
+
+    Runs in a worker process
+
+    Returns:
+        dest_path, or None if there was no need for it (the image already
+        fits in size and is in that format) or it couldn't be written
+    """
+    try:
+        img = Image.open(source_path)
+        if size is not None:
+            if img.size[0] <= size[0] and img.size[1] <= size[1]:
+                if img.format == image_format:
+                    return None
+            else:
+                img.thumbnail(size, Image.ANTIALIAS)
+        if image_format == 'JPEG' and img.mode not in ('RGB', 'L'):
+            img = img.convert('RGB')
+        # written under another name first, so the file is never served
+        # half written
+        temp_path = '{0!s}.{1:d}.tmp'.format(dest_path, os.getpid())
+        img.save(temp_path, image_format)
+        os.rename(temp_path, dest_path)
+        return dest_path
+    except (IOError, KeyError, ValueError) as e:
+        # KeyError: this Pillow has no encoder for the format
+        logger.error('Could not write {0!s}: {1!s}'.format(dest_path, e))
+        return None
+
+
+def _get_executor():
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = concurrent.futures.ProcessPoolExecutor(
+                max_workers=settings.OZP.get('IMAGE_PROCESS_WORKERS'))
+        return _executor
+
+
+def make_variants(image_path, image_type, file_extension):
+    """
+    Make the variants of an uploaded image file (those that don't exist
+    yet), and wait for them
+
+    Returns:
+        the paths of the files that were written
+    """
+    sizes = sorted(set(get_variants(image_type).values()))
+    jobs = [(image_path, get_variant_path(image_path, size), size,
+             FORMATS[file_extension]) for size in sizes]
+    if settings.OZP.get('IMAGE_WEBP', False):
+        jobs += [(image_path, get_variant_path(image_path, size, WEBP), size,
+                  FORMATS[WEBP]) for size in [None] + sizes]
+    # the files of an image that was already stored are kept
+    jobs = [job for job in jobs if not os.path.exists(job[1])]
+    if not jobs:
+        return []
+
+    if settings.OZP.get('IMAGE_PROCESS_WORKERS', 0) == 0:
+        paths = [_make_variant(*job) for job in jobs]
+    else:
+        executor = _get_executor()
+        paths = [i.result() for i in
+            [executor.submit(_make_variant, *job) for job in jobs]]
+    return [i for i in paths if i]
@@ -0,0 +1,40 @@
+"""
+Check the ListingVisibility table against the access rules
+
+Usage:
+    python manage.py check_listing_visibility [--fix]
+
+Exits with an error if any rows are missing or stale
+"""
+from django.core.management.base import BaseCommand
+from django.core.management.base import CommandError
+
+from ozpcenter import visibility
+
+
+class Command(BaseCommand):
+    help = 'Check the table of the listings each user can see'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--fix', action='store_true', default=False,
+            help='Rebuild the table if it is out of date')
+
+    def handle(self, *args, **options):
+        missing, extra = visibility.check()
+        for profile_id, listing_id in sorted(missing):
+            self.stdout.write('Missing: profile {0:d} listing {1:d}'.format(
+                profile_id, listing_id))
+        for profile_id, listing_id in sorted(extra):
+            self.stdout.write('Stale: profile {0:d} listing {1:d}'.format(
+                profile_id, listing_id))
+
+        if not missing and not extra:
+            self.stdout.write('Listing visibility is consistent')
+            return
+
+        if options['fix']:
+            visibility.rebuild()
+            self.stdout.write('Rebuilt listing visibility')
+        else:
+            raise CommandError('Listing visibility is out of date: {0:d} missing, '
+                '{1:d} stale rows'.format(len(missing), len(extra)))
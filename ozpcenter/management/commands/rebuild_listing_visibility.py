@@ -0,0 +1,19 @@
+"""
+Recreate the ListingVisibility table from the access rules (and update the
+visibility class of each Profile)
+
+Usage:
+    python manage.py rebuild_listing_visibility
+"""
+from django.core.management.base import BaseCommand
+
+from ozpcenter import visibility
+
+
+class Command(BaseCommand):
+    help = 'Recreate the table of the listings each user can see'
+
+    def handle(self, *args, **options):
+        count = visibility.rebuild()
+        visibility.update_visibility_classes()
+        self.stdout.write('Created {0:d} listing visibility rows'.format(count))
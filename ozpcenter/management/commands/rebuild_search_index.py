@@ -0,0 +1,17 @@
+"""
+Recreate the search documents of all listings (and so the full-text index)
+
+Usage:
+    python manage.py rebuild_search_index
+"""
+from django.core.management.base import BaseCommand
+
+from ozpcenter import search
+
+
+class Command(BaseCommand):
+    help = 'Recreate the full-text search documents of the listings'
+
+    def handle(self, *args, **options):
+        count = search.rebuild()
+        self.stdout.write('Created {0:d} listing search documents'.format(count))
@@ -0,0 +1,18 @@
+"""
+Recompute the rating counters and average rating of every listing from its
+reviews (to repair counters that drifted)
+
+Usage:
+    python manage.py recompute_ratings
+"""
+from django.core.management.base import BaseCommand
+
+import ozpcenter.api.listing.model_access as listing_model_access
+
+
+class Command(BaseCommand):
+    help = 'Recompute the ratings of all listings from their reviews'
+
+    def handle(self, *args, **options):
+        count = listing_model_access.recompute_ratings()
+        self.stdout.write('Updated the ratings of {0:d} listings'.format(count))
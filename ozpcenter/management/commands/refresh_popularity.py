@@ -0,0 +1,19 @@
+"""
+Recompute the popularity score of every listing (see ozpcenter.ranking). The
+scores drift as the mean rating of all listings changes, so run this on a
+schedule
+
+Usage:
+    python manage.py refresh_popularity
+"""
+from django.core.management.base import BaseCommand
+
+import ozpcenter.api.listing.model_access as listing_model_access
+
+
+class Command(BaseCommand):
+    help = 'Recompute the popularity scores of all listings'
+
+    def handle(self, *args, **options):
+        count = listing_model_access.refresh_popularity()
+        self.stdout.write('Updated the popularity of {0:d} listings'.format(count))
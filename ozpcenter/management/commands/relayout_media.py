@@ -0,0 +1,19 @@
+"""
+Move the files of images stored as <MEDIA_ROOT><id>_<image type>.<ext>
+into the content addressed store (see ozpcenter.media_storage). Run once
+after upgrading; images that were already moved are skipped
+
+Usage:
+    python manage.py relayout_media
+"""
+from django.core.management.base import BaseCommand
+
+import ozpcenter.api.image.model_access as image_model_access
+
+
+class Command(BaseCommand):
+    help = 'Move image files into the content addressed store'
+
+    def handle(self, *args, **options):
+        count = image_model_access.relayout_legacy_images()
+        self.stdout.write('Moved {0:d} images'.format(count))
@@ -0,0 +1,27 @@
+"""
+Remove the image files that no Image refers to (see
+ozpcenter.media_storage). Deleting an image removes its files right away,
+unless another image has the same contents or the files were only just
+stored, so run this on a schedule to catch the rest
+
+Usage:
+    python manage.py sweep_media [--dry-run]
+"""
+from django.core.management.base import BaseCommand
+
+import ozpcenter.api.image.model_access as image_model_access
+
+
+class Command(BaseCommand):
+    help = 'Remove orphaned image files'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', default=False,
+            help='Count the orphaned files without removing them')
+
+    def handle(self, *args, **options):
+        count = image_model_access.sweep_orphaned_files(options['dry_run'])
+        if options['dry_run']:
+            self.stdout.write('Found {0:d} orphaned files'.format(count))
+        else:
+            self.stdout.write('Removed {0:d} orphaned files'.format(count))
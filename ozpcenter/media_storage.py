@@ -0,0 +1,202 @@
+"""
+Content addressed media storage
+
+Image files are stored under the SHA-256 of their contents, in a fan-out
+directory tree so that no directory gets too large:
+    <MEDIA_ROOT>ab/cd/abcd...<rest of the hash>.<ext>
+
+The variants of an image (see ozpcenter.image_processing) are stored next
+to it. Identical files uploaded many times (like the icons of many
+listings) are stored once: Image rows refer to their file by content_hash,
+and a file is removed when the last row that refers to it is deleted (see
+ozpcenter.signals), or later by the sweep_media command
+
+Images created before content addressing have no content_hash, and are
+stored as <MEDIA_ROOT><id>_<image type>.<ext> until the relayout_media
+command moves them
+
+Files are written under a temporary name and renamed, so a file is never
+seen half written. Files younger than GRACE_SECONDS are never removed, as
+an upload of the same contents may be about to refer to them
+"""
+import glob
+import hashlib
+import logging
+import os
+import re
+import time
+
+from django.conf import settings
+
+# Get an instance of a logger
+logger = logging.getLogger('ozp-center.' + str(__name__))
+
+# directory levels, and hash characters per level
+SHARD_LEVELS = 2
+SHARD_WIDTH = 2
+
+GRACE_SECONDS = 60 * 60
+
+# <id>_<image type>[_<variant>].<ext>
+LEGACY_NAME_RE = re.compile(r'^(\d+)_([a-z_0-9]+)\.')
+
+
+def get_hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def get_directory(content_hash):
+    parts = [content_hash[i * SHARD_WIDTH:(i + 1) * SHARD_WIDTH]
+             for i in range(SHARD_LEVELS)]
+    return os.path.join(settings.MEDIA_ROOT, *parts)
+
+
+def get_path(content_hash, file_extension):
+    return os.path.join(get_directory(content_hash),
+        '{0!s}.{1!s}'.format(content_hash, file_extension))
+
+
+def get_legacy_path(image_id, image_type, file_extension):
+    """
+    Get the path of an image stored before content addressing
+    """
+    return os.path.join(settings.MEDIA_ROOT, '{0:d}_{1!s}.{2!s}'.format(
+        image_id, image_type, file_extension))
+
+
+def get_legacy_files(image_id, image_type):
+    """
+    Get the paths of all the files of an image stored before content
+    addressing (the original and its variants)
+    """
+    prefix = os.path.join(settings.MEDIA_ROOT, '{0:d}_{1!s}'.format(image_id,
+        image_type))
+    return glob.glob(prefix + '.*') + glob.glob(prefix + '_*')
+
+
+def iter_legacy_images():
+    """
+    Yield the (id, image type) of every image stored before content
+    addressing (each once)
+    """
+    seen = set()
+    for name in os.listdir(settings.MEDIA_ROOT):
+        match = LEGACY_NAME_RE.match(name)
+        if not match:
+            continue
+        image_id, image_type = int(match.group(1)), match.group(2)
+        # variants are named <id>_<image type>_<size>.<ext>
+        image_type = re.sub(r'_\d+x\d+$', '', image_type)
+        if (image_id, image_type) not in seen:
+            seen.add((image_id, image_type))
+            yield image_id, image_type
+
+
+def get_files(content_hash):
+    """
+    Get the paths of all the files stored for a hash (the original and its
+    variants)
+    """
+    return glob.glob(os.path.join(get_directory(content_hash),
+        content_hash + '*'))
+
+
+def store(data, file_extension):
+    """
+    Store a file, unless the same contents are already stored
+
+    Returns:
+        (content_hash, path)
+    """
+    content_hash = get_hash(data)
+    path = get_path(content_hash, file_extension)
+    if os.path.exists(path):
+        # refresh the grace period (see remove)
+        os.utime(path, None)
+        return content_hash, path
+
+    directory = os.path.dirname(path)
+    if not os.path.isdir(directory):
+        try:
+            os.makedirs(directory)
+        except OSError:
+            # made by another process meanwhile
+            if not os.path.isdir(directory):
+                raise
+    temp_path = '{0!s}.{1:d}.tmp'.format(path, os.getpid())
+    with open(temp_path, 'wb') as f:
+        f.write(data)
+    os.rename(temp_path, path)
+    return content_hash, path
+
+
+def move(source_path, file_extension):
+    """
+    Move an existing file into the store (removing it if the same contents
+    are already stored)
+
+    Returns:
+        (content_hash, path)
+    """
+    with open(source_path, 'rb') as f:
+        data = f.read()
+    content_hash = get_hash(data)
+    path = get_path(content_hash, file_extension)
+    if os.path.exists(path):
+        os.remove(source_path)
+        return content_hash, path
+    if not os.path.isdir(os.path.dirname(path)):
+        os.makedirs(os.path.dirname(path))
+    os.rename(source_path, path)
+    return content_hash, path
+
+
+def _is_old(path, now):
+    try:
+        return now - os.path.getmtime(path) > GRACE_SECONDS
+    except OSError:
+        # removed meanwhile
+        return False
+
+
+def remove_files(paths):
+    """
+    Remove files, unless any of them was just stored (and may be about to be
+    referred to)
+
+    Returns:
+        the number of files removed
+    """
+    now = time.time()
+    if not all(_is_old(i, now) for i in paths):
+        return 0
+    for path in paths:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+    return len(paths)
+
+
+def remove(content_hash):
+    """
+    Remove the files stored for a hash (call once no Image refers to it)
+
+    Returns:
+        the number of files removed
+    """
+    return remove_files(get_files(content_hash))
+
+
+def iter_hashes():
+    """
+    Yield the hash of every stored file (each once)
+    """
+    pattern = os.path.join(settings.MEDIA_ROOT,
+        *(['[0-9a-f]' * SHARD_WIDTH] * SHARD_LEVELS + ['*']))
+    seen = set()
+    for path in glob.iglob(pattern):
+        content_hash = os.path.basename(path).split('.')[0].split('_')[0]
+        if len(content_hash) == 64 and content_hash not in seen:
+            seen.add(content_hash)
+            yield content_hash
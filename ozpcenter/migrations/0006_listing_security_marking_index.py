@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ozpcenter', '0005_notification_agency'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='listing',
+            name='security_marking',
+            field=models.CharField(max_length=1024, blank=True, null=True, db_index=True),
+        ),
+    ]
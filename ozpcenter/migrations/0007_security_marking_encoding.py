@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+from plugins_util import plugin_manager
+
+
+def encode_existing_markings(apps, schema_editor):
+    """
+    Fill in the encoded markings and accesses of existing rows (new rows are
+    encoded on save)
+    """
+    access_control_instance = plugin_manager.get_system_access_control_plugin()
+    if not hasattr(access_control_instance, 'encode_marking'):
+        return
+
+    for model_name in ['Image', 'Listing']:
+        model = apps.get_model('ozpcenter', model_name)
+        markings = model.objects.order_by().values_list('security_marking',
+            flat=True).distinct()
+        for marking in markings:
+            level, mask = access_control_instance.encode_marking(marking)
+            model.objects.filter(security_marking=marking).update(
+                security_level=level, security_mask=mask)
+
+    Profile = apps.get_model('ozpcenter', 'Profile')
+    for profile in Profile.objects.all():
+        level, mask = access_control_instance.encode_user_accesses(profile.access_control)
+        Profile.objects.filter(id=profile.id).update(access_level=level,
+            access_mask=mask)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ozpcenter', '0006_listing_security_marking_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='image',
+            name='security_level',
+            field=models.IntegerField(blank=True, null=True, db_index=True),
+        ),
+        migrations.AddField(
+            model_name='image',
+            name='security_mask',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='listing',
+            name='security_level',
+            field=models.IntegerField(blank=True, null=True, db_index=True),
+        ),
+        migrations.AddField(
+            model_name='listing',
+            name='security_mask',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='profile',
+            name='access_level',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='profile',
+            name='access_mask',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+        migrations.RunPython(encode_existing_markings,
+            migrations.RunPython.noop),
+    ]
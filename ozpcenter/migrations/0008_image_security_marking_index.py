@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import models, migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ozpcenter', '0007_security_marking_encoding'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='image',
+            name='security_marking',
+            field=models.CharField(max_length=1024, db_index=True),
+        ),
+    ]
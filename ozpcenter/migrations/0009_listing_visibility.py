@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import collections
+
+from django.db import models, migrations
+
+from plugins_util import plugin_manager
+
+BATCH_SIZE = 500
+
+
+def _get_organization_ids(apps):
+    """
+    Get the Agencies whose private listings each profile can see:
+    {profile_id: frozenset of ids, or None for all of them}
+    """
+    Profile = apps.get_model('ozpcenter', 'Profile')
+    related = {}
+    for field in ['user__groups__name', 'organizations', 'stewarded_organizations']:
+        related[field] = collections.defaultdict(set)
+        for profile_id, value in Profile.objects.values_list('id', field):
+            if value is not None:
+                related[field][profile_id].add(value)
+
+    organization_ids = {}
+    for profile_id in Profile.objects.values_list('id', flat=True):
+        groups = related['user__groups__name'][profile_id]
+        if 'APPS_MALL_STEWARD' in groups:
+            organization_ids[profile_id] = None
+        elif 'ORG_STEWARD' in groups:
+            organization_ids[profile_id] = frozenset(
+                related['stewarded_organizations'][profile_id])
+        else:
+            organization_ids[profile_id] = frozenset(
+                related['organizations'][profile_id])
+    return organization_ids
+
+
+def build_listing_visibility(apps, schema_editor):
+    """
+    Materialize the visible listings of existing profiles (afterwards the
+    table is maintained incrementally, see ozpcenter.visibility)
+    """
+    Profile = apps.get_model('ozpcenter', 'Profile')
+    Listing = apps.get_model('ozpcenter', 'Listing')
+    ListingVisibility = apps.get_model('ozpcenter', 'ListingVisibility')
+
+    # profiles with the same accesses and organizations see the same listings
+    organization_ids = _get_organization_ids(apps)
+    profiles_by_key = collections.defaultdict(list)
+    for profile_id, access_control in Profile.objects.values_list('id',
+            'access_control'):
+        profiles_by_key[(access_control, organization_ids[profile_id])].append(
+            profile_id)
+
+    listings = list(Listing.objects.values_list('id', 'is_private', 'agency_id',
+        'security_marking'))
+    markings = {i[3] for i in listings}
+    access_control_instance = plugin_manager.get_system_access_control_plugin()
+
+    entries = []
+    for (access_control, agency_ids), profile_ids in profiles_by_key.items():
+        allowed_markings = {marking for marking in markings if
+            access_control_instance.has_access(access_control, marking)}
+        for listing_id, is_private, agency_id, marking in listings:
+            if marking not in allowed_markings:
+                continue
+            # private listings without an agency are visible to everyone
+            if (is_private and agency_ids is not None and
+                    agency_id is not None and agency_id not in agency_ids):
+                continue
+            entries.extend(ListingVisibility(profile_id=profile_id,
+                listing_id=listing_id) for profile_id in profile_ids)
+    ListingVisibility.objects.bulk_create(entries, batch_size=BATCH_SIZE)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ozpcenter', '0008_image_security_marking_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ListingVisibility',
+            fields=[
+                ('id', models.AutoField(verbose_name='ID', primary_key=True, serialize=False, auto_created=True)),
+                ('listing', models.ForeignKey(related_name='visibility_entries', to='ozpcenter.Listing')),
+                ('profile', models.ForeignKey(related_name='visibility_entries', to='ozpcenter.Profile')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='listingvisibility',
+            unique_together=set([('profile', 'listing')]),
+        ),
+        migrations.RunPython(build_listing_visibility,
+            migrations.RunPython.noop),
+    ]
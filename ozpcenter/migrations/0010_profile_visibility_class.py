@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import collections
+import hashlib
+import json
+
+from django.db import models, migrations
+
+
+def _normalize_access_control(access_control):
+    try:
+        accesses = json.loads(access_control)
+    except (TypeError, ValueError):
+        return access_control
+    if not isinstance(accesses, dict):
+        return access_control
+    accesses = {key: sorted(set(value)) if isinstance(value, list) else value
+                for key, value in accesses.items()}
+    return json.dumps(accesses, sort_keys=True)
+
+
+def set_visibility_classes(apps, schema_editor):
+    """
+    Fill in the visibility class of existing profiles (new profiles get
+    theirs on save), as computed by ozpcenter.visibility when this migration
+    was written
+    """
+    Profile = apps.get_model('ozpcenter', 'Profile')
+    related = {}
+    for field in ['user__groups__name', 'organizations', 'stewarded_organizations']:
+        related[field] = collections.defaultdict(set)
+        for profile_id, value in Profile.objects.values_list('id', field):
+            if value is not None:
+                related[field][profile_id].add(value)
+
+    for profile_id, access_control in Profile.objects.values_list('id',
+            'access_control'):
+        groups = related['user__groups__name'][profile_id]
+        if 'APPS_MALL_STEWARD' in groups:
+            organization_ids = None
+        elif 'ORG_STEWARD' in groups:
+            organization_ids = sorted(related['stewarded_organizations'][profile_id])
+        else:
+            organization_ids = sorted(related['organizations'][profile_id])
+        fingerprint = json.dumps([_normalize_access_control(access_control),
+            organization_ids])
+        Profile.objects.filter(id=profile_id).update(visibility_class=hashlib.sha1(
+            fingerprint.encode('utf-8')).hexdigest())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ozpcenter', '0009_listing_visibility'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='profile',
+            name='visibility_class',
+            field=models.CharField(max_length=40, blank=True, null=True, db_index=True),
+        ),
+        migrations.RunPython(set_visibility_classes,
+            migrations.RunPython.noop),
+    ]
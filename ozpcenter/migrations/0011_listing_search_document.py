@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import collections
+import logging
+
+from django.db import DatabaseError
+from django.db import models, migrations
+
+logger = logging.getLogger('ozp-center.' + str(__name__))
+
+BATCH_SIZE = 500
+
+SQLITE_CREATE_SQL = [
+    """CREATE VIRTUAL TABLE ozpcenter_listingsearchindex USING fts5(
+        title, tags, description_short, description,
+        content='ozpcenter_listingsearchdocument', content_rowid='listing_id',
+        tokenize="unicode61 tokenchars '_'")""",
+    """CREATE TRIGGER ozpcenter_listingsearchdocument_ai AFTER INSERT ON ozpcenter_listingsearchdocument BEGIN
+        INSERT INTO ozpcenter_listingsearchindex(rowid, title, tags, description_short, description)
+        VALUES (new.listing_id, new.title, new.tags, new.description_short,
+            new.description);
+    END""",
+    """CREATE TRIGGER ozpcenter_listingsearchdocument_ad AFTER DELETE ON ozpcenter_listingsearchdocument BEGIN
+        INSERT INTO ozpcenter_listingsearchindex(ozpcenter_listingsearchindex, rowid, title, tags, description_short,
+            description)
+        VALUES ('delete', old.listing_id, old.title, old.tags,
+            old.description_short, old.description);
+    END""",
+    """CREATE TRIGGER ozpcenter_listingsearchdocument_au AFTER UPDATE ON ozpcenter_listingsearchdocument BEGIN
+        INSERT INTO ozpcenter_listingsearchindex(ozpcenter_listingsearchindex, rowid, title, tags, description_short,
+            description)
+        VALUES ('delete', old.listing_id, old.title, old.tags,
+            old.description_short, old.description);
+        INSERT INTO ozpcenter_listingsearchindex(rowid, title, tags, description_short, description)
+        VALUES (new.listing_id, new.title, new.tags, new.description_short,
+            new.description);
+    END""",
+]
+
+SQLITE_DROP_SQL = [
+    'DROP TRIGGER IF EXISTS ozpcenter_listingsearchdocument_ai',
+    'DROP TRIGGER IF EXISTS ozpcenter_listingsearchdocument_ad',
+    'DROP TRIGGER IF EXISTS ozpcenter_listingsearchdocument_au',
+    'DROP TABLE IF EXISTS ozpcenter_listingsearchindex',
+]
+
+POSTGRESQL_CREATE_SQL = [
+    'ALTER TABLE ozpcenter_listingsearchdocument ADD COLUMN search_vector tsvector',
+    """CREATE FUNCTION ozpcenter_listingsearchdocument_update() RETURNS trigger AS $$
+    BEGIN
+        NEW.search_vector :=
+            setweight(to_tsvector('english', coalesce(NEW.title, '')), 'A') ||
+            setweight(to_tsvector('english', coalesce(NEW.tags, '')), 'B') ||
+            setweight(to_tsvector('english', coalesce(NEW.description_short, '')), 'C') ||
+            setweight(to_tsvector('english', coalesce(NEW.description, '')), 'D');
+        RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql""",
+    """CREATE TRIGGER ozpcenter_listingsearchdocument_update BEFORE INSERT OR UPDATE ON ozpcenter_listingsearchdocument
+        FOR EACH ROW EXECUTE PROCEDURE ozpcenter_listingsearchdocument_update()""",
+    'CREATE INDEX ozpcenter_listingsearchdocument_search_vector ON ozpcenter_listingsearchdocument USING gin(search_vector)',
+]
+
+POSTGRESQL_DROP_SQL = [
+    'DROP TRIGGER IF EXISTS ozpcenter_listingsearchdocument_update ON ozpcenter_listingsearchdocument',
+    'DROP FUNCTION IF EXISTS ozpcenter_listingsearchdocument_update()',
+]
+
+
+def create_search_index(apps, schema_editor):
+    """
+    Create the full-text index of the document table for the schema_editor's
+    database (if it supports one)
+    """
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        with schema_editor.connection.cursor() as cursor:
+            # FTS5 is optional (and can be loaded as an extension) - just try it
+            try:
+                cursor.execute('CREATE VIRTUAL TABLE temp.ozpcenter_fts5_probe USING fts5(text)')
+                cursor.execute('DROP TABLE temp.ozpcenter_fts5_probe')
+            except DatabaseError:
+                logger.warning('SQLite FTS5 is not available, listing search will not be indexed')
+                return
+        statements = SQLITE_CREATE_SQL
+    elif vendor == 'postgresql':
+        statements = POSTGRESQL_CREATE_SQL
+    else:
+        return
+    for statement in statements:
+        schema_editor.execute(statement)
+
+
+def drop_search_index(apps, schema_editor):
+    """
+    Reverse create_search_index
+    """
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        statements = SQLITE_DROP_SQL
+    elif vendor == 'postgresql':
+        statements = POSTGRESQL_DROP_SQL
+    else:
+        return
+    for statement in statements:
+        schema_editor.execute(statement)
+
+
+def build_search_documents(apps, schema_editor):
+    """
+    Create the search documents of existing listings (afterwards they are
+    maintained incrementally, see ozpcenter.search)
+    """
+    Listing = apps.get_model('ozpcenter', 'Listing')
+    ListingSearchDocument = apps.get_model('ozpcenter', 'ListingSearchDocument')
+
+    tags = collections.defaultdict(list)
+    for listing_id, tag_name in Listing.objects.filter(
+            tags__isnull=False).values_list('id', 'tags__name'):
+        tags[listing_id].append(tag_name)
+
+    ListingSearchDocument.objects.bulk_create(
+        [ListingSearchDocument(listing_id=listing_id, title=title or '',
+                               tags=' '.join(sorted(tags[listing_id])),
+                               description_short=description_short or '',
+                               description=description or '')
+         for listing_id, title, description_short, description in
+         Listing.objects.values_list('id', 'title', 'description_short',
+            'description')],
+        batch_size=BATCH_SIZE)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ozpcenter', '0010_profile_visibility_class'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ListingSearchDocument',
+            fields=[
+                ('listing', models.OneToOneField(related_name='search_document', serialize=False, to='ozpcenter.Listing', primary_key=True)),
+                ('title', models.TextField(blank=True)),
+                ('tags', models.TextField(blank=True)),
+                ('description_short', models.TextField(blank=True)),
+                ('description', models.TextField(blank=True)),
+            ],
+        ),
+        migrations.RunPython(create_search_index, drop_search_index),
+        migrations.RunPython(build_search_documents,
+            migrations.RunPython.noop),
+    ]
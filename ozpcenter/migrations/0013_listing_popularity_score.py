@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.core.cache import cache
+from django.db import models, migrations
+
+# the scoring of ozpcenter.ranking as of this migration (kept here so that
+# later changes to it don't change what this migration does)
+STAR_FIELDS = [(1, 'total_rate1'), (2, 'total_rate2'), (3, 'total_rate3'),
+               (4, 'total_rate4'), (5, 'total_rate5')]
+PRIOR_VOTES = 5
+DEFAULT_MEAN = 3.0
+MEAN_KEY = 'popularity_mean'
+
+
+def _get_totals(counts):
+    votes = sum(counts[field] or 0 for stars, field in STAR_FIELDS)
+    ratings = sum(stars * (counts[field] or 0) for stars, field in STAR_FIELDS)
+    return votes, ratings
+
+
+def compute_popularity_scores(apps, schema_editor):
+    """
+    Score the existing listings (afterwards scores are updated with their
+    ratings)
+    """
+    Listing = apps.get_model('ozpcenter', 'Listing')
+    rows = list(Listing.objects.order_by().values('id',
+        *[field for stars, field in STAR_FIELDS]))
+    votes, ratings = 0, 0
+    for row in rows:
+        row_votes, row_ratings = _get_totals(row)
+        votes += row_votes
+        ratings += row_ratings
+    mean = ratings / votes if votes else DEFAULT_MEAN
+    cache.set(MEAN_KEY, mean, None)
+
+    for row in rows:
+        row_votes, row_ratings = _get_totals(row)
+        Listing.objects.filter(id=row['id']).update(popularity_score=(
+            (PRIOR_VOTES * mean + row_ratings) / (PRIOR_VOTES + row_votes)))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ozpcenter', '0012_listing_change'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='listing',
+            name='popularity_score',
+            field=models.FloatField(default=0.0, db_index=True),
+        ),
+        migrations.AlterField(
+            model_name='listing',
+            name='approved_date',
+            field=models.DateTimeField(blank=True, null=True, db_index=True),
+        ),
+        migrations.RunPython(compute_popularity_scores,
+            migrations.RunPython.noop),
+    ]
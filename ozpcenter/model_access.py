@@ -3,11 +3,12 @@ Generic model access methods
 """
 import logging
 
-from django.core.cache import cache
-from django.core.exceptions import ObjectDoesNotExist
+from django.db import connections
+from django.db import router
+from django.db import transaction
 
+from ozpcenter import caching
 from ozpcenter import models
-from ozpcenter import utils
 
 # Get an instance of a logger
 logger = logging.getLogger('ozp-center.' + str(__name__))
@@ -17,20 +18,70 @@ def get_profile(username):
     """
     get a user's Profile
 
-    Key: current_profile:<username>
+    Key: current_profile:<Profile generation>:<username>
     """
-    username = utils.make_keysafe(username)
-    key = 'current_profile:{0!s}'.format(username)
+    return caching.cached_instance(models.Profile, 'current_profile',
+        [username], lambda: models.Profile.objects.filter(
+            user__username=username).first())
 
-    data = cache.get(key)
-    if data is None:
-        try:
-            data = models.Profile.objects.get(user__username=username)
-            cache.set(key, data)
-            # logger.debug('NOT getting data for key: %s from cache' % key)
-            return data
-        except ObjectDoesNotExist:
-            return None
+
+def get_catalog_version():
+    """
+    Get the current version of the listing catalog, which changes whenever a
+    Listing or Agency is saved or deleted (see bump_catalog_version). Include
+    it in the cache key of results computed from many listings so that they
+    never outlive a change
+
+    It is the generation of caching.CATALOG
+
+    Key: generation:catalog
+    """
+    return caching.get_generations([caching.CATALOG])[0]
+
+
+def bump_catalog_version():
+    """
+    Mark all results keyed on the current catalog version as stale
+    """
+    caching.bump_generation(caching.CATALOG)
+
+
+def bulk_create_with_ids(model, objects):
+    """
+    Insert model instances in bulk, and set their primary keys
+
+    bulk_create doesn't set the primary keys of the objects it inserts (so
+    they can't be referenced by other rows yet):
+        * on PostgreSQL the ids are taken from the table's sequence up front
+        * on SQLite the ids are read back after the insert, which is safe as
+            writers are serialized (the insert must be inside a transaction)
+        * other databases fall back to saving each object
+
+    Returns:
+        the objects
+    """
+    objects = list(objects)
+    if not objects:
+        return objects
+    connection = connections[router.db_for_write(model)]
+    table = model._meta.db_table
+    pk_column = model._meta.pk.column
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT nextval(pg_get_serial_sequence(%s, %s)) '
+                'FROM generate_series(1, %s)', [table, pk_column, len(objects)])
+            ids = [row[0] for row in cursor.fetchall()]
+        for obj, pk in zip(objects, ids):
+            obj.pk = pk
+        model._default_manager.bulk_create(objects)
+    elif connection.vendor == 'sqlite':
+        with transaction.atomic(using=connection.alias):
+            model._default_manager.bulk_create(objects)
+            ids = model._default_manager.using(connection.alias).order_by(
+                '-pk').values_list('pk', flat=True)[:len(objects)]
+            for obj, pk in zip(objects, reversed(list(ids))):
+                obj.pk = pk
     else:
-        # logger.debug('GOT data for key: %s from cache' % key)
-        return data
+        for obj in objects:
+            obj.save()
+    return objects
@@ -3,9 +3,9 @@
 model definitions for ozpcenter
 
 """
+import io
 import json
 import logging
-import os
 import uuid
 
 from django.conf import settings
@@ -18,12 +18,41 @@ from django.contrib import auth
 
 from plugins_util import plugin_manager
 from ozpcenter import constants
+from ozpcenter import errors
+from ozpcenter import image_processing
+from ozpcenter import media_storage
+from ozpcenter import ranking
 from ozpcenter import utils
+from ozpcenter import visibility
 
 # Get an instance of a logger
 logger = logging.getLogger('ozp-center.' + str(__name__))
 
 
+def _encode_security_marking(marking):
+    """
+    Encode a security marking as a (level, mask) pair using the access control
+    plugin. (None, None) if the plugin does not support encoding or the marking
+    can't be encoded
+    """
+    access_control_instance = plugin_manager.get_system_access_control_plugin()
+    if not hasattr(access_control_instance, 'encode_marking'):
+        return (None, None)
+    return access_control_instance.encode_marking(marking)
+
+
+def _encode_user_accesses(access_control):
+    """
+    Encode a user's access_control as a (level, mask) pair using the access
+    control plugin. (None, None) if the plugin does not support encoding or the
+    access_control can't be encoded
+    """
+    access_control_instance = plugin_manager.get_system_access_control_plugin()
+    if not hasattr(access_control_instance, 'encode_user_accesses'):
+        return (None, None)
+    return access_control_instance.encode_user_accesses(access_control)
+
+
 class ImageType(models.Model):
     """
     Image types (as in Small Screenshot, not png)
@@ -66,7 +95,49 @@ class ImageType(models.Model):
         return self.name
 
 
-class AccessControlImageManager(models.Manager):
+class AccessControlManager(models.Manager):
+    """
+    Base manager for models that have a security_marking (and its encoded
+    security_level and security_mask)
+    """
+
+    def apply_access_control(self, queryset, access_control):
+        """
+        Restrict a queryset to the objects a user's access_control permits
+
+        The access control plugin remains the authority on the rules, but it
+        is consulted with a single batch of the distinct security_markings
+        rather than once per object. The decisions are then applied as a single filter on the
+        (indexed) security_marking column, so the database returns exactly the
+        visible objects
+        """
+        access_control_instance = plugin_manager.get_system_access_control_plugin()
+        markings = queryset.order_by().values_list('security_marking',
+            flat=True).distinct()
+
+        markings = list(markings)
+        decisions = plugin_manager.has_access_many(access_control_instance,
+            access_control, markings)
+
+        allowed_markings = []
+        allow_unmarked = False
+        for marking, decision in zip(markings, decisions):
+            if not decision:
+                continue
+            if marking is None:
+                allow_unmarked = True
+            else:
+                allowed_markings.append(marking)
+
+        # an IN clause never matches NULL, so objects without a marking
+        # need their own condition
+        visible = models.Q(security_marking__in=allowed_markings)
+        if allow_unmarked:
+            visible |= models.Q(security_marking__isnull=True)
+        return queryset.filter(visible)
+
+
+class AccessControlImageManager(AccessControlManager):
     """
     Use a custom manager to control access to Images
 
@@ -78,25 +149,20 @@ class AccessControlImageManager(models.Manager):
     """
 
     def for_user(self, username):
-        access_control_instance = plugin_manager.get_system_access_control_plugin()
         # get all images
         objects = super(AccessControlImageManager, self).get_queryset()
         user = Profile.objects.get(user__username=username)
-        # filter out listings by user's access level
-        images_to_exclude = []
-        for i in objects:
-            if not access_control_instance.has_access(user.access_control, i.security_marking):
-                images_to_exclude.append(i.id)
-        objects = objects.exclude(id__in=images_to_exclude)
-        return objects
+        # filter out images by user's access level
+        return self.apply_access_control(objects, user.access_control)
 
 
 class Image(models.Model):
     """
     Image
 
-    (Uploaded) images are stored in a flat directory on the server using a
-    filename like <id>_<image_type>.png
+    (Uploaded) images are stored by the hash of their contents, so identical
+    files are only stored once (see ozpcenter.media_storage), together with
+    their variants (see ozpcenter.image_processing)
 
     When creating a new image, use the Image.create_image method, do not
     use the Image.save() directly
@@ -109,8 +175,15 @@ class Image(models.Model):
     # segfault. keeping it around doesn't hurt anything, and it could be
     # useful later)
     uuid = models.CharField(max_length=36, unique=True)
-    security_marking = models.CharField(max_length=1024)
+    security_marking = models.CharField(max_length=1024, db_index=True)
+    # encoded security_marking (see _encode_security_marking), set on save
+    security_level = models.IntegerField(null=True, blank=True, db_index=True)
+    security_mask = models.BigIntegerField(null=True, blank=True)
     file_extension = models.CharField(max_length=16, default='png')
+    # SHA-256 of the file, which is where it is stored (see
+    # ozpcenter.media_storage). None for images stored before that
+    content_hash = models.CharField(max_length=64, null=True, blank=True,
+        db_index=True)
     image_type = models.ForeignKey(ImageType, related_name='images')
 
     # use a custom Manager class to limit returned Images
@@ -122,6 +195,11 @@ class Image(models.Model):
     def __str__(self):
         return str(self.id)
 
+    def save(self, *args, **kwargs):
+        self.security_level, self.security_mask = _encode_security_marking(
+            self.security_marking)
+        super(Image, self).save(*args, **kwargs)
+
     @staticmethod
     def create_image(pil_img, **kwargs):
         """
@@ -129,6 +207,10 @@ class Image(models.Model):
         create DB entry
 
         pil_img: PIL.Image (see https://pillow.readthedocs.org/en/latest/reference/Image.html)
+
+        The dimensions and size are checked first (raising
+        errors.InvalidInput), then the resized variants are made (see
+        ozpcenter.image_processing)
         """
         # get DB info for image
         random_uuid = str(uuid.uuid4())
@@ -147,29 +229,39 @@ class Image(models.Model):
             return
         image_type = ImageType.objects.get(name=image_type)
 
-        # create database entry
-        img = Image(uuid=random_uuid, security_marking=security_marking,
-                    file_extension=file_extension, image_type=image_type)
-        img.save()
-
-        # write the image to the file system
-        file_name = settings.MEDIA_ROOT + str(img.id) + '_' + img.image_type.name + '.' + file_extension
-        # logger.debug('saving image %s' % file_name)
-        pil_img.save(file_name)
+        # check the image before anything is written
+        width, height = pil_img.size
+        if not (image_type.min_width <= width <= image_type.max_width and
+                image_type.min_height <= height <= image_type.max_height):
+            raise errors.InvalidInput('Image is {0:d}x{1:d}, which is outside '
+                'the allowed {2:d}x{3:d} to {4:d}x{5:d}'.format(width, height,
+                image_type.min_width, image_type.min_height,
+                image_type.max_width, image_type.max_height))
 
-        # check size requirements
-        size_bytes = os.path.getsize(file_name)
+        data = io.BytesIO()
+        pil_img.save(data, image_processing.FORMATS[file_extension])
+        size_bytes = len(data.getvalue())
 
         # TODO: PIL saved images can be larger than submitted images.
         # To avoid unexpected image save error, make the max_size_bytes
         # larger than we expect
         if size_bytes > (image_type.max_size_bytes * 2):
-            logger.error('Image size is {0:d} bytes, which is larger than the max \
-                allowed {1:d} bytes'.format(size_bytes, 2 * image_type.max_size_bytes))
-            # TODO raise exception and remove file
-            return
+            raise errors.InvalidInput('Image size is {0:d} bytes, which is '
+                'larger than the max allowed {1:d} bytes'.format(size_bytes,
+                2 * image_type.max_size_bytes))
+
+        # write the image to the file system (if it isn't there already),
+        # then create the database entry that refers to it
+        content_hash, file_name = media_storage.store(data.getvalue(),
+            file_extension)
+        # resized variants (see ozpcenter.image_processing)
+        image_processing.make_variants(file_name, image_type.name,
+            file_extension)
 
-        # TODO: check width and height
+        img = Image(uuid=random_uuid, security_marking=security_marking,
+                    file_extension=file_extension, image_type=image_type,
+                    content_hash=content_hash)
+        img.save()
 
         return img
 
@@ -452,10 +544,10 @@ class AccessControlReviewManager(models.Manager):
     def for_user(self, username):
         # get all reviews
         all_reviews = super(AccessControlReviewManager, self).get_queryset()
-        # get all listings for this user
-        listings = Listing.objects.for_user(username).all()
+        user = Profile.objects.get(user__username=username)
         # filter out reviews for listings this user cannot see
-        filtered_reviews = all_reviews.filter(listing__in=listings)
+        filtered_reviews = all_reviews.filter(
+            listing__visibility_entries__profile_id=user.id)
         return filtered_reviews
 
 
@@ -541,6 +633,14 @@ class Profile(models.Model):
         blank=True)
 
     access_control = models.CharField(max_length=16384)
+    # encoded access_control (see _encode_user_accesses), set on save
+    access_level = models.IntegerField(null=True, blank=True)
+    access_mask = models.BigIntegerField(null=True, blank=True)
+    # fingerprint of what this profile can see (see
+    # visibility.get_profile_visibility_class), set on save and kept up to
+    # date when the profile's organizations or role change
+    visibility_class = models.CharField(max_length=40, null=True, blank=True,
+                                        db_index=True)
 
     # instead of overriding the builtin Django User model used
     # for authentication, we extend it
@@ -560,6 +660,22 @@ class Profile(models.Model):
     def __str__(self):
         return self.user.username
 
+    def save(self, *args, **kwargs):
+        self.access_level, self.access_mask = _encode_user_accesses(
+            self.access_control)
+        # changes to the organizations and role are handled by ozpcenter.signals,
+        # which store the new visibility class in bulk. _visibility_state is
+        # the access_control the profile was loaded with (see
+        # signals.profile_post_init)
+        if (self._state.adding or
+                self.access_control != getattr(self, '_visibility_state', None)):
+            self.visibility_class = visibility.get_profile_visibility_class(self)
+        elif 'update_fields' not in kwargs and not kwargs.get('force_insert'):
+            # don't overwrite a visibility class stored since it was loaded
+            kwargs['update_fields'] = [i.name for i in self._meta.concrete_fields
+                                       if not i.primary_key and i.name != 'visibility_class']
+        super(Profile, self).save(*args, **kwargs)
+
     @staticmethod
     def create_groups():
         """
@@ -668,7 +784,7 @@ class Profile(models.Model):
         return p
 
 
-class AccessControlListingManager(models.Manager):
+class AccessControlListingManager(AccessControlManager):
     """
     Use a custom manager to control access to Listings
 
@@ -680,35 +796,11 @@ class AccessControlListingManager(models.Manager):
     """
 
     def for_user(self, username):
-        # get all listings
-        objects = super(AccessControlListingManager, self).get_queryset()
-        # filter out private listings
+        # the listings visible to each user are maintained in the
+        # ListingVisibility table (see ozpcenter.visibility)
         user = Profile.objects.get(user__username=username)
-        if user.highest_role() == 'APPS_MALL_STEWARD':
-            exclude_orgs = []
-        elif user.highest_role() == 'ORG_STEWARD':
-            user_orgs = user.stewarded_organizations.all()
-            user_orgs = [i.title for i in user_orgs]
-            exclude_orgs = Agency.objects.exclude(title__in=user_orgs)
-        else:
-            user_orgs = user.organizations.all()
-            user_orgs = [i.title for i in user_orgs]
-            exclude_orgs = Agency.objects.exclude(title__in=user_orgs)
-
-        objects = objects.exclude(is_private=True,
-                                  agency__in=exclude_orgs)
-
-        access_control_instance = plugin_manager.get_system_access_control_plugin()
-
-        # filter out listings by user's access level
-        titles_to_exclude = []
-        for i in objects:
-            if not i.security_marking:
-                logger.debug('Listing {0!s} has no security_marking'.format(i.title))
-            if not access_control_instance.has_access(user.access_control, i.security_marking):
-                titles_to_exclude.append(i.title)
-        objects = objects.exclude(title__in=titles_to_exclude)
-        return objects
+        objects = super(AccessControlListingManager, self).get_queryset()
+        return objects.filter(visibility_entries__profile_id=user.id)
 
 
 class Listing(models.Model):
@@ -738,7 +830,7 @@ class Listing(models.Model):
     )
     # title is not guaranteed to be unique
     title = models.CharField(max_length=255)
-    approved_date = models.DateTimeField(null=True, blank=True)
+    approved_date = models.DateTimeField(null=True, blank=True, db_index=True)
     # TODO: change this back after the migration
     # edited_date = models.DateTimeField(auto_now=True)
     edited_date = models.DateTimeField(default=utils.get_now_utc)
@@ -785,6 +877,8 @@ class Listing(models.Model):
     total_rate2 = models.IntegerField(default=0)
     total_rate1 = models.IntegerField(default=0)
     total_reviews = models.IntegerField(default=0)
+    # Bayesian average of the ratings (see ozpcenter.ranking)
+    popularity_score = models.FloatField(default=0.0, db_index=True)
     iframe_compatible = models.BooleanField(default=True)
 
     contacts = models.ManyToManyField(
@@ -826,7 +920,10 @@ class Listing(models.Model):
     )
 
     security_marking = models.CharField(max_length=1024,
-                                        null=True, blank=True)
+                                        null=True, blank=True, db_index=True)
+    # encoded security_marking (see _encode_security_marking), set on save
+    security_level = models.IntegerField(null=True, blank=True, db_index=True)
+    security_mask = models.BigIntegerField(null=True, blank=True)
 
     # private listings can only be viewed by members of the same agency
     is_private = models.BooleanField(default=False)
@@ -834,8 +931,21 @@ class Listing(models.Model):
     # use a custom Manager class to limit returned Listings
     objects = AccessControlListingManager()
 
-    def is_bookmarked(self):
-        return ApplicationLibraryEntry.objects.filter(listing=self).count() >= 1
+    def is_bookmarked(self, username):
+        """
+        Whether the user has this listing in their library (see
+        listing model_access.annotate_bookmarked to get this for many
+        listings at once)
+        """
+        return self.application_library_entries.filter(
+            owner__user__username=username).exists()
+
+    def save(self, *args, **kwargs):
+        self.security_level, self.security_mask = _encode_security_marking(
+            self.security_marking)
+        if self.pk is None:
+            self.popularity_score = ranking.get_initial_score()
+        super(Listing, self).save(*args, **kwargs)
 
     def __repr__(self):
         return '({0!s}-{1!s})'.format(self.unique_name, [owner.user.username for owner in self.owners.all()])
@@ -844,6 +954,67 @@ class Listing(models.Model):
         return '({0!s}-{1!s})'.format(self.unique_name, [owner.user.username for owner in self.owners.all()])
 
 
+class ListingVisibility(models.Model):
+    """
+    A Listing that a Profile can see
+
+    Materialized from the access rules (see ozpcenter.visibility) and kept up
+    to date by the handlers in ozpcenter.signals
+    """
+    profile = models.ForeignKey('Profile', related_name='visibility_entries')
+    listing = models.ForeignKey('Listing', related_name='visibility_entries')
+
+    def __repr__(self):
+        return '{0!s}: {1!s}'.format(self.profile_id, self.listing_id)
+
+    def __str__(self):
+        return '{0!s}: {1!s}'.format(self.profile_id, self.listing_id)
+
+    class Meta:
+        unique_together = ('profile', 'listing')
+
+
+class ListingSearchDocument(models.Model):
+    """
+    The searchable text of a Listing
+
+    Kept up to date by the handlers in ozpcenter.signals. The database indexes
+    it for full-text search (see ozpcenter.search)
+    """
+    listing = models.OneToOneField('Listing', primary_key=True,
+                                   related_name='search_document')
+    title = models.TextField(blank=True)
+    # space separated tag names
+    tags = models.TextField(blank=True)
+    description_short = models.TextField(blank=True)
+    description = models.TextField(blank=True)
+
+    def __repr__(self):
+        return '{0!s}: {1!s}'.format(self.listing_id, self.title)
+
+    def __str__(self):
+        return '{0!s}: {1!s}'.format(self.listing_id, self.title)
+
+
+class ListingChange(models.Model):
+    """
+    A change to the facets of a Listing (or of all Listings if listing_id is
+    null)
+
+    Appended to by the handlers in ozpcenter.signals and read by the facet
+    index of each process (see ozpcenter.facets). Not a foreign key, as the
+    Listing may have been deleted
+    """
+    listing_id = models.IntegerField(null=True)
+    token = models.CharField(max_length=32)
+
+    def __repr__(self):
+        return '{0!s}: {1!s}'.format(self.id, self.listing_id)
+
+    def __str__(self):
+        return '{0!s}: {1!s}'.format(self.id, self.listing_id)
+
+
 class AccessControlListingActivityManager(models.Manager):
     """
     Use a custom manager to control access to ListingActivities
@@ -859,11 +1030,10 @@ class AccessControlListingActivityManager(models.Manager):
         # get all activities
         all_activities = super(
             AccessControlListingActivityManager, self).get_queryset()
-        # get all listings for this user
-        listings = Listing.objects.for_user(username).all()
+        user = Profile.objects.get(user__username=username)
         # filter out listing_activities for listings this user cannot see
         filtered_listing_activities = all_activities.filter(
-            listing__in=listings)
+            listing__visibility_entries__profile_id=user.id)
         return filtered_listing_activities
 
 
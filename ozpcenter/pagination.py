@@ -1,7 +1,155 @@
+import base64
+import collections
+import json
+
+from django.db.models import Q
 from rest_framework import pagination
+from rest_framework.exceptions import NotFound
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
 
 
 class StandardPagination(pagination.PageNumberPagination):
     page_size = 10
     page_size_query_param = 'page_size'
     max_page_size = 1000
+
+
+class CursorOrLimitOffsetPagination(pagination.LimitOffsetPagination):
+    """
+    Limit/offset pagination, or keyset (cursor) pagination if the request has
+    a cursor parameter
+
+    Cursor pagination orders by one of the view's cursor_ordering_fields (the
+    first one, descending, unless ?ordering=[-]<field> is given) with id as a
+    tiebreak. Instead of an OFFSET, each page is filtered on the position of
+    the last row of the previous page, so deep pages are as fast as the first
+    one, no count query is made, and pages don't shift while rows are being
+    inserted
+
+    Usage:
+        first page: ?cursor=&limit=<limit>
+        other pages: follow the next and previous links of the response
+    """
+    cursor_query_param = 'cursor'
+    ordering_query_param = 'ordering'
+    # page size if no limit is given
+    cursor_page_size = 50
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        ordering_fields = getattr(view, 'cursor_ordering_fields', None)
+        self.use_cursor = (ordering_fields is not None and
+                           self.cursor_query_param in request.query_params)
+        if not self.use_cursor:
+            return super(CursorOrLimitOffsetPagination, self).paginate_queryset(
+                queryset, request, view)
+
+        self.limit = self.get_limit(request) or self.cursor_page_size
+        self.base_url = request.build_absolute_uri()
+        self.request = request
+        self.ordering = self._get_ordering(request, ordering_fields)
+        position, reverse = self._decode_cursor(request)
+
+        # walk backwards from the cursor to get the previous page
+        ordering = self.ordering
+        if reverse:
+            ordering = [self._reverse(i) for i in ordering]
+        queryset = queryset.order_by(*ordering)
+        if position is not None:
+            queryset = queryset.filter(self._after(ordering, position))
+
+        results = list(queryset[:self.limit + 1])
+        has_more = len(results) > self.limit
+        self.page = results[:self.limit]
+        if reverse:
+            self.page.reverse()
+            self.has_next = True
+            self.has_previous = has_more
+        else:
+            self.has_next = has_more
+            self.has_previous = position is not None
+        return self.page
+
+    def get_paginated_response(self, data):
+        if not self.use_cursor:
+            return super(CursorOrLimitOffsetPagination, self).get_paginated_response(data)
+        return Response(collections.OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data)
+        ]))
+
+    def get_next_link(self):
+        if not self.use_cursor:
+            return super(CursorOrLimitOffsetPagination, self).get_next_link()
+        if not self.has_next or not self.page:
+            return None
+        return self._encode_cursor(self.page[-1], False)
+
+    def get_previous_link(self):
+        if not self.use_cursor:
+            return super(CursorOrLimitOffsetPagination, self).get_previous_link()
+        if not self.has_previous or not self.page:
+            return None
+        return self._encode_cursor(self.page[0], True)
+
+    def _get_ordering(self, request, ordering_fields):
+        ordering = request.query_params.get(self.ordering_query_param,
+            '-' + ordering_fields[0])
+        if ordering.lstrip('-') not in ordering_fields:
+            raise NotFound('Invalid ordering for cursor pagination')
+        tiebreak = '-id' if ordering.startswith('-') else 'id'
+        return [ordering, tiebreak]
+
+    @staticmethod
+    def _reverse(order):
+        return order[1:] if order.startswith('-') else '-' + order
+
+    @staticmethod
+    def _after(ordering, position):
+        """
+        Filter for the rows that come after position in this ordering
+        """
+        # (a, b) > (x, y) is a > x or (a = x and b > y)
+        after = Q()
+        equal = {}
+        for order, value in zip(ordering, position):
+            field = order.lstrip('-')
+            lookup = '__lt' if order.startswith('-') else '__gt'
+            after |= Q(**dict(equal, **{field + lookup: value}))
+            equal[field] = value
+        return after
+
+    def _decode_cursor(self, request):
+        """
+        Get the (position, reverse) of the cursor of the request
+        """
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return (None, False)
+        try:
+            cursor = json.loads(base64.urlsafe_b64decode(
+                encoded.encode('ascii')).decode('utf-8'))
+            position = cursor['p']
+            reverse = bool(cursor.get('r'))
+        except (TypeError, ValueError, KeyError):
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(position, list) or len(position) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+        return (position, reverse)
+
+    def _encode_cursor(self, instance, reverse):
+        position = []
+        for order in self.ordering:
+            value = getattr(instance, order.lstrip('-'))
+            if hasattr(value, 'isoformat'):
+                value = value.isoformat()
+            position.append(value)
+        cursor = {'p': position}
+        if reverse:
+            cursor['r'] = 1
+        encoded = base64.urlsafe_b64encode(json.dumps(cursor).encode(
+            'utf-8')).decode('ascii')
+        return replace_query_param(self.base_url, self.cursor_query_param,
+            encoded)
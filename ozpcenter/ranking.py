@@ -0,0 +1,151 @@
+"""
+Listing popularity ranking
+
+Ordering listings by avg_rate lets a single 5 star vote outrank hundreds of
+4 star votes. Instead, each Listing has a popularity_score: the Bayesian
+average of its ratings, as if it also had PRIOR_VOTES votes at the mean
+rating of all listings
+
+    score = (PRIOR_VOTES * mean + sum of ratings) / (PRIOR_VOTES + votes)
+
+Listings with few votes score close to the mean, and need many votes to move
+far from it. The score is an indexed column, so the most popular listings
+are read in order from the index
+
+Keeping scores up to date:
+    get_score is used whenever a listing's rating counters change (see
+    listing model_access._update_rating), using the mean stored by the last
+    refresh (get_stored_mean), so that listings with the same votes have the
+    same score, and so that rating a listing doesn't aggregate the whole
+    table. A new listing is unrated, so it scores the stored mean
+    (get_initial_score), which is only read from the cache. As votes come in
+    the mean itself moves, which changes every score a little: refresh
+    recomputes the mean and all the scores in one pass (run the
+    refresh_popularity management command on a schedule)
+"""
+import logging
+
+from django.apps import apps
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Case
+from django.db.models import FloatField
+from django.db.models import Sum
+from django.db.models import Value
+from django.db.models import When
+
+# Get an instance of a logger
+logger = logging.getLogger('ozp-center.' + str(__name__))
+
+# the rating counters of a Listing, by number of stars
+STAR_FIELDS = [(1, 'total_rate1'), (2, 'total_rate2'), (3, 'total_rate3'),
+               (4, 'total_rate4'), (5, 'total_rate5')]
+
+# weight of the mean rating in every score, in votes
+PRIOR_VOTES = 5
+
+# mean rating when there are no votes at all
+DEFAULT_MEAN = 3.0
+
+# number of scores to write per query
+BATCH_SIZE = 500
+
+MEAN_KEY = 'popularity_mean'
+
+
+def _get_totals(counts):
+    """
+    Get the (number of votes, sum of ratings) of a dict of STAR_FIELDS
+    """
+    votes = sum(counts[field] or 0 for stars, field in STAR_FIELDS)
+    ratings = sum(stars * (counts[field] or 0) for stars, field in STAR_FIELDS)
+    return votes, ratings
+
+
+def get_score(counts, mean):
+    """
+    Get the popularity score of a Listing
+
+    Args:
+        counts: dict of the Listing's STAR_FIELDS
+        mean: mean rating of all Listings (see get_mean)
+    """
+    votes, ratings = _get_totals(counts)
+    return (PRIOR_VOTES * mean + ratings) / (PRIOR_VOTES + votes)
+
+
+def _get_listing_model():
+    # not imported, as ozpcenter.models imports this module
+    return apps.get_model('ozpcenter', 'Listing')
+
+
+def get_mean():
+    """
+    Get the mean rating of all votes, with a single aggregate query
+    """
+    counts = _get_listing_model().objects.order_by().aggregate(
+        **{field: Sum(field) for stars, field in STAR_FIELDS})
+    votes, ratings = _get_totals(counts)
+    return ratings / votes if votes else DEFAULT_MEAN
+
+
+def get_stored_mean():
+    """
+    Get the mean rating the current scores were computed with (see refresh)
+
+    If it isn't cached (or was evicted), the current mean is stored instead
+    """
+    mean = cache.get(MEAN_KEY)
+    if mean is None:
+        mean = get_mean()
+        cache.set(MEAN_KEY, mean, None)
+    return mean
+
+
+def get_initial_score():
+    """
+    Get the popularity score of a new (unrated) Listing, without a query
+
+    This is the stored mean, or DEFAULT_MEAN if it isn't cached; the next
+    refresh corrects the score either way
+    """
+    return cache.get(MEAN_KEY, DEFAULT_MEAN)
+
+
+def refresh():
+    """
+    Recompute the mean rating, and the popularity score of every Listing
+
+    The counters of all Listings are read with one query, and only the
+    scores that changed are written, BATCH_SIZE per UPDATE
+
+    Returns:
+        the number of Listings whose score changed
+    """
+    Listing = _get_listing_model()
+    rows = list(Listing.objects.order_by().values('id', 'popularity_score',
+        *[field for stars, field in STAR_FIELDS]))
+    votes, ratings = 0, 0
+    for row in rows:
+        row_votes, row_ratings = _get_totals(row)
+        votes += row_votes
+        ratings += row_ratings
+    mean = ratings / votes if votes else DEFAULT_MEAN
+    cache.set(MEAN_KEY, mean, None)
+
+    scores = {}
+    for row in rows:
+        score = get_score(row, mean)
+        if score != row['popularity_score']:
+            scores[row['id']] = score
+
+    changed_ids = sorted(scores)
+    with transaction.atomic():
+        for i in range(0, len(changed_ids), BATCH_SIZE):
+            batch = changed_ids[i:i + BATCH_SIZE]
+            Listing.objects.filter(id__in=batch).update(popularity_score=Case(
+                *[When(id=listing_id, then=Value(scores[listing_id]))
+                  for listing_id in batch],
+                output_field=FloatField()))
+    logger.info('Updated the popularity of {0:d} listings'.format(len(changed_ids)))
+    return len(changed_ids)
@@ -1188,6 +1188,9 @@ def run():
         listing_model_access.approve_listing_by_org_steward(winston, listing)
         listing_model_access.approve_listing(winston, listing)
 
+    # score all listings against the mean rating of all the reviews above
+    listing_model_access.refresh_popularity()
+
     ############################################################################
     #                           Library
     ############################################################################
@@ -0,0 +1,201 @@
+"""
+Listing full-text search
+
+Each Listing has a ListingSearchDocument holding the text that is searched
+(title, description_short, description, and tag names). The documents are
+kept up to date incrementally by the handlers in ozpcenter.signals, and the
+database keeps its full-text index of the documents up to date with triggers
+(created by migration 0011_listing_search_document):
+    * SQLite: an external content FTS5 table (SQLITE_INDEX_TABLE), ranked
+        with bm25
+    * PostgreSQL: a weighted tsvector column of the documents with a GIN
+        index, ranked with ts_rank
+    * other databases (or SQLite builds without FTS5): no index, each term is
+        matched against the document with icontains. Since there is a single
+        document per Listing this still can't return duplicates
+
+Every term of the search text must match (as a word prefix, so that results
+can be shown while typing). Matches in the title weigh the most, then tags,
+description_short, and description
+"""
+import collections
+import logging
+import re
+
+from django.db import connections
+from django.db import transaction
+from django.db.models import Q
+
+from ozpcenter import models
+
+# Get an instance of a logger
+logger = logging.getLogger('ozp-center.' + str(__name__))
+
+# number of documents to insert or delete per query
+BATCH_SIZE = 500
+
+DOCUMENT_TABLE = 'ozpcenter_listingsearchdocument'
+SQLITE_INDEX_TABLE = 'ozpcenter_listingsearchindex'
+
+# searched columns, in order of decreasing weight
+COLUMNS = ['title', 'tags', 'description_short', 'description']
+
+# search terms are words - tag names like tag_1 are a single word
+TERM_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def get_terms(text):
+    """
+    Split search text into terms
+    """
+    return TERM_RE.findall(text or '')
+
+
+class SearchBackend(object):
+    """
+    Matches Listings against search terms without an index
+    """
+
+    def search(self, queryset, terms):
+        """
+        Filter a Listing queryset to the Listings matching all terms
+
+        Returns:
+            (queryset, rank_ordering) where rank_ordering is the order_by
+            argument that sorts the Listings by relevance, or None if there is
+            no ranking
+        """
+        for term in terms:
+            match = Q()
+            for column in COLUMNS:
+                match |= Q(**{'search_document__' + column + '__icontains': term})
+            queryset = queryset.filter(match)
+        return (queryset, None)
+
+
+class SqliteSearchBackend(SearchBackend):
+    """
+    Matches Listings with the FTS5 index
+    """
+    # bm25 weights of COLUMNS
+    weights = [10.0, 5.0, 2.0, 1.0]
+
+    def search(self, queryset, terms):
+        # quote every term so that it isn't parsed as FTS5 syntax
+        query = ' '.join('"{0!s}"*'.format(term) for term in terms)
+        rank = 'bm25({0!s}, {1!s})'.format(SQLITE_INDEX_TABLE,
+            ', '.join(str(i) for i in self.weights))
+        queryset = queryset.extra(
+            select={'search_rank': rank},
+            tables=[SQLITE_INDEX_TABLE],
+            where=['{0!s}.rowid = ozpcenter_listing.id'.format(SQLITE_INDEX_TABLE),
+                   '{0!s} MATCH %s'.format(SQLITE_INDEX_TABLE)],
+            params=[query])
+        # bm25 is lower for better matches
+        return (queryset, 'search_rank')
+
+
+class PostgresqlSearchBackend(SearchBackend):
+    """
+    Matches Listings with the tsvector index
+    """
+
+    def search(self, queryset, terms):
+        query = ' & '.join('{0!s}:*'.format(term) for term in terms)
+        tsquery = "to_tsquery('english', %s)"
+        queryset = queryset.extra(
+            select={'search_rank': 'ts_rank({0!s}.search_vector, {1!s})'.format(
+                DOCUMENT_TABLE, tsquery)},
+            select_params=[query],
+            tables=[DOCUMENT_TABLE],
+            where=['{0!s}.listing_id = ozpcenter_listing.id'.format(DOCUMENT_TABLE),
+                   '{0!s}.search_vector @@ {1!s}'.format(DOCUMENT_TABLE, tsquery)],
+            params=[query])
+        return (queryset, '-search_rank')
+
+
+# backend of each database connection
+_backends = {}
+
+
+def get_backend(using='default'):
+    """
+    Get the SearchBackend for a database
+    """
+    backend = _backends.get(using)
+    if backend is None:
+        connection = connections[using]
+        if connection.vendor == 'postgresql':
+            backend = PostgresqlSearchBackend()
+        elif (connection.vendor == 'sqlite' and SQLITE_INDEX_TABLE in
+                connection.introspection.table_names()):
+            backend = SqliteSearchBackend()
+        else:
+            backend = SearchBackend()
+        _backends[using] = backend
+    return backend
+
+
+def search_listings(queryset, text):
+    """
+    Filter a Listing queryset to the Listings matching the search text, best
+    matches first (ties keep the queryset's ordering)
+    """
+    terms = get_terms(text)
+    if not terms:
+        return queryset
+    queryset, rank_ordering = get_backend(queryset.db).search(queryset, terms)
+    if rank_ordering is not None:
+        queryset = queryset.order_by(rank_ordering, *queryset.query.order_by)
+    return queryset
+
+
+def _make_documents(listing_ids=None):
+    """
+    Make the (unsaved) ListingSearchDocuments of Listings
+    """
+    listings = models.Listing.objects.order_by()
+    if listing_ids is not None:
+        listings = listings.filter(id__in=listing_ids)
+
+    tags = collections.defaultdict(list)
+    for listing_id, tag_name in listings.filter(tags__isnull=False).values_list(
+            'id', 'tags__name'):
+        tags[listing_id].append(tag_name)
+
+    return [models.ListingSearchDocument(listing_id=listing_id, title=title or '',
+                                         tags=' '.join(sorted(tags[listing_id])),
+                                         description_short=description_short or '',
+                                         description=description or '')
+            for listing_id, title, description_short, description in
+            listings.values_list('id', 'title', 'description_short', 'description')]
+
+
+def index_listings(listing_ids):
+    """
+    Update the search documents of the given Listings
+    """
+    listing_ids = list(listing_ids)
+    if not listing_ids:
+        return
+    with transaction.atomic():
+        for i in range(0, len(listing_ids), BATCH_SIZE):
+            models.ListingSearchDocument.objects.filter(
+                listing_id__in=listing_ids[i:i + BATCH_SIZE]).delete()
+        models.ListingSearchDocument.objects.bulk_create(
+            _make_documents(listing_ids), batch_size=BATCH_SIZE)
+
+
+def rebuild():
+    """
+    Recreate the search documents of all Listings
+
+    Returns:
+        the number of documents created
+    """
+    with transaction.atomic():
+        models.ListingSearchDocument.objects.all().delete()
+        documents = _make_documents()
+        models.ListingSearchDocument.objects.bulk_create(documents,
+            batch_size=BATCH_SIZE)
+    return len(documents)
@@ -0,0 +1,273 @@
+"""
+Signal handlers for ozpcenter
+
+Keeps the ListingVisibility table, the visibility classes of Profiles (see
+ozpcenter.visibility), the search documents of Listings (see
+ozpcenter.search), the facet index change log (see ozpcenter.facets), the
+catalog version (see model_access.get_catalog_version), the cache
+generations of models (see ozpcenter.caching), and the cached storefront
+metadata up to date. Since
+Listings and Profiles are saved often for unrelated reasons (ratings, auth
+refreshes, etc), the fields each of these depend on are remembered when an
+instance is loaded and they are only refreshed when one of them changed
+"""
+from django.contrib import auth
+from django.db.models.signals import m2m_changed
+from django.db.models.signals import post_delete
+from django.db.models.signals import post_init
+from django.db.models.signals import post_save
+from django.db.models.signals import pre_delete
+from django.dispatch import receiver
+
+from ozpcenter import caching
+from ozpcenter import facets
+from ozpcenter import media_storage
+from ozpcenter import models
+import ozpcenter.model_access as generic_model_access
+from ozpcenter import search
+from ozpcenter import visibility
+
+
+def _get_listing_state(listing):
+    # read the instance's __dict__ so that deferred fields aren't loaded
+    return tuple(listing.__dict__.get(i) for i in
+        ['security_marking', 'is_private', 'agency_id'])
+
+
+def _get_listing_search_state(listing):
+    return tuple(listing.__dict__.get(i) for i in
+        ['title', 'description_short', 'description'])
+
+
+def _get_listing_facet_state(listing):
+    return tuple(listing.__dict__.get(i) for i in
+        ['agency_id', 'listing_type_id'])
+
+
+@receiver(post_init, sender=models.Listing)
+def listing_post_init(sender, instance, **kwargs):
+    instance._visibility_state = _get_listing_state(instance)
+    instance._search_state = _get_listing_search_state(instance)
+    instance._facet_state = _get_listing_facet_state(instance)
+
+
+@receiver(post_save, sender=models.Listing)
+def listing_post_save(sender, instance, created, raw, **kwargs):
+    if raw:
+        return
+    state = _get_listing_state(instance)
+    if created or state != instance._visibility_state:
+        visibility.refresh_listings([instance.id])
+        instance._visibility_state = state
+    search_state = _get_listing_search_state(instance)
+    if created or search_state != instance._search_state:
+        search.index_listings([instance.id])
+        instance._search_state = search_state
+    facet_state = _get_listing_facet_state(instance)
+    if created or facet_state != instance._facet_state:
+        facets.record_change([instance.id])
+        instance._facet_state = facet_state
+
+
+@receiver(post_delete, sender=models.Listing)
+def listing_post_delete(sender, instance, **kwargs):
+    facets.record_change([instance.id])
+
+
+def _get_m2m_listing_ids(instance, action, reverse, pk_set):
+    """
+    Get the Listings affected by a change to one of their many-to-many
+    relations (None before the change is done)
+    """
+    if reverse and action == 'pre_clear':
+        # remember the Listings losing the related object
+        instance._changed_listing_ids = list(
+            instance.listings.values_list('id', flat=True))
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return None
+    if not reverse:
+        return [instance.id]
+    elif action == 'post_clear':
+        return getattr(instance, '_changed_listing_ids', [])
+    else:
+        return list(pk_set or [])
+
+
+@receiver(m2m_changed, sender=models.Listing.tags.through)
+def listing_tags_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    listing_ids = _get_m2m_listing_ids(instance, action, reverse, pk_set)
+    if listing_ids is not None:
+        search.index_listings(listing_ids)
+        facets.record_change(listing_ids)
+
+
+@receiver(m2m_changed, sender=models.Listing.categories.through)
+def listing_categories_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    listing_ids = _get_m2m_listing_ids(instance, action, reverse, pk_set)
+    if listing_ids is not None:
+        facets.record_change(listing_ids)
+
+
+@receiver(post_init, sender=models.Tag)
+def tag_post_init(sender, instance, **kwargs):
+    instance._search_state = instance.__dict__.get('name')
+
+
+@receiver(post_save, sender=models.Tag)
+def tag_post_save(sender, instance, created, raw, **kwargs):
+    if raw or created:
+        return
+    if instance.name != instance._search_state:
+        search.index_listings(instance.listings.values_list('id', flat=True))
+        facets.record_change()
+        instance._search_state = instance.name
+
+
+@receiver(pre_delete, sender=models.Tag)
+def tag_pre_delete(sender, instance, **kwargs):
+    # the tag_listing rows are deleted without m2m_changed signals
+    instance._changed_listing_ids = list(
+        instance.listings.values_list('id', flat=True))
+
+
+@receiver(post_delete, sender=models.Tag)
+def tag_post_delete(sender, instance, **kwargs):
+    search.index_listings(instance._changed_listing_ids)
+    facets.record_change(instance._changed_listing_ids)
+
+
+def _get_facet_value(instance):
+    return instance.__dict__.get(
+        'short_name' if isinstance(instance, models.Agency) else 'title')
+
+
+@receiver(post_init, sender=models.Category)
+@receiver(post_init, sender=models.Agency)
+@receiver(post_init, sender=models.ListingType)
+def facet_value_post_init(sender, instance, **kwargs):
+    instance._facet_state = _get_facet_value(instance)
+
+
+@receiver(post_save, sender=models.Category)
+@receiver(post_save, sender=models.Agency)
+@receiver(post_save, sender=models.ListingType)
+def facet_value_post_save(sender, instance, created, raw, **kwargs):
+    if raw or created:
+        return
+    if _get_facet_value(instance) != instance._facet_state:
+        # renamed - reload all Listings rather than find the ones that have it
+        facets.record_change()
+        instance._facet_state = _get_facet_value(instance)
+
+
+@receiver(post_delete, sender=models.Category)
+@receiver(post_delete, sender=models.Agency)
+@receiver(post_delete, sender=models.ListingType)
+def facet_value_post_delete(sender, instance, **kwargs):
+    facets.record_change()
+
+
+@receiver(post_init, sender=models.Profile)
+def profile_post_init(sender, instance, **kwargs):
+    instance._visibility_state = instance.__dict__.get('access_control')
+
+
+@receiver(post_save, sender=models.Profile)
+def profile_post_save(sender, instance, created, raw, **kwargs):
+    if raw:
+        return
+    if created or instance.access_control != instance._visibility_state:
+        visibility.refresh_profiles([instance.id])
+    instance._visibility_state = instance.access_control
+
+
+def _m2m_changed(instance, action, reverse, pk_set, get_profile_ids,
+        get_reverse_profile_ids, get_cleared_profile_ids):
+    """
+    Refresh the Profiles affected by a change to one of their relations
+
+    get_profile_ids() returns the affected Profiles for a forward change
+    get_reverse_profile_ids(pk_set) returns them for a reverse change
+    get_cleared_profile_ids() returns them before a reverse clear
+    """
+    if reverse and action == 'pre_clear':
+        # remember the Profiles losing the related object
+        instance._changed_profile_ids = list(get_cleared_profile_ids())
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if action != 'post_clear' and not pk_set:
+        return
+    if not reverse:
+        visibility.refresh_profiles(get_profile_ids())
+    elif action == 'post_clear':
+        visibility.refresh_profiles(getattr(instance, '_changed_profile_ids', []))
+    else:
+        visibility.refresh_profiles(get_reverse_profile_ids(pk_set))
+
+
+@receiver(m2m_changed, sender=models.Profile.organizations.through)
+@receiver(m2m_changed, sender=models.Profile.stewarded_organizations.through)
+def profile_organizations_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    _m2m_changed(instance, action, reverse, pk_set, lambda: [instance.id],
+        lambda profile_ids: profile_ids,
+        lambda: sender.objects.filter(agency_id=instance.id).values_list(
+            'profile_id', flat=True))
+
+
+@receiver(m2m_changed, sender=auth.models.User.groups.through)
+def user_groups_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    _m2m_changed(instance, action, reverse, pk_set,
+        lambda: models.Profile.objects.filter(user=instance).values_list('id', flat=True),
+        lambda user_ids: models.Profile.objects.filter(user_id__in=user_ids).values_list('id', flat=True),
+        lambda: models.Profile.objects.filter(user__groups=instance).values_list('id', flat=True))
+
+
+@receiver(post_save, sender=models.Listing)
+@receiver(post_delete, sender=models.Listing)
+@receiver(post_save, sender=models.Agency)
+@receiver(post_delete, sender=models.Agency)
+def catalog_changed(sender, **kwargs):
+    generic_model_access.bump_catalog_version()
+
+
+@receiver(post_save, sender=models.Profile)
+@receiver(post_delete, sender=models.Profile)
+@receiver(post_save, sender=models.Listing)
+@receiver(post_delete, sender=models.Listing)
+@receiver(post_save, sender=models.Review)
+@receiver(post_delete, sender=models.Review)
+@receiver(post_save, sender=models.ApplicationLibraryEntry)
+@receiver(post_delete, sender=models.ApplicationLibraryEntry)
+@receiver(post_save, sender=models.ListingType)
+@receiver(post_delete, sender=models.ListingType)
+@receiver(post_save, sender=models.Category)
+@receiver(post_delete, sender=models.Category)
+@receiver(post_save, sender=models.Agency)
+@receiver(post_delete, sender=models.Agency)
+@receiver(post_save, sender=models.ContactType)
+@receiver(post_delete, sender=models.ContactType)
+@receiver(post_save, sender=models.Intent)
+@receiver(post_delete, sender=models.Intent)
+def cached_model_changed(sender, **kwargs):
+    caching.bump_generation(sender)
+
+
+@receiver(m2m_changed, sender=models.Listing.owners.through)
+def listing_owners_changed(sender, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        caching.bump_generation(models.Listing)
+
+
+@receiver(post_delete, sender=models.Image)
+def image_post_delete(sender, instance, **kwargs):
+    # the files are removed with the last image that refers to them (see
+    # ozpcenter.media_storage)
+    if instance.content_hash is None:
+        image_type = models.ImageType.objects.filter(
+            id=instance.image_type_id).values_list('name', flat=True).first()
+        if image_type:
+            media_storage.remove_files(media_storage.get_legacy_files(
+                instance.id, image_type))
+    elif not models.Image.objects.filter(
+            content_hash=instance.content_hash).exists():
+        media_storage.remove(instance.content_hash)
@@ -0,0 +1,107 @@
+"""
+Cache layer tests
+"""
+import shutil
+import tempfile
+from unittest.mock import patch
+
+from django.test import TestCase
+
+from ozpcenter.scripts import sample_data_generator as data_gen
+from ozpcenter import caching
+from ozpcenter import models
+import ozpcenter.api.listing.model_access as listing_model_access
+import ozpcenter.model_access as generic_model_access
+
+
+class CachingTest(TestCase):
+
+    def setUp(self):
+        """
+        setUp is invoked before each test method
+        """
+        caching.reset_stats()
+
+    @classmethod
+    def setUpTestData(cls):
+        """
+        Set up test data for the whole TestCase (only run once for the TestCase)
+        """
+        data_gen.run()
+
+    def _locmem(self, location):
+        return self.settings(CACHES={'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': location}})
+
+    def test_keys(self):
+        with self._locmem('test_keys'):
+            key = caching.make_key('listings', ['abc'], [models.Listing])
+            self.assertTrue(key.startswith('listings:'))
+            self.assertTrue(key.endswith(':abc'))
+            self.assertEqual(caching.make_key('listings', ['abc'], [models.Listing]), key)
+            # unsafe parts are hashed
+            self.assertFalse(' ' in caching.make_key('x', ['a b'], [models.Listing]))
+
+            caching.bump_generation(models.Listing)
+            self.assertNotEqual(caching.make_key('listings', ['abc'], [models.Listing]), key)
+
+    def test_catalog_version(self):
+        with self._locmem('test_catalog_version'):
+            version = generic_model_access.get_catalog_version()
+            self.assertEqual(caching.get_generations([caching.CATALOG]), [version])
+            key = caching.make_key('listings', [], [caching.CATALOG])
+            generic_model_access.bump_catalog_version()
+            self.assertNotEqual(generic_model_access.get_catalog_version(), version)
+            self.assertNotEqual(caching.make_key('listings', [], [caching.CATALOG]), key)
+
+    def test_cached_queryset(self):
+        with self._locmem('test_cached_queryset'):
+            expected = set(models.Listing.objects.for_user('wsmith'))
+            for i in range(2):
+                self.assertEqual(set(listing_model_access.get_listings('wsmith')),
+                    expected)
+            stats = caching.get_stats()['listings']
+            self.assertEqual((stats['hits'], stats['misses']), (1, 1))
+
+            # any listing change makes the cached ids stale
+            models.Listing.objects.first().save()
+            self.assertEqual(set(listing_model_access.get_listings('wsmith')),
+                expected)
+            self.assertEqual(caching.get_stats()['listings']['misses'], 2)
+
+    def test_too_many_ids(self):
+        with self._locmem('test_too_many_ids'):
+            with patch.object(caching, 'MAX_IDS', 5):
+                listings = models.Listing.objects.for_user('wsmith')
+                self.assertTrue(caching.cached_queryset('listings', ['all'],
+                    [models.Listing], listings) is listings)
+
+    def test_cached_instance(self):
+        with self._locmem('test_cached_instance'):
+            self.assertIsNone(generic_model_access.get_profile('nobody'))
+            profile = generic_model_access.get_profile('jones')
+            with self.assertNumQueries(0):
+                cached = generic_model_access.get_profile('jones')
+            self.assertEqual(cached.id, profile.id)
+            self.assertEqual(cached.display_name, profile.display_name)
+            self.assertEqual(cached.visibility_class, profile.visibility_class)
+
+            profile.display_name = 'Jones 2'
+            profile.save()
+            self.assertEqual(generic_model_access.get_profile('jones').display_name,
+                'Jones 2')
+
+    def test_file_cache(self):
+        location = tempfile.mkdtemp()
+        try:
+            with self.settings(CACHES={'default': {
+                    'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+                    'LOCATION': location}}):
+                for i in range(2):
+                    self.assertEqual(generic_model_access.get_profile('jones').user.username,
+                        'jones')
+                stats = caching.get_stats()['current_profile']
+                self.assertEqual((stats['hits'], stats['misses']), (1, 1))
+        finally:
+            shutil.rmtree(location)
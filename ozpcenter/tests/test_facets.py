@@ -0,0 +1,145 @@
+"""
+Listing facet index tests
+"""
+from unittest.mock import patch
+
+from django.db import transaction
+from django.test import TestCase
+
+from ozpcenter.scripts import sample_data_generator as data_gen
+from ozpcenter import caching
+from ozpcenter import facets
+from ozpcenter import models
+import ozpcenter.api.listing.model_access as listing_model_access
+
+
+class FacetIndexTest(TestCase):
+
+    def setUp(self):
+        """
+        setUp is invoked before each test method
+        """
+        pass
+
+    @classmethod
+    def setUpTestData(cls):
+        """
+        Set up test data for the whole TestCase (only run once for the TestCase)
+        """
+        data_gen.run()
+
+    def _filter(self, filter_params, username='wsmith'):
+        return set(listing_model_access.filter_listings(username,
+            filter_params).values_list('id', flat=True))
+
+    def _expected(self, username='wsmith', **filters):
+        listings = models.Listing.objects.for_user(username).filter(
+            approval_status=models.Listing.APPROVED, is_enabled=True)
+        return set(listings.filter(**filters).values_list('id', flat=True))
+
+    def test_bitmaps(self):
+        ids = [0, 3, 8, 9, 200]
+        bitmap = facets.to_bitmap(ids)
+        self.assertEqual(facets.from_bitmap(bitmap), ids)
+        self.assertEqual(facets.count_bitmap(bitmap), 5)
+        self.assertEqual(facets.to_bitmap([]), 0)
+        self.assertEqual(facets.from_bitmap(0), [])
+
+    def test_filter_listings(self):
+        agencies = ['Minitrue', 'Miniluv']
+        self.assertEqual(self._filter({'agencies': agencies}),
+            self._expected(agency__short_name__in=agencies))
+        self.assertEqual(self._filter({'listing_types': ['web application']}),
+            self._expected(listing_type__title='web application'))
+        self.assertEqual(self._filter({'tags': ['tag_1']}),
+            self._expected(tags__name='tag_1'))
+
+        categories = ['Communication', 'Productivity']
+        self.assertEqual(self._filter({'categories': categories}),
+            self._expected(categories__title__in=categories))
+        both = self._filter({'categories': categories, 'category_logic': 'and'})
+        self.assertEqual(both, self._expected(categories__title='Communication') &
+            self._expected(categories__title='Productivity'))
+        self.assertTrue(len(both) > 0)
+
+        self.assertEqual(self._filter({'categories': ['No such category']}),
+            set())
+
+        # too many matches to filter on by id
+        filters = [{'agencies': agencies}, {'tags': ['tag_1']},
+                   {'categories': categories, 'category_logic': 'and'}]
+        results = [self._filter(i) for i in filters]
+        with patch.object(caching, 'MAX_IDS', 1):
+            self.assertEqual([self._filter(i) for i in filters], results)
+
+    def test_counts(self):
+        filter_params = {'agencies': ['Minitrue']}
+        counts = listing_model_access.get_facet_counts('wsmith', filter_params)
+        self.assertEqual(counts['total'], len(self._filter(filter_params)))
+        # the agency counts don't apply the agency filter
+        self.assertEqual(counts['agencies'].get('Miniluv', 0),
+            len(self._expected(agency__short_name='Miniluv')))
+        self.assertTrue(counts['agencies'].get('Miniluv', 0) > 0)
+        self.assertEqual(counts['categories'].get('Communication', 0),
+            len(self._expected(agency__short_name='Minitrue',
+                categories__title='Communication')))
+
+    def test_incremental_changes(self):
+        listing = models.Listing.objects.get(title='Air Mail 1')
+        self.assertTrue(listing.id in self._filter({'agencies': ['Minitrue']}))
+        index = facets.get_index()
+        minitrue_bitmap = index.bitmaps['agencies']['Minitrue']
+
+        with patch.object(facets, '_build', wraps=facets._build) as build:
+            listing.agency = models.Agency.objects.get(short_name='Miniluv')
+            listing.save()
+            listing.categories.clear()
+            listing.tags.add(models.Tag.objects.create(name='zeppelin'))
+            self.assertFalse(listing.id in self._filter({'agencies': ['Minitrue']}))
+            self.assertTrue(listing.id in self._filter({'agencies': ['Miniluv']}))
+            self.assertFalse(listing.id in self._filter({'categories': ['Communication']}))
+            self.assertEqual(self._filter({'tags': ['zeppelin']}), {listing.id})
+            # updated, not rebuilt
+            self.assertEqual(build.call_count, 0)
+        # the changes were applied to a copy
+        self.assertFalse(facets.get_index() is index)
+        self.assertEqual(index.bitmaps['agencies']['Minitrue'], minitrue_bitmap)
+
+        category = models.Category.objects.get(title='Communication')
+        category.title = 'Messaging'
+        category.save()
+        self.assertEqual(self._filter({'categories': ['Messaging']}),
+            self._expected(categories__title='Messaging'))
+
+    def test_late_changes(self):
+        listing = models.Listing.objects.get(title='Air Mail 1')
+        other = models.Listing.objects.get(title='Air Mail 2')
+        facets.get_index()
+
+        with patch.object(facets, '_build', wraps=facets._build) as build:
+            # a change committed after a change with a higher id
+            late = models.ListingChange.objects.create(listing_id=listing.id,
+                token='late')
+            facets.record_change([other.id])
+            late.delete()
+            models.Listing.objects.filter(id=listing.id).update(
+                agency=models.Agency.objects.get(short_name='Miniluv'))
+            self.assertTrue(listing.id in self._filter({'agencies': ['Minitrue']}))
+
+            models.ListingChange.objects.create(id=late.id, listing_id=listing.id,
+                token='late')
+            self.assertFalse(listing.id in self._filter({'agencies': ['Minitrue']}))
+            self.assertTrue(listing.id in self._filter({'agencies': ['Miniluv']}))
+            self.assertEqual(build.call_count, 0)
+
+    def test_rolled_back_changes(self):
+        listing = models.Listing.objects.get(title='Air Mail 1')
+        try:
+            with transaction.atomic():
+                listing.tags.add(models.Tag.objects.create(name='zeppelin'))
+                self.assertEqual(self._filter({'tags': ['zeppelin']}),
+                    {listing.id})
+                raise ValueError
+        except ValueError:
+            pass
+        self.assertEqual(self._filter({'tags': ['zeppelin']}), set())
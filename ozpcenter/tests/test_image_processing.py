@@ -0,0 +1,79 @@
+"""
+Image variant tests
+"""
+import os
+import shutil
+import tempfile
+
+from django.conf import settings
+from django.test import TestCase
+from PIL import Image
+
+from ozpcenter import errors
+from ozpcenter import image_processing
+from ozpcenter import models
+from ozpcenter.scripts import sample_data_generator as data_gen
+
+TEST_IMG_PATH = data_gen.TEST_IMG_PATH
+
+
+class ImageProcessingTest(TestCase):
+
+    def setUp(self):
+        """
+        setUp is invoked before each test method
+        """
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    @classmethod
+    def setUpTestData(cls):
+        """
+        Set up test data for the whole TestCase (only run once for the TestCase)
+        """
+        data_gen.run()
+
+    def _copy(self, name):
+        path = os.path.join(self.directory, '1_small_screenshot.png')
+        shutil.copy(TEST_IMG_PATH + name, path)
+        return path
+
+    def test_variant_paths(self):
+        path = '/media/ab/cd/abcd.png'
+        self.assertEqual(image_processing.get_variant_path(path, (220, 137)),
+            '/media/ab/cd/abcd_220x137.png')
+        self.assertEqual(image_processing.get_variant_paths(path, (220, 137), 'webp'), [
+            '/media/ab/cd/abcd_220x137.webp',
+            '/media/ab/cd/abcd_220x137.png',
+            '/media/ab/cd/abcd.webp',
+            path])
+        self.assertEqual(image_processing.get_variant_paths(path), [path])
+
+    def test_make_variants(self):
+        for workers in [0, 2]:
+            path = self._copy('AirMailFeatured.png')
+            for i in image_processing.get_variant_paths(path, (220, 137)):
+                if i != path and os.path.exists(i):
+                    os.remove(i)
+            with self.settings(OZP=dict(settings.OZP, IMAGE_PROCESS_WORKERS=workers)):
+                paths = image_processing.make_variants(path, 'small_screenshot', 'png')
+            thumbnail = image_processing.get_variant_path(path, (220, 137))
+            self.assertTrue(thumbnail in paths)
+            width, height = Image.open(thumbnail).size
+            self.assertTrue(width <= 220 and height <= 137)
+            self.assertTrue(os.path.getsize(thumbnail) < os.path.getsize(path))
+            # the original (600x376) already fits the display size
+            self.assertFalse(image_processing.get_variant_path(path, (600, 376)) in paths)
+
+    def test_create_image_checks_size(self):
+        count = models.Image.objects.count()
+        img = Image.open(TEST_IMG_PATH + 'AirMail16.png')
+        with self.assertRaises(errors.InvalidInput):
+            models.Image.create_image(img.resize((8, 8)), file_extension='png',
+                image_type='small_icon')
+        with self.assertRaises(errors.InvalidInput):
+            models.Image.create_image(img.resize((3000, 16)), file_extension='png',
+                image_type='small_icon')
+        self.assertEqual(models.Image.objects.count(), count)
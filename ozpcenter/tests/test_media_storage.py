@@ -0,0 +1,102 @@
+"""
+Content addressed media storage tests
+"""
+import io
+import os
+import shutil
+import tempfile
+from unittest.mock import patch
+
+from django.core.management import call_command
+from django.test import TestCase
+from PIL import Image
+
+from ozpcenter import media_storage
+from ozpcenter import models
+from ozpcenter.scripts import sample_data_generator as data_gen
+import ozpcenter.api.image.model_access as image_model_access
+
+
+class MediaStorageTest(TestCase):
+
+    def setUp(self):
+        """
+        setUp is invoked before each test method
+        """
+        self.directory = tempfile.mkdtemp() + '/'
+        self.media_root = self.settings(MEDIA_ROOT=self.directory)
+        self.media_root.enable()
+
+    def tearDown(self):
+        self.media_root.disable()
+        shutil.rmtree(self.directory)
+
+    @classmethod
+    def setUpTestData(cls):
+        """
+        Set up test data for the whole TestCase (only run once for the TestCase)
+        """
+        data_gen.run()
+
+    def _create_image(self):
+        # contents that no sample image has, so its files are only referred
+        # to by the images made here
+        return models.Image.create_image(
+            Image.new('RGB', (600, 376), (12, 34, 56)),
+            file_extension='png', image_type='small_screenshot')
+
+    def test_store(self):
+        content_hash, path = media_storage.store(b'abc', 'png')
+        self.assertEqual(path, os.path.join(self.directory, content_hash[:2],
+            content_hash[2:4], content_hash + '.png'))
+        with open(path, 'rb') as f:
+            self.assertEqual(f.read(), b'abc')
+        self.assertEqual(media_storage.store(b'abc', 'png'), (content_hash, path))
+        self.assertEqual(list(media_storage.iter_hashes()), [content_hash])
+
+    def test_deduplicate(self):
+        image = self._create_image()
+        other_image = self._create_image()
+        self.assertEqual(image.content_hash, other_image.content_hash)
+        paths = media_storage.get_files(image.content_hash)
+        # the original and its thumbnail
+        self.assertEqual(len(paths), 2)
+        self.assertEqual(image_model_access.get_image_path(image),
+            media_storage.get_path(image.content_hash, 'png'))
+
+        with patch.object(media_storage, 'GRACE_SECONDS', -1):
+            image.delete()
+            self.assertTrue(all(os.path.exists(i) for i in paths))
+            # removed with the last image that refers to them
+            other_image.delete()
+            self.assertFalse(any(os.path.exists(i) for i in paths))
+
+    def test_sweep(self):
+        image = self._create_image()
+        content_hash, path = media_storage.store(b'orphan', 'png')
+        out = io.StringIO()
+        call_command('sweep_media', dry_run=True, stdout=out)
+        self.assertTrue(os.path.exists(path))
+        # not removed during the grace period
+        self.assertEqual(image_model_access.sweep_orphaned_files(), 0)
+        with patch.object(media_storage, 'GRACE_SECONDS', -1):
+            self.assertEqual(image_model_access.sweep_orphaned_files(), 1)
+        self.assertFalse(os.path.exists(path))
+        self.assertTrue(media_storage.get_files(image.content_hash))
+
+    def test_relayout(self):
+        image = self._create_image()
+        original = media_storage.get_path(image.content_hash, 'png')
+        legacy_path = media_storage.get_legacy_path(image.id,
+            'small_screenshot', 'png')
+        shutil.copy(original, legacy_path)
+        models.Image.objects.filter(id=image.id).update(content_hash=None)
+        image = models.Image.objects.get(id=image.id)
+        self.assertEqual(image_model_access.get_image_path(image), legacy_path)
+
+        out = io.StringIO()
+        call_command('relayout_media', stdout=out)
+        self.assertTrue('Moved 1 images' in out.getvalue())
+        image = models.Image.objects.get(id=image.id)
+        self.assertEqual(image_model_access.get_image_path(image), original)
+        self.assertFalse(os.path.exists(legacy_path))
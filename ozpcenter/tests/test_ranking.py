@@ -0,0 +1,100 @@
+"""
+Listing popularity ranking tests
+"""
+import io
+
+from django.core.management import call_command
+from django.test import TestCase
+
+from ozpcenter.scripts import sample_data_generator as data_gen
+from ozpcenter import models
+import ozpcenter.api.listing.model_access as listing_model_access
+from ozpcenter import ranking
+
+
+class RankingTest(TestCase):
+
+    def setUp(self):
+        """
+        setUp is invoked before each test method
+        """
+        pass
+
+    @classmethod
+    def setUpTestData(cls):
+        """
+        Set up test data for the whole TestCase (only run once for the TestCase)
+        """
+        data_gen.run()
+
+    def _counts(self, **counts):
+        data = {field: 0 for stars, field in ranking.STAR_FIELDS}
+        data.update(counts)
+        return data
+
+    def test_score(self):
+        mean = 3.0
+        self.assertEqual(ranking.get_score(self._counts(), mean), mean)
+        # a single 5 star vote doesn't beat many 4 star votes
+        self.assertTrue(ranking.get_score(self._counts(total_rate5=1), mean) <
+            ranking.get_score(self._counts(total_rate4=500), mean))
+        self.assertTrue(ranking.get_score(self._counts(total_rate1=500), mean) <
+            ranking.get_score(self._counts(total_rate1=1), mean))
+
+    def test_refresh(self):
+        ranking.refresh()
+        self.assertEqual(ranking.refresh(), 0)
+        mean = ranking.get_mean()
+        for listing in models.Listing.objects.values('popularity_score',
+                *[field for stars, field in ranking.STAR_FIELDS]):
+            self.assertAlmostEqual(listing['popularity_score'],
+                ranking.get_score(listing, mean))
+
+        models.Listing.objects.update(popularity_score=0)
+        out = io.StringIO()
+        call_command('refresh_popularity', stdout=out)
+        self.assertTrue('{0:d} listings'.format(models.Listing.objects.count())
+            in out.getvalue())
+
+    def test_stored_mean(self):
+        mean = ranking.get_mean()
+        # unrated listings score the mean
+        for listing in models.Listing.objects.filter(total_votes=0):
+            self.assertAlmostEqual(listing.popularity_score, mean)
+        # new listings score the stored mean, without computing it
+        agency = models.Agency.objects.get(short_name='Minitrue')
+        listing = models.Listing(title='Unrated', unique_name='ozp.test.unrated',
+            agency=agency)
+        listing.save()
+        self.assertAlmostEqual(listing.popularity_score, ranking.DEFAULT_MEAN)
+
+        # listings are scored against the mean of the last refresh
+        with self.settings(CACHES={'default': {
+                'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}):
+            ranking.refresh()
+            self.assertAlmostEqual(ranking.get_stored_mean(), mean)
+            listing = models.Listing(title='New', unique_name='ozp.test.new',
+                agency=agency)
+            listing.save()
+            self.assertAlmostEqual(listing.popularity_score, mean)
+            air_mail = models.Listing.objects.get(title='Air Mail')
+            listing_model_access.create_listing_review('jones', air_mail, 1)
+            self.assertAlmostEqual(ranking.get_stored_mean(), mean)
+            listing = models.Listing.objects.get(id=air_mail.id)
+            self.assertAlmostEqual(listing.popularity_score, ranking.get_score(
+                {field: getattr(listing, field) for stars, field in ranking.STAR_FIELDS},
+                mean))
+            ranking.refresh()
+            self.assertAlmostEqual(ranking.get_stored_mean(), ranking.get_mean())
+
+    def test_review_updates_score(self):
+        air_mail = models.Listing.objects.get(title='Air Mail')
+        # the listing passed in is updated too
+        old_score = air_mail.popularity_score
+        listing_model_access.create_listing_review('jones', air_mail, 1)
+        listing = models.Listing.objects.get(id=air_mail.id)
+        self.assertAlmostEqual(listing.popularity_score, ranking.get_score(
+            {field: getattr(listing, field) for stars, field in ranking.STAR_FIELDS},
+            ranking.get_mean()))
+        self.assertTrue(listing.popularity_score < old_score)
+        self.assertEqual(air_mail.popularity_score, listing.popularity_score)
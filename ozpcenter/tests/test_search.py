@@ -0,0 +1,99 @@
+"""
+Listing search tests
+"""
+import io
+from unittest.mock import patch
+
+from django.core.management import call_command
+from django.test import TestCase
+
+from ozpcenter.scripts import sample_data_generator as data_gen
+from ozpcenter import models
+import ozpcenter.api.listing.model_access as listing_model_access
+from ozpcenter import search
+from plugins_util import plugin_manager
+
+
+class ListingSearchTest(TestCase):
+
+    def setUp(self):
+        """
+        setUp is invoked before each test method
+        """
+        pass
+
+    @classmethod
+    def setUpTestData(cls):
+        """
+        Set up test data for the whole TestCase (only run once for the TestCase)
+        """
+        data_gen.run()
+
+    def _search(self, text, username='wsmith', filter_params=None):
+        listings = listing_model_access.filter_listings(username,
+            filter_params or {})
+        return [i.id for i in search.search_listings(listings, text)]
+
+    def test_documents_after_sample_data(self):
+        self.assertEqual(models.ListingSearchDocument.objects.count(),
+            models.Listing.objects.count())
+        listing = models.Listing.objects.get(title='Air Mail 1')
+        self.assertEqual(listing.search_document.tags, 'demo example tag_1')
+
+    def test_search_terms(self):
+        self.assertEqual(search.get_terms('air "ma'), ['air', 'ma'])
+        self.assertEqual(search.get_terms(' '), [])
+        self.assertEqual(search.get_terms(None), [])
+        # no terms, no filtering
+        self.assertEqual(len(self._search('"')), len(self._search(None)))
+
+    def test_listing_changes(self):
+        listing = models.Listing.objects.get(title='Air Mail 1')
+        self.assertEqual(self._search('Zeppelin'), [])
+
+        listing.title = 'Zeppelin Mail'
+        listing.save()
+        self.assertEqual(self._search('zeppelin'), [listing.id])
+
+        tag = models.Tag.objects.create(name='dirigible')
+        listing.tags.add(tag)
+        self.assertEqual(self._search('dirig'), [listing.id])
+        tag.name = 'blimp'
+        tag.save()
+        self.assertEqual(self._search('dirig'), [])
+        self.assertEqual(self._search('blimp'), [listing.id])
+        tag.delete()
+        self.assertEqual(self._search('blimp'), [])
+
+    def test_ranking(self):
+        # a title match beats a description match
+        air_mail = models.Listing.objects.get(title='Air Mail 2')
+        bread_basket = models.Listing.objects.get(title='Bread Basket')
+        bread_basket.description = 'Mails bread'
+        bread_basket.save()
+        air_mail.title = 'Bread Mail'
+        air_mail.save()
+        self.assertEqual(self._search('bread mail')[:2],
+            [air_mail.id, bread_basket.id])
+
+    def test_filters_and_access_control(self):
+        ids = self._search('air', filter_params={'agencies': ['Minipax']})
+        self.assertEqual(ids, [])
+        ids = self._search('air', filter_params={'agencies': ['Minitrue']})
+        self.assertEqual(len(ids), 10)
+
+        listing = models.Listing.objects.get(title='Air Mail 3')
+        self.assertTrue(listing.id in self._search('air', username='jones'))
+        # the default plugin lets everyone see everything
+        access_control_instance = plugin_manager.get_system_access_control_plugin()
+        with patch.object(access_control_instance, 'has_access',
+                side_effect=lambda accesses, marking: marking != 'TOP SECRET'):
+            listing.security_marking = 'TOP SECRET'
+            listing.save()
+        self.assertFalse(listing.id in self._search('air', username='jones'))
+
+    def test_rebuild(self):
+        models.ListingSearchDocument.objects.all().delete()
+        self.assertEqual(self._search('air'), [])
+        call_command('rebuild_search_index', stdout=io.StringIO())
+        self.assertEqual(len(self._search('air')), 10)
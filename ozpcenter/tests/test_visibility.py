@@ -0,0 +1,155 @@
+"""
+Listing visibility tests
+"""
+import io
+import json
+from unittest.mock import patch
+
+from django.contrib import auth
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase
+
+from ozpcenter.scripts import sample_data_generator as data_gen
+from ozpcenter import models
+import ozpcenter.api.listing.model_access as listing_model_access
+import ozpcenter.model_access as generic_model_access
+from ozpcenter import visibility
+
+
+class ListingVisibilityTest(TestCase):
+
+    def setUp(self):
+        """
+        setUp is invoked before each test method
+        """
+        pass
+
+    @classmethod
+    def setUpTestData(cls):
+        """
+        Set up test data for the whole TestCase (only run once for the TestCase)
+        """
+        data_gen.run()
+
+    def _visible_ids(self, username):
+        return set(models.Listing.objects.for_user(username).values_list(
+            'id', flat=True))
+
+    def test_consistent_after_sample_data(self):
+        self.assertEqual(visibility.check(), (set(), set()))
+
+    def test_listing_privacy_and_agency(self):
+        listing = models.Listing.objects.filter(is_private=False).first()
+        profile = models.Profile.objects.get(user__username='jones')
+        other_agency = models.Agency.objects.exclude(
+            id__in=profile.organizations.all()).first()
+        self.assertTrue(listing.id in self._visible_ids('jones'))
+
+        listing.is_private = True
+        listing.agency = other_agency
+        listing.save()
+        self.assertFalse(listing.id in self._visible_ids('jones'))
+        # apps mall stewards see all private listings
+        self.assertTrue(listing.id in self._visible_ids('bigbrother'))
+
+        # joining the listing's agency makes it visible
+        profile.organizations.add(other_agency)
+        self.assertTrue(listing.id in self._visible_ids('jones'))
+        other_agency.profiles.remove(profile)
+        self.assertFalse(listing.id in self._visible_ids('jones'))
+        # clearing the agency's members refreshes just them
+        profile.organizations.add(other_agency)
+        self.assertTrue(listing.id in self._visible_ids('jones'))
+        other_agency.profiles.clear()
+        self.assertFalse(listing.id in self._visible_ids('jones'))
+        self.assertEqual(visibility.check(), (set(), set()))
+
+        # so does becoming an apps mall steward
+        profile.user.groups.add(
+            auth.models.Group.objects.get(name='APPS_MALL_STEWARD'))
+        self.assertTrue(listing.id in self._visible_ids('jones'))
+        self.assertEqual(visibility.check(), (set(), set()))
+
+    def test_rebuild(self):
+        expected = self._visible_ids('jones')
+        models.ListingVisibility.objects.all().delete()
+        missing, extra = visibility.check()
+        self.assertTrue(len(missing) > 0)
+        self.assertEqual(extra, set())
+        with self.assertRaises(CommandError):
+            call_command('check_listing_visibility', stdout=io.StringIO())
+
+        call_command('rebuild_listing_visibility', stdout=io.StringIO())
+        self.assertEqual(visibility.check(), (set(), set()))
+        self.assertEqual(self._visible_ids('jones'), expected)
+
+    def test_visibility_class(self):
+        # same role, organizations, and (equivalent) access_control
+        jones = models.Profile.objects.get(user__username='jones')
+        syme = models.Profile.objects.get(user__username='syme')
+        syme.organizations.clear()
+        syme.organizations.add(*jones.organizations.all())
+        accesses = json.loads(jones.access_control)
+        syme.access_control = json.dumps({key: list(reversed(value))
+            for key, value in accesses.items()})
+        syme.save()
+        self.assertEqual(syme.visibility_class, jones.visibility_class)
+        self.assertEqual(self._visible_ids('syme'), self._visible_ids('jones'))
+
+        # a different organization is a different class
+        other_agency = models.Agency.objects.exclude(
+            id__in=jones.organizations.all()).first()
+        syme.organizations.add(other_agency)
+        syme = models.Profile.objects.get(id=syme.id)
+        self.assertNotEqual(syme.visibility_class, jones.visibility_class)
+
+        # unless the role makes organizations irrelevant
+        for profile in [syme, jones]:
+            profile.user.groups.add(
+                auth.models.Group.objects.get(name='APPS_MALL_STEWARD'))
+        syme = models.Profile.objects.get(id=syme.id)
+        jones = models.Profile.objects.get(id=jones.id)
+        self.assertEqual(syme.visibility_class, jones.visibility_class)
+
+    def test_visibility_class_on_save(self):
+        jones = models.Profile.objects.get(user__username='jones')
+        loaded = models.Profile.objects.get(id=jones.id)
+        jones.organizations.add(models.Agency.objects.exclude(
+            id__in=jones.organizations.all()).first())
+        visibility_class = models.Profile.objects.get(id=jones.id).visibility_class
+        self.assertNotEqual(visibility_class, loaded.visibility_class)
+
+        # saving without changing the access_control (like an auth refresh)
+        # doesn't recompute the class, nor overwrite the stored one
+        with patch.object(visibility, 'get_profile_visibility_class') as get_class:
+            loaded.display_name = 'Jones the poet'
+            loaded.save()
+            self.assertEqual(get_class.call_count, 0)
+        jones = models.Profile.objects.get(id=jones.id)
+        self.assertEqual(jones.display_name, 'Jones the poet')
+        self.assertEqual(jones.visibility_class, visibility_class)
+
+        jones.access_control = json.dumps({'clearances': ['UNCLASSIFIED'],
+            'formal_accesses': [], 'visas': []})
+        jones.save()
+        self.assertNotEqual(jones.visibility_class, visibility_class)
+        self.assertEqual(models.Profile.objects.get(id=jones.id).visibility_class,
+            jones.visibility_class)
+
+    def test_visibility_class_cache(self):
+        jones = models.Profile.objects.get(user__username='jones')
+        with self.settings(CACHES={'default': {
+                'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                'LOCATION': 'test_visibility_class_cache'}}):
+            listings = listing_model_access.get_listings('jones')
+            self.assertEqual(set(listings),
+                set(models.Listing.objects.for_user('jones')))
+            # joining an organization moves jones to another class
+            jones.organizations.add(models.Agency.objects.exclude(
+                id__in=jones.organizations.all()).first())
+            self.assertNotEqual(
+                generic_model_access.get_profile('jones').visibility_class,
+                jones.visibility_class)
+            self.assertEqual(set(listing_model_access.get_listings('jones')),
+                set(models.Listing.objects.for_user('jones')))
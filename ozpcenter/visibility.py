@@ -0,0 +1,324 @@
+"""
+Listing visibility
+
+The Listings each user can see are materialized in the ListingVisibility
+table, so that Listing.objects.for_user is a single indexed join instead of
+recomputing the access rules on every request
+
+Which Listings a Profile can see depends on:
+    * the Profile's access_control (checked against each Listing's
+        security_marking by the access control plugin)
+    * the Profile's role, organizations, and stewarded_organizations (for
+        private Listings):
+        - APPS_MALL_STEWARDs see all private Listings
+        - ORG_STEWARDs see the private Listings of their stewarded
+            organizations
+        - everyone else sees the private Listings of their organizations
+    * the Listing's security_marking, is_private, and agency
+
+The table is kept up to date incrementally by the handlers in
+ozpcenter.signals, which call refresh_profiles or refresh_listings when any of
+the above changes. rebuild recreates the whole table and check reports any
+rows that are out of date (see the rebuild_listing_visibility and
+check_listing_visibility management commands)
+
+Profiles with the same (normalized) access_control and the same
+organizations relevant to their role see exactly the same Listings. A
+fingerprint of these inputs - the Profile's visibility class - is stored on
+each Profile, so that results that only depend on visibility can be cached
+once per class instead of once per user. Since the rows and visibility
+classes are written in bulk, the ListingVisibility and Profile cache
+generations are bumped here (see ozpcenter.caching)
+"""
+import collections
+import hashlib
+import json
+import logging
+
+from django.apps import apps
+from django.db import transaction
+
+from ozpcenter import caching
+from plugins_util import plugin_manager
+
+# Get an instance of a logger
+logger = logging.getLogger('ozp-center.' + str(__name__))
+
+# number of rows to insert or delete per query
+BATCH_SIZE = 500
+
+
+def _get_models():
+    # not imported, as ozpcenter.models imports this module
+    return (apps.get_model('ozpcenter', 'Profile'),
+            apps.get_model('ozpcenter', 'Listing'),
+            apps.get_model('ozpcenter', 'ListingVisibility'))
+
+
+def _get_visibility_keys(profile_ids=None):
+    """
+    Get the inputs of the access rules for each Profile
+
+    Returns:
+        {profile_id: (access_control, organization_ids)} where
+        organization_ids is a frozenset of the Agencies whose private Listings
+        the Profile can see, or None if the Profile can see all of them.
+        Profiles with equal keys see exactly the same Listings
+    """
+    Profile = _get_models()[0]
+    profiles = Profile.objects.order_by()
+    if profile_ids is not None:
+        profiles = profiles.filter(id__in=profile_ids)
+
+    access_controls = dict(profiles.values_list('id', 'access_control'))
+    groups = collections.defaultdict(set)
+    organizations = collections.defaultdict(set)
+    stewarded_organizations = collections.defaultdict(set)
+    # each related set is a single (outer) join - skip the NULL rows of
+    # Profiles without any
+    for related, values in [('user__groups__name', groups),
+                            ('organizations', organizations),
+                            ('stewarded_organizations', stewarded_organizations)]:
+        for profile_id, value in profiles.values_list('id', related):
+            if value is not None:
+                values[profile_id].add(value)
+
+    return {profile_id: _make_visibility_key(access_control, groups[profile_id],
+                organizations[profile_id], stewarded_organizations[profile_id])
+            for profile_id, access_control in access_controls.items()}
+
+
+def _normalize_access_control(access_control):
+    """
+    Make equivalent access_controls (e.g. with keys or values in a different
+    order) equal
+    """
+    try:
+        accesses = json.loads(access_control)
+    except (TypeError, ValueError):
+        # leave it to the access control plugin to reject
+        return access_control
+    if not isinstance(accesses, dict):
+        return access_control
+    accesses = {key: sorted(set(value)) if isinstance(value, list) else value
+                for key, value in accesses.items()}
+    return json.dumps(accesses, sort_keys=True)
+
+
+def _make_visibility_key(access_control, group_names, organization_ids,
+        stewarded_organization_ids):
+    """
+    Reduce a Profile's access_control, role, and organizations to the inputs
+    of the access rules
+    """
+    # role precedence matches Profile.highest_role
+    if 'APPS_MALL_STEWARD' in group_names:
+        relevant_organization_ids = None
+    elif 'ORG_STEWARD' in group_names:
+        relevant_organization_ids = frozenset(stewarded_organization_ids)
+    else:
+        relevant_organization_ids = frozenset(organization_ids)
+    return (_normalize_access_control(access_control), relevant_organization_ids)
+
+
+def _get_visibility_class(key):
+    access_control, organization_ids = key
+    if organization_ids is not None:
+        organization_ids = sorted(organization_ids)
+    fingerprint = json.dumps([access_control, organization_ids])
+    return hashlib.sha1(fingerprint.encode('utf-8')).hexdigest()
+
+
+def get_profile_visibility_class(profile):
+    """
+    Compute the visibility class of a Profile instance (which doesn't have to
+    be saved yet)
+    """
+    group_names = []
+    if profile.user_id is not None:
+        group_names = profile.user.groups.values_list('name', flat=True)
+    organization_ids = []
+    stewarded_organization_ids = []
+    if profile.pk is not None:
+        organization_ids = profile.organizations.values_list('id', flat=True)
+        stewarded_organization_ids = profile.stewarded_organizations.values_list(
+            'id', flat=True)
+    return _get_visibility_class(_make_visibility_key(profile.access_control,
+        set(group_names), organization_ids, stewarded_organization_ids))
+
+
+def _get_listing_states(listing_ids=None):
+    """
+    Get the (id, is_private, agency_id, security_marking) of Listings
+    """
+    Listing = _get_models()[1]
+    listings = Listing.objects.order_by()
+    if listing_ids is not None:
+        listings = listings.filter(id__in=listing_ids)
+    return list(listings.values_list('id', 'is_private', 'agency_id',
+        'security_marking'))
+
+
+def _visible_listing_ids(key, listing_states):
+    """
+    Apply the access rules for one visibility key to a list of Listings
+
+    The access control plugin is consulted once per distinct marking
+    """
+    access_control, organization_ids = key
+    access_control_instance = plugin_manager.get_system_access_control_plugin()
+    markings = list({i[3] for i in listing_states})
+    decisions = plugin_manager.has_access_many(access_control_instance,
+        access_control, markings)
+    allowed_markings = {marking for marking, decision in zip(markings, decisions)
+                        if decision}
+
+    visible_ids = set()
+    for listing_id, is_private, agency_id, marking in listing_states:
+        if marking not in allowed_markings:
+            continue
+        # private listings without an agency are visible to everyone
+        if (is_private and organization_ids is not None and
+                agency_id is not None and agency_id not in organization_ids):
+            continue
+        visible_ids.add(listing_id)
+    return visible_ids
+
+
+def _get_expected_pairs(keys, listing_ids=None):
+    """
+    Get the (profile_id, listing_id) pairs the table should contain for the
+    given Profiles (see _get_visibility_keys) and Listings (all of them if
+    None)
+    """
+    listing_states = _get_listing_states(listing_ids)
+
+    profiles_by_key = collections.defaultdict(list)
+    for profile_id, key in keys.items():
+        profiles_by_key[key].append(profile_id)
+
+    pairs = set()
+    for key, key_profile_ids in profiles_by_key.items():
+        visible_ids = _visible_listing_ids(key, listing_states)
+        pairs.update((profile_id, listing_id)
+                     for profile_id in key_profile_ids
+                     for listing_id in visible_ids)
+    return pairs
+
+
+def _get_actual_pairs(profile_ids=None, listing_ids=None):
+    ListingVisibility = _get_models()[2]
+    entries = ListingVisibility.objects.order_by()
+    if profile_ids is not None:
+        entries = entries.filter(profile_id__in=profile_ids)
+    if listing_ids is not None:
+        entries = entries.filter(listing_id__in=listing_ids)
+    return {(profile_id, listing_id): entry_id for entry_id, profile_id, listing_id
+            in entries.values_list('id', 'profile_id', 'listing_id')}
+
+
+def _store_visibility_classes(keys):
+    """
+    Update the visibility_class of Profiles given their visibility keys
+    """
+    Profile = _get_models()[0]
+    current = dict(Profile.objects.filter(id__in=list(keys)).values_list(
+        'id', 'visibility_class'))
+
+    profiles_by_class = collections.defaultdict(list)
+    for profile_id, key in keys.items():
+        visibility_class = _get_visibility_class(key)
+        if current.get(profile_id) != visibility_class:
+            profiles_by_class[visibility_class].append(profile_id)
+
+    for visibility_class, profile_ids in profiles_by_class.items():
+        for i in range(0, len(profile_ids), BATCH_SIZE):
+            Profile.objects.filter(id__in=profile_ids[i:i + BATCH_SIZE]).update(
+                visibility_class=visibility_class)
+    if profiles_by_class:
+        caching.bump_generation(Profile)
+
+
+def update_visibility_classes():
+    """
+    Update the visibility_class of all Profiles
+    """
+    _store_visibility_classes(_get_visibility_keys())
+
+
+def _sync(profile_ids=None, listing_ids=None):
+    """
+    Bring the rows for the given Profiles and Listings up to date, only
+    inserting and deleting the rows that changed
+    """
+    ListingVisibility = _get_models()[2]
+    with transaction.atomic():
+        keys = _get_visibility_keys(profile_ids)
+        if profile_ids is not None:
+            _store_visibility_classes(keys)
+        expected = _get_expected_pairs(keys, listing_ids)
+        actual = _get_actual_pairs(profile_ids, listing_ids)
+
+        stale_ids = [entry_id for pair, entry_id in actual.items()
+                     if pair not in expected]
+        for i in range(0, len(stale_ids), BATCH_SIZE):
+            ListingVisibility.objects.filter(
+                id__in=stale_ids[i:i + BATCH_SIZE]).delete()
+
+        new_entries = [ListingVisibility(profile_id=profile_id, listing_id=listing_id)
+                       for profile_id, listing_id in expected if
+                       (profile_id, listing_id) not in actual]
+        ListingVisibility.objects.bulk_create(new_entries, batch_size=BATCH_SIZE)
+    if stale_ids or new_entries:
+        caching.bump_generation(ListingVisibility)
+
+
+def refresh_profiles(profile_ids):
+    """
+    Update the visible Listings of the given Profiles
+    """
+    profile_ids = list(profile_ids)
+    if profile_ids:
+        _sync(profile_ids=profile_ids)
+
+
+def refresh_listings(listing_ids):
+    """
+    Update the Profiles that can see the given Listings
+    """
+    listing_ids = list(listing_ids)
+    if listing_ids:
+        _sync(listing_ids=listing_ids)
+
+
+def rebuild():
+    """
+    Recreate the whole table from scratch
+
+    Returns:
+        the number of rows created
+    """
+    ListingVisibility = _get_models()[2]
+    with transaction.atomic():
+        ListingVisibility.objects.all().delete()
+        pairs = _get_expected_pairs(_get_visibility_keys())
+        ListingVisibility.objects.bulk_create(
+            [ListingVisibility(profile_id=profile_id, listing_id=listing_id)
+             for profile_id, listing_id in pairs],
+            batch_size=BATCH_SIZE)
+    caching.bump_generation(ListingVisibility)
+    logger.info('Rebuilt listing visibility: {0:d} rows'.format(len(pairs)))
+    return len(pairs)
+
+
+def check():
+    """
+    Compare the table against the access rules
+
+    Returns:
+        (missing, extra): sets of (profile_id, listing_id) pairs that should be
+        in the table but are not, and that are in the table but should not be
+    """
+    expected = _get_expected_pairs(_get_visibility_keys())
+    actual = set(_get_actual_pairs())
+    return (expected - actual, actual - expected)
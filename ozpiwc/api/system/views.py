@@ -36,6 +36,7 @@ def ApplicationListView(request):
     data = hal.create_base_structure(request, hal.generate_content_type(
         request.accepted_media_type))
     applications = listing_model_access.get_listings(profile.user.username)
+    applications = applications.prefetch_related('intents__icon')
     items = []
     embedded_items = []
     for i in applications:
@@ -82,7 +83,9 @@ def ApplicationView(request, id='0'):
 
     # This minimal definition of what a Listing object must have should be
     # advertised so that others can use IWC with their own systems
-    queryset = listing_model_access.get_listing_by_id(profile.user.username, id)
+    listings = listing_serializers.ListingSerializer.setup_eager_loading(
+        listing_model_access.get_listings(profile.user.username))
+    queryset = listings.filter(id=id).first()
     if not queryset:
         return Response(status=status.HTTP_404_NOT_FOUND)
     serializer = listing_serializers.ListingSerializer(queryset,
@@ -0,0 +1,69 @@
+"""
+Cache File
+
+A small bounded LRU mapping used to memoize parsed markings, parsed user
+accesses, and access decisions
+"""
+import collections
+import threading
+
+
+class LRUCache(object):
+    """
+    Bounded least-recently-used cache with hit/miss counters
+
+    Usage:
+        cache = LRUCache(maxsize=1000)
+        value = cache.get(key)
+        if value is LRUCache.MISSING:
+            value = compute(key)
+            cache.set(key, value)
+    """
+    MISSING = object()
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._data = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Return the cached value for key, or LRUCache.MISSING
+        """
+        with self._lock:
+            try:
+                value = self._data.pop(key)
+            except KeyError:
+                self.misses += 1
+                return self.MISSING
+            # re-insert to mark as most recently used
+            self._data[key] = value
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = value
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def info(self):
+        """
+        Return cache statistics
+        """
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'maxsize': self.maxsize,
+                'currsize': len(self._data)}
+
+    def __len__(self):
+        return len(self._data)
@@ -15,14 +15,44 @@ Classification Validation:
 This simple logic is this: for a user to have access:
     1. They must have a classification equal to or higher than that required
     2. They must have at least all controls that are required (in any order)
+
+Markings and user accesses are compiled once and access decisions are
+memoized, as a single request can check thousands of (mostly identical)
+markings for the same user
+
+Compiled markings and user accesses are represented as a (level, mask) pair,
+where each known dissemination control owns a bit of the mask, so that the
+check itself is one integer compare and one AND:
+    user_level >= level and not (mask & ~user_mask)
+
+Controls that are not in tokens_list have no bit and are compared as strings
 """
+import collections
 import json
 import logging
+import sys
 
+from . import cache as access_cache
 from . import tokens as all_tokens
 
 logger = logging.getLogger('ozp-center.' + str(__name__))
 
+# max number of entries held by each of the plugin's caches
+CACHE_SIZE = 10000
+
+# parts: tuple of interned marking parts
+# level: required classification level (None if the classification is unknown)
+# mask: bitmask of required known controls
+# extra_controls: frozenset of required controls that have no bit
+CompiledMarking = collections.namedtuple('CompiledMarking',
+    ['parts', 'level', 'mask', 'extra_controls'])
+
+# level: highest classification level the user is cleared for
+# mask: bitmask of known controls the user holds
+# extra_controls: frozenset of held controls that have no bit
+CompiledAccesses = collections.namedtuple('CompiledAccesses',
+    ['level', 'mask', 'extra_controls'])
+
 
 tokens_list = [
     # Classification Tokens
@@ -47,9 +77,12 @@ tokens_list = [
              'level': 4}
     },
     # Dissemination Control Tokens
+    # bit positions are stored in the database (as part of encoded markings),
+    # so never reuse or change the bit of an existing control
     {'type': 'DisseminationControl',
      'data': {'short_name': 'FOUO',
-             'long_name': 'FOR OFFICIAL USE ONLY'}
+             'long_name': 'FOR OFFICIAL USE ONLY',
+             'bit': 0}
     }
 ]
 
@@ -68,6 +101,22 @@ class PluginMain(object):
 
         self.tokens = [self._convert_dict_to_token(input) for input in tokens_list]
 
+        # the token lookups never change, so build them once
+        self.long_name_lookup = {}
+        for token in self.tokens:
+            self.long_name_lookup[token.long_name.upper()] = token
+
+        self.short_name_lookup = {}
+        for token in self.tokens:
+            self.short_name_lookup[token.short_name.upper()] = token
+
+        # marking string -> CompiledMarking
+        self.marking_cache = access_cache.LRUCache(CACHE_SIZE)
+        # user accesses json -> CompiledAccesses
+        self.user_accesses_cache = access_cache.LRUCache(CACHE_SIZE)
+        # (user accesses json, marking) -> access decision
+        self.decision_cache = access_cache.LRUCache(CACHE_SIZE)
+
     def _convert_dict_to_token(self, input):
         """
         Converts Dictionary into Token
@@ -89,38 +138,171 @@ class PluginMain(object):
 
         return token_type_class(**data)
 
-    def _split_tokens(self, input_marking, delimiter='//'):
+    def _lookup_token(self, name):
         """
-        This method is responsible for converting a String into Tokens
+        Return the known token for a long or short name, or None
         """
-        long_name_lookup = {}
-        for token in self.tokens:
-            long_name_lookup[token.long_name.upper()] = token
+        name_upper = name.upper()
+        token = self.long_name_lookup.get(name_upper)
+        if token is None:
+            token = self.short_name_lookup.get(name_upper)
+        return token
 
-        short_name_lookup = {}
-        for token in self.tokens:
-            short_name_lookup[token.short_name.upper()] = token
+    def _compile_marking(self, input_marking, delimiter='//'):
+        """
+        Convert a marking String into a CompiledMarking
 
-        markings = input_marking.split(delimiter)
+        'SECRET//FOUO//XYZ' -> CompiledMarking(parts=('SECRET', 'FOUO', 'XYZ'),
+            level=3, mask=0b1, extra_controls=frozenset({'XYZ'}))
+        """
+        key = (input_marking, delimiter)
+        compiled = self.marking_cache.get(key)
+        if compiled is not access_cache.LRUCache.MISSING:
+            return compiled
 
-        output_tokens = []
-        for marking in markings:
-            current_token = None
+        parts = tuple(sys.intern(marking) for marking in input_marking.split(delimiter))
 
-            if marking.upper() in long_name_lookup:
-                current_token = long_name_lookup[marking.upper()]
+        classification = self._lookup_token(parts[0])
+        if isinstance(classification, all_tokens.ClassificationToken):
+            level = classification.level
+        else:
+            level = None
+
+        mask = 0
+        extra_controls = set()
+        for part in parts[1:]:
+            control = self._lookup_token(part)
+            if isinstance(control, all_tokens.DisseminationControlToken):
+                mask |= 1 << control.bit
             else:
-                if marking.upper() in short_name_lookup:
-                    current_token = short_name_lookup[marking.upper()]
+                extra_controls.add(part)
+
+        compiled = CompiledMarking(parts, level, mask, frozenset(extra_controls))
+        self.marking_cache.set(key, compiled)
+        return compiled
+
+    def _compile_user_accesses(self, user_accesses_json):
+        """
+        Convert user accesses json into CompiledAccesses, combining the
+        user's formal accesses and visas into a single set of controls
+
+        The json is only parsed the first time a given string is seen, so a
+        profile's access_control is parsed once until it changes
+
+        Returns None if the json is invalid
+        """
+        compiled = self.user_accesses_cache.get(user_accesses_json)
+        if compiled is not access_cache.LRUCache.MISSING:
+            return compiled
+
+        try:
+            user_accesses = json.loads(user_accesses_json)
+        except (TypeError, ValueError):
+            logger.error('Error parsing JSON data: {0!s}'.format(user_accesses_json))
+            compiled = None
+        else:
+            level = 0
+            for clearance in user_accesses.get('clearances', []):
+                token = self._lookup_token(clearance)
+                if isinstance(token, all_tokens.ClassificationToken):
+                    level = max(level, token.level)
+
+            mask = 0
+            extra_controls = set()
+            for control in user_accesses.get('formal_accesses', []) + user_accesses.get('visas', []):
+                token = self._lookup_token(control)
+                if isinstance(token, all_tokens.DisseminationControlToken):
+                    mask |= 1 << token.bit
                 else:
-                    current_token = all_tokens.UnknownToken(long_name=marking)
+                    extra_controls.add(sys.intern(control))
+
+            compiled = CompiledAccesses(level, mask, frozenset(extra_controls))
+
+        self.user_accesses_cache.set(user_accesses_json, compiled)
+        return compiled
+
+    def encode_marking(self, marking):
+        """
+        Return the storable (level, mask) integer encoding of a marking
+
+        Returns (None, None) if the marking can't be fully represented (no
+        marking, an unknown classification, or controls that have no bit) -
+        such markings must be checked with has_access instead
+        """
+        if not marking:
+            return (None, None)
+        compiled = self._compile_marking(marking)
+        if compiled.level is None or compiled.extra_controls:
+            return (None, None)
+        return (compiled.level, compiled.mask)
+
+    def encode_user_accesses(self, user_accesses_json):
+        """
+        Return the storable (level, mask) integer encoding of user accesses
+
+        Returns (None, None) if the json is invalid
+        """
+        compiled = self._compile_user_accesses(user_accesses_json)
+        if compiled is None:
+            return (None, None)
+        return (compiled.level, compiled.mask)
+
+    @staticmethod
+    def has_access_encoded(user_level, user_mask, level, mask):
+        """
+        Access check on encoded user accesses and an encoded marking
+        """
+        return user_level >= level and not (mask & ~user_mask)
+
+    def _split_tokens(self, input_marking, delimiter='//'):
+        """
+        This method is responsible for converting a String into Tokens
+        """
+        output_tokens = []
+        for marking in self._compile_marking(input_marking, delimiter).parts:
+            current_token = self._lookup_token(marking)
+            if current_token is None:
+                current_token = all_tokens.UnknownToken(long_name=marking)
 
             output_tokens.append(current_token)
         return output_tokens
 
+    def get_cache_info(self):
+        """
+        Return hit/miss statistics for the plugin's caches
+        """
+        return {
+            'markings': self.marking_cache.info(),
+            'user_accesses': self.user_accesses_cache.info(),
+            'decisions': self.decision_cache.info()
+        }
+
+    def clear_cache(self):
+        self.marking_cache.clear()
+        self.user_accesses_cache.clear()
+        self.decision_cache.clear()
+
     def has_access(self, user_accesses_json, marking):
         return True
 
+    def has_access_many(self, user_accesses_json, markings):
+        """
+        Determine if a user has access to each of many markings
+
+        Identical markings are only checked once
+
+        Args:
+            user_accesses_json (string): user accesses in json (clearances, formal_accesses, visas)
+            markings (list): security markings
+
+        Returns:
+            list of booleans, one decision per marking (in order)
+        """
+        decisions = {}
+        for marking in set(markings):
+            decisions[marking] = self.has_access(user_accesses_json, marking)
+        return [decisions[marking] for marking in markings]
+
     def future_has_access(self, user_accesses_json, marking):
         """
         Determine if a user has access to a given access control
@@ -140,32 +322,35 @@ class PluginMain(object):
         """
         if not marking:
             return False
-        markings = marking.split('//')
-        # get the user's access_control data
-        try:
-            user_accesses = json.loads(user_accesses_json)
-        except ValueError:
-            logger.error('Error parsing JSON data: {0!s}'.format(user_accesses_json))
-            return False
 
-        # check clearances
-        clearances = user_accesses['clearances']
-        required_clearance = markings[0]
+        key = (user_accesses_json, marking)
+        decision = self.decision_cache.get(key)
+        if decision is access_cache.LRUCache.MISSING:
+            decision = self._compute_access(user_accesses_json, marking)
+            self.decision_cache.set(key, decision)
+        return decision
 
-        if required_clearance not in clearances:
+    def _compute_access(self, user_accesses_json, marking):
+        """
+        Uncached access check used by future_has_access
+        """
+        compiled_marking = self._compile_marking(marking)
+        if compiled_marking.level is None:
             return False
 
-        # just combine all of the user's formal accesses and visas
-        user_controls = user_accesses['formal_accesses']
-        user_controls += user_accesses['visas']
+        # get the user's access_control data
+        user_accesses = self._compile_user_accesses(user_accesses_json)
+        if user_accesses is None:
+            return False
 
-        required_controls = markings[1:]
-        missing_controls = [i for i in required_controls if i not in user_controls]
-        if not missing_controls:
-            return True
-        else:
+        # check clearance and known controls
+        if not self.has_access_encoded(user_accesses.level, user_accesses.mask,
+                compiled_marking.level, compiled_marking.mask):
             return False
 
+        # check remaining controls
+        return compiled_marking.extra_controls <= user_accesses.extra_controls
+
     def validate_marking(self, marking):
         """
         This function is responsible for validating a marking string
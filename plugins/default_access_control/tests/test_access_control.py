@@ -253,3 +253,94 @@ class AccessControlTest(TestCase):
         self.assertFalse(self.access_control_instance.future_has_access(user_accesses_json, marking))
         marking = 'INVALID LEVEL'
         self.assertFalse(self.access_control_instance.future_has_access(user_accesses_json, marking))
+
+    def test_compile_marking(self):
+        compiled = self.access_control_instance._compile_marking('SECRET//FOUO//ABC')
+        self.assertEqual(compiled.parts, ('SECRET', 'FOUO', 'ABC'))
+        self.assertEqual(compiled.level, 3)
+        self.assertEqual(compiled.mask, 1)
+        self.assertEqual(compiled.extra_controls, frozenset(['ABC']))
+        # compiled markings are reused, not re-parsed
+        self.assertIs(self.access_control_instance._compile_marking('SECRET//FOUO//ABC'), compiled)
+
+    def test_has_access_decision_cache(self):
+        user_accesses_json = json.dumps(
+            {
+                "clearances": ["UNCLASSIFIED", "CONFIDENTIAL"],
+                "formal_accesses": ["FOUO"],
+                "visas": ["ABC"]
+            }
+        )
+        self.access_control_instance.clear_cache()
+
+        for i in range(3):
+            self.assertTrue(self.access_control_instance.future_has_access(user_accesses_json, 'CONFIDENTIAL//FOUO//ABC'))
+            self.assertFalse(self.access_control_instance.future_has_access(user_accesses_json, 'SECRET'))
+
+        cache_info = self.access_control_instance.get_cache_info()
+        self.assertEqual(cache_info['decisions']['misses'], 2)
+        self.assertEqual(cache_info['decisions']['hits'], 4)
+        # the user's json was only parsed once
+        self.assertEqual(cache_info['user_accesses']['misses'], 1)
+        self.assertEqual(cache_info['user_accesses']['currsize'], 1)
+
+        # a changed access_control string is a different user access
+        user_accesses_json = json.dumps(
+            {
+                "clearances": ["UNCLASSIFIED", "CONFIDENTIAL", "SECRET"],
+                "formal_accesses": [],
+                "visas": []
+            }
+        )
+        self.assertTrue(self.access_control_instance.future_has_access(user_accesses_json, 'SECRET'))
+
+    def test_decision_cache_bounded(self):
+        self.access_control_instance.decision_cache.maxsize = 2
+        user_accesses_json = json.dumps({"clearances": ["SECRET"]})
+        for marking in ['SECRET', 'SECRET//A', 'SECRET//B']:
+            self.access_control_instance.future_has_access(user_accesses_json, marking)
+        self.assertEqual(len(self.access_control_instance.decision_cache), 2)
+
+    def test_encode_marking(self):
+        self.assertEqual(self.access_control_instance.encode_marking('UNCLASSIFIED'), (1, 0))
+        self.assertEqual(self.access_control_instance.encode_marking('S//FOUO'), (3, 1))
+        self.assertEqual(self.access_control_instance.encode_marking('TOP SECRET//FOR OFFICIAL USE ONLY'), (4, 1))
+        # not representable as integers
+        self.assertEqual(self.access_control_instance.encode_marking('SECRET//ABC'), (None, None))
+        self.assertEqual(self.access_control_instance.encode_marking('INVALID LEVEL'), (None, None))
+        self.assertEqual(self.access_control_instance.encode_marking(None), (None, None))
+
+    def test_encode_user_accesses(self):
+        user_accesses_json = json.dumps(
+            {
+                "clearances": ["UNCLASSIFIED", "CONFIDENTIAL"],
+                "formal_accesses": ["FOUO", "ABC"],
+                "visas": []
+            }
+        )
+        self.assertEqual(self.access_control_instance.encode_user_accesses(user_accesses_json), (2, 1))
+        self.assertEqual(self.access_control_instance.encode_user_accesses('{"clearances": ["TS"]}'), (4, 0))
+        self.assertEqual(self.access_control_instance.encode_user_accesses('not json'), (None, None))
+
+    def test_has_access_encoded(self):
+        user_level, user_mask = self.access_control_instance.encode_user_accesses(
+            json.dumps({"clearances": ["SECRET"], "formal_accesses": [], "visas": ["FOUO"]}))
+
+        for marking, expected in [('UNCLASSIFIED', True), ('SECRET//FOUO', True),
+                                  ('TOP SECRET', False), ('TOP SECRET//FOUO', False)]:
+            level, mask = self.access_control_instance.encode_marking(marking)
+            self.assertEqual(self.access_control_instance.has_access_encoded(user_level, user_mask, level, mask), expected)
+
+    def test_has_access_many(self):
+        markings = ['UNCLASSIFIED', 'SECRET', 'UNCLASSIFIED', None]
+        checked = []
+
+        def has_access(user_accesses_json, marking):
+            checked.append(marking)
+            return marking == 'UNCLASSIFIED'
+
+        self.access_control_instance.has_access = has_access
+        decisions = self.access_control_instance.has_access_many('{}', markings)
+        self.assertEqual(decisions, [True, False, True, False])
+        # identical markings are only checked once
+        self.assertEqual(len(checked), 3)
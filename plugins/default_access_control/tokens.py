@@ -43,6 +43,8 @@ class ClassificationToken(Token):
 
 class DisseminationControlToken(Token):
 
-    def __init__(self, **kwargs):
+    def __init__(self, bit=None, **kwargs):
         super(DisseminationControlToken, self).__init__(**kwargs)
         self.token_type = 'DisseminationControlToken'
+        # position of this control in access control bitmasks
+        self.bit = bit
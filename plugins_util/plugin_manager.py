@@ -204,5 +204,31 @@ def get_system_access_control_plugin():
     return plugin_manager_instance.get_plugin_instance(ACCESS_CONTROL_PLUGIN)
 
 
+def has_access_many(access_control_instance, user_accesses_json, markings):
+    """
+    Check one user's access to many markings at once
+
+    Uses the plugin's has_access_many if it implements one (e.g. to make a
+    single request to an external service), otherwise falls back to calling
+    has_access once per distinct marking
+
+    Args:
+        access_control_instance: access control plugin instance
+        user_accesses_json (string): user accesses in json
+        markings (list): security markings
+
+    Returns:
+        list of booleans, one decision per marking (in order)
+    """
+    if hasattr(access_control_instance, 'has_access_many'):
+        return access_control_instance.has_access_many(user_accesses_json, markings)
+
+    decisions = {}
+    for marking in markings:
+        if marking not in decisions:
+            decisions[marking] = access_control_instance.has_access(user_accesses_json, marking)
+    return [decisions[marking] for marking in markings]
+
+
 def get_system_authorization_plugin():
     return plugin_manager_instance.get_plugin_instance(AUTHORIZATION_PLUGIN)
@@ -6,6 +6,8 @@ import os
 from django.conf import settings
 from django.test import TestCase
 
+from plugins_util import plugin_manager
+
 # from plugins_util.plugin_manager import dynamic_directory_importer
 # from plugins_util.plugin_manager import dynamic_importer
 # from plugins_util.plugin_manager import dynamic_mock_service_importer
@@ -40,6 +42,26 @@ class PluginManagerTest(TestCase):
         """
         # data_gen.run()
 
+    def test_has_access_many_fallback(self):
+        """
+        Plugins that only implement has_access are called once per distinct
+        marking
+        """
+        class SingleAccessControlPlugin(object):
+
+            def __init__(self):
+                self.checked = []
+
+            def has_access(self, user_accesses_json, marking):
+                self.checked.append(marking)
+                return marking != 'SECRET'
+
+        access_control_instance = SingleAccessControlPlugin()
+        markings = ['UNCLASSIFIED', 'SECRET', 'UNCLASSIFIED', 'SECRET']
+        decisions = plugin_manager.has_access_many(access_control_instance, '{}', markings)
+        self.assertEqual(decisions, [True, False, True, False])
+        self.assertEqual(access_control_instance.checked, ['UNCLASSIFIED', 'SECRET'])
+
     # TODO FINISH UNIT TEST
     # def test_invalid_auth_cache(self):
     #     """
@@ -44,7 +44,8 @@ packages = ['ozp', 'ozpcenter', 'ozpcenter.api', 'ozpcenter.scripts',
             'ozpcenter.api.image', 'ozpcenter.api.intent',
             'ozpcenter.api.library', 'ozpcenter.api.listing',
             'ozpcenter.api.notification', 'ozpcenter.api.profile',
-            'ozpcenter.api.storefront', 'ozpiwc', 'ozpiwc.migrations',
+            'ozpcenter.api.storefront', 'ozpcenter.management',
+            'ozpcenter.management.commands', 'ozpiwc', 'ozpiwc.migrations',
             'ozpiwc.api', 'ozpiwc.api.data',
             'ozpiwc.api.intent', 'ozpiwc.api.names', 'ozpiwc.api.system']
 package_data = {'': ['README.md', 'static']}